@@ -2,11 +2,154 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from price_store import get_store
+from indicators import RollingMean, rolling_means
+from sweep import parameter_grid
+from trade_ledger import TradeLedger, ConsoleSink, BUY, SELL, CLOSE
 
 plt.style.use("seaborn")
 plt.rcParams["font.family"] = 'serif'
 
 
+class Account(object):
+    """
+    빠른 엔진 (engine='numpy')이 봉마다 갱신하는 계좌 상태.
+    __slots__로 속성 접근 비용을 줄이고, 주문은 출력하지 않고 ledger에 기록해 두었다가
+    백테스트가 끝난 뒤 한 번에 날짜를 붙여 출력한다.
+    주문 계산은 BacktestBase.place_buy_order, place_sell_order와 같은 순서로 해서 결과가 같다.
+
+    속성
+    amount: float
+        현재 잔고
+    units: int
+        보유 단위 (숏이면 음수)
+    position: int
+        현재 포지션 (1, 0, -1)
+    trades: int
+        거래 횟수
+    ledger: TradeLedger
+        주문 기록
+    """
+    __slots__ = ("amount", "units", "position", "trades", "ftc", "ptc", "ledger")
+
+    def __init__(self, amount, ftc, ptc, units=0, ledger=None):
+        self.amount = amount
+        self.units = units
+        self.position = 0
+        self.trades = 0
+        self.ftc = ftc
+        self.ptc = ptc
+        self.ledger = ledger if ledger is not None else TradeLedger()
+
+    def buy(self, bar, price, units=None, amount=None):
+        if units is None:
+            units = int(amount / price)
+        self.amount -= (units * price) * (1 + self.ptc) + self.ftc
+        self.units += units
+        self.trades += 1
+        self.ledger.append(bar, BUY, units, price, (units * price) * self.ptc + self.ftc,
+                           self.amount, self.units * price + self.amount)
+
+    def sell(self, bar, price, units=None, amount=None):
+        if units is None:
+            units = int(amount / price)
+        self.amount += (units * price) * (1 - self.ptc) - self.ftc
+        self.units -= units
+        self.trades += 1
+        self.ledger.append(bar, SELL, units, price, (units * price) * self.ptc + self.ftc,
+                           self.amount, self.units * price + self.amount)
+
+    def go_long(self, bar, price, units=None, amount=None):
+        """BacktestLongShort.go_long과 같은 주문을 낸다."""
+        if self.position == 1:
+            self.buy(bar, price, units=-self.units)
+        if units:
+            self.buy(bar, price, units=units)
+        elif amount:
+            if amount == 'all':
+                amount = self.amount
+            self.buy(bar, price, amount=amount)
+
+    def go_short(self, bar, price, units=None, amount=None):
+        """BacktestLongShort.go_short와 같은 주문을 낸다."""
+        if self.position == 1:
+            self.sell(bar, price, units=-self.units)
+        if units:
+            self.sell(bar, price, units=units)
+        elif amount:
+            if amount == 'all':
+                amount = self.amount
+            self.sell(bar, price, amount=amount)
+
+
+class AccountArray(object):
+    """
+    run_lockstep이 파라미터 조합마다 하나씩 두는 계좌 상태 벡터.
+    주문은 마스크로 고른 조합에만 적용하고, 단위 계산 (int(amount / price))과 거래 비용은
+    Account와 같은 순서의 float64 연산이라 조합별 결과가 단일 실행과 같다.
+
+    속성
+    amount: np.ndarray
+        조합별 현재 잔고
+    units: np.ndarray
+        조합별 보유 단위
+    position: np.ndarray
+        조합별 현재 포지션 (1, 0, -1)
+    trades: np.ndarray
+        조합별 거래 횟수
+    """
+    __slots__ = ("amount", "units", "position", "trades", "ftc", "ptc")
+
+    def __init__(self, size, amount, ftc, ptc):
+        self.amount = np.full(size, float(amount))
+        self.units = np.zeros(size, dtype=np.int64)
+        self.position = np.zeros(size, dtype=np.int64)
+        self.trades = np.zeros(size, dtype=np.int64)
+        self.ftc = ftc
+        self.ptc = ptc
+
+    def _units(self, mask, price, units, amount):
+        if units is None:
+            # int()와 같이 0 쪽으로 버린다.
+            units = np.trunc(np.broadcast_to(amount, mask.shape)[mask] / price)
+            return units.astype(np.int64)
+        return np.broadcast_to(units, mask.shape)[mask]
+
+    def buy(self, mask, price, units=None, amount=None):
+        if not mask.any():
+            return
+        units = self._units(mask, price, units, amount)
+        self.amount[mask] -= (units * price) * (1 + self.ptc) + self.ftc
+        self.units[mask] += units
+        self.trades[mask] += 1
+
+    def sell(self, mask, price, units=None, amount=None):
+        if not mask.any():
+            return
+        units = self._units(mask, price, units, amount)
+        self.amount[mask] += (units * price) * (1 - self.ptc) - self.ftc
+        self.units[mask] -= units
+        self.trades[mask] += 1
+
+    def go_long(self, mask, price, amount):
+        """BacktestLongShort.go_long(bar, amount=amount)와 같은 주문을 낸다."""
+        if not mask.any():
+            return
+        self.buy(mask & (self.position == 1), price, units=-self.units)
+        if isinstance(amount, str) and amount == 'all':
+            amount = self.amount
+        self.buy(mask & (np.broadcast_to(amount, mask.shape) != 0), price, amount=amount)
+
+    def go_short(self, mask, price, amount):
+        """BacktestLongShort.go_short(bar, amount=amount)와 같은 주문을 낸다."""
+        if not mask.any():
+            return
+        self.sell(mask & (self.position == 1), price, units=-self.units)
+        if isinstance(amount, str) and amount == 'all':
+            amount = self.amount
+        self.sell(mask & (np.broadcast_to(amount, mask.shape) != 0), price, amount=amount)
+
+
 class BacktestBase(object):
     """
     속성
@@ -22,6 +165,16 @@ class BacktestBase(object):
            거래당 고정 거래 비용 
        ptc: float 
             거래당 비례 거래비용
+       engine: str
+            'pandas'면 봉마다 데이터프레임에서 값을 읽고, 'numpy'면 가격과 지표 열을 배열로
+            꺼내 Account로 실행한다. 'event'면 포지션별 주문 조건을 벡터로 계산해서 주문이
+            날 수 있는 봉에서만 같은 처리를 한다 (세 엔진의 거래와 출력은 같다).
+            'numpy'와 'event'는 봉별 순자산을 self.net_wealths에 남긴다.
+       sink: object
+            콘솔 출력을 받을 write(줄), flush() 객체 (None이면 ConsoleSink).
+            출력은 모아 두었다가 close_out이 끝날 때 한 번에 쓴다.
+       ledger: TradeLedger
+            거래마다 (봉, 매수/매도/청산, 단위, 가격, 비용, 잔고, 순자산)을 기록한다.
 
        =======
        get_data:
@@ -40,9 +193,18 @@ class BacktestBase(object):
             매도 주문을 넣는다.
        close_out:
             롱 포지셔이나 숏 포지션을 닫는다.
+       get_ledger:
+            마지막 백테스트의 거래 기록을 데이터프레임으로 반환한다.
+       add_indicator:
+            스트리밍 지표로 데이터 열을 계산하고 지표 상태를 보관한다.
+       run_lockstep:
+            여러 파라미터 조합의 이벤트 기반 백테스트를 봉마다 함께 진행한다.
     """
 
-    def __init__(self, symbol, start, end, amount, ftc=0., ptc=0.0, verbose=True):
+    def __init__(self, symbol, start, end, amount, ftc=0., ptc=0.0, verbose=True,
+                 engine="pandas", sink=None):
+        if engine not in ("pandas", "numpy", "event"):
+            raise ValueError("Engine not known or not yet implemented.")
         self.symbol = symbol
         self.start = start
         self.end = end
@@ -54,17 +216,26 @@ class BacktestBase(object):
         self.position = 0
         self.trades = 0
         self.verbose = verbose
+        self.engine = engine
+        self.indicators = {}
+        self.sink = sink if sink is not None else ConsoleSink()
+        self.ledger = TradeLedger()
         self.get_data()
 
     def get_data(self):
-        raw = pd.read_csv("http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-                          index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start: self.end]
+        raw = get_store().get_frame(self.symbol, self.start, self.end, copy=False)
         raw.rename(columns={self.symbol: 'price'}, inplace=True)
         raw["return"] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
 
+    def add_indicator(self, column, indicator, source="price"):
+        """
+        source 열 전체에 indicator.batch를 실행해 column 열로 두고, 새 봉을 이어 붙일 때
+        update로 이어서 계산할 수 있도록 지표 객체를 self.indicators에 보관한다.
+        """
+        self.data[column] = indicator.batch(self.data[source].values)
+        self.indicators[column] = indicator
+
     def plot_data(self, cols=None):
         if cols is None:
             cols = ["price"]
@@ -77,50 +248,177 @@ class BacktestBase(object):
 
     def print_balance(self, bar):
         date, price = self.get_data_price(bar)
-        print(f"{date} | current balance {self.amount:.2f}")
+        self.sink.write(f"{date} | current balance {self.amount:.2f}")
+        self.sink.flush()
 
     def print_net_wealth(self, bar):
         date, price = self.get_data_price(bar)
         net_wealth = self.units * price + self.amount
-        print(f"{date} | current net wealth {net_wealth:.2f}")
+        self.sink.write(f"{date} | current net wealth {net_wealth:.2f}")
+        self.sink.flush()
+
+    def _log_order(self, bar, side, units, price, net_wealth):
+        """place_*_order의 주문, 잔고, 순자산 줄을 출력 버퍼에 쓴다 (verbose일 때만 부른다)."""
+        date = str(self.data.index[bar])[:10]
+        self.sink.write(f"{date} | {side} {units} units at {price:.2f}")
+        self.sink.write(f"{date} | current balance {self.amount:.2f}")
+        self.sink.write(f"{date} | current net wealth {net_wealth:.2f}")
 
     def place_buy_order(self, bar, units=None, amount=None):
-        date, price = self.get_data_price(bar)
+        price = self.data.price.iloc[bar]
         if units is None:
             units = int(amount / price)
         self.amount -= (units * price) * (1 + self.ptc) + self.ftc
         self.units += units
         self.trades += 1
+        net_wealth = self.units * price + self.amount
+        self.ledger.append(bar, BUY, units, price, (units * price) * self.ptc + self.ftc,
+                           self.amount, net_wealth)
         if self.verbose:
-            print(f"{date} | selling {units} units at {price:.2f}")
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+            self._log_order(bar, "buying", units, price, net_wealth)
 
     def place_sell_order(self, bar, units=None, amount=None):
-        date, price = self.get_data_price(bar)
+        price = self.data.price.iloc[bar]
         if units is None:
             units = int(amount / price)
         self.amount += (units * price) * (1 - self.ptc) - self.ftc
         self.units -= units
         self.trades += 1
+        net_wealth = self.units * price + self.amount
+        self.ledger.append(bar, SELL, units, price, (units * price) * self.ptc + self.ftc,
+                           self.amount, net_wealth)
         if self.verbose:
-            print(f"{date} | selling {units} units at {price:.2f}")
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+            self._log_order(bar, "selling", units, price, net_wealth)
 
     def close_out(self, bar):
         date, price = self.get_data_price(bar)
+        inventory = self.units
         self.amount += self.units * price
         self.units = 0
         self.trades += 1
+        self.ledger.append(bar, CLOSE, inventory, price, 0., self.amount, self.amount)
         if self.verbose:
-            print(f"{date} | inventory {self.units} units at {price:.2f}")
-            print("=" * 55)
-        print("Final balance [$] {:.2f}".format(self.amount))
+            self.sink.write(f"{date} | inventory {self.units} units at {price:.2f}")
+            self.sink.write("=" * 55)
+        self.sink.write("Final balance [$] {:.2f}".format(self.amount))
         perf = ((self.amount - self.initial_amount) / self.initial_amount * 100)
-        print("Net Performance [%] {:.2f}".format(perf))
-        print("Trades Executed [#] {:.2f}".format(self.trades))
-        print("=" * 55)
+        self.sink.write("Net Performance [%] {:.2f}".format(perf))
+        self.sink.write("Trades Executed [#] {:.2f}".format(self.trades))
+        self.sink.write("=" * 55)
+        self.sink.flush()
+
+    def get_ledger(self):
+        """
+        :return: pd.DataFrame
+            거래가 난 봉의 날짜를 인덱스로 한 거래 기록 (TradeLedger.to_frame)
+        """
+        return self.ledger.to_frame(self.data.index)
+
+    def run_lockstep(self, strategy, grid):
+        """
+        파라미터 조합마다 계좌 상태 (잔고, 단위, 포지션, 거래 횟수)를 하나씩 두고,
+        모든 조합을 봉마다 마스크 연산으로 함께 진행한다. 조합별 결과는 같은 파라미터로
+        run_{strategy}_strategy를 실행한 뒤의 최종 잔고, 거래 횟수와 같다.
+        :param strategy: str
+            'sma', 'momentum', 'mean_reversion'
+        :param grid: list 또는 dict
+            파라미터 딕셔너리의 목록, 또는 parameter_grid에 넘길 {이름: 값 목록}
+            (예: {'SMA1': [20, 42], 'SMA2': [200, 252]})
+        :return: pd.DataFrame
+            조합별 파라미터와 최종 잔고 (amount), 성과 [%] (performance), 거래 횟수 (trades)
+        """
+        if strategy not in ("sma", "momentum", "mean_reversion"):
+            raise ValueError("Strategy not known or not yet implemented.")
+        if isinstance(grid, dict):
+            grid = parameter_grid(**grid)
+        params = pd.DataFrame(grid)
+        price = self.data["price"].values
+        account = AccountArray(len(params), self.initial_amount, self.ftc, self.ptc)
+        getattr(self, f"_lockstep_{strategy}")(account, params, price)
+        # close_out과 같이 마지막 봉에서 남은 단위를 정리한다.
+        account.amount += account.units * price[-1]
+        account.units[:] = 0
+        account.trades += 1
+        results = params.copy()
+        results["amount"] = account.amount
+        results["performance"] = (account.amount - self.initial_amount) / self.initial_amount * 100
+        results["trades"] = account.trades
+        return results
+
+    def _rolling_means(self, column, windows):
+        """조합별 시간 창의 이동 평균을 (봉, 조합) 형태로 만든다 (RollingMean.batch와 같은 값)."""
+        windows = np.asarray(windows, dtype=int)
+        unique = np.unique(windows)
+        means = rolling_means(self.data[column].values, unique)
+        return np.ascontiguousarray(means[np.searchsorted(unique, windows)].T)
+
+    def _active(self, first, n):
+        """조합별 루프가 시작하는 봉 (first) 이후면 True인 (봉, 조합) 마스크"""
+        return np.arange(n)[:, None] >= np.asarray(first)[None, :]
+
+    def _arrays(self, *columns):
+        """빠른 엔진이 쓸 열들을 파이썬 float 리스트로 꺼낸다 (봉마다 .iloc를 부르지 않도록)."""
+        return [self.data[column].values.tolist() for column in columns]
+
+    def _account(self):
+        return Account(self.initial_amount, self.ftc, self.ptc, self.units, self.ledger)
+
+    def _run_fast(self, start, triggers, step):
+        """
+        step(account, bar)를 'numpy' 엔진이면 start 이후 모든 봉에서, 'event' 엔진이면
+        현재 포지션의 주문 조건 (triggers[포지션], 봉별 bool 배열)이 참인 봉에서만 실행한다.
+        조건이 거짓인 봉에서 step은 아무것도 하지 않으므로 두 엔진의 주문은 같다.
+        """
+        account = self._account()
+        n = len(self.data)
+        initial = (account.amount, account.units)
+        if self.engine == "event":
+            events = {position: np.flatnonzero(trigger) for position, trigger in triggers.items()}
+            bar = start
+            while True:
+                candidates = events[account.position]
+                i = np.searchsorted(candidates, bar)
+                if i == len(candidates):
+                    break
+                bar = int(candidates[i])
+                step(account, bar)
+                bar += 1
+        else:
+            for bar in range(start, n):
+                step(account, bar)
+        self._net_wealths(account, initial, start, n)
+        self._finish(account, n - 1)
+
+    def _net_wealths(self, account, initial, start, n):
+        """
+        주문 사이에는 잔고와 단위가 바뀌지 않으므로 봉별 순자산 (units * price + amount)을
+        주문 기록에서 한 번에 채운다.
+        """
+        price = self.data["price"].values[start:n]
+        records = account.ledger.records
+        amounts = np.concatenate(([initial[0]], records["balance"]))
+        units = initial[1] + np.concatenate(([0], np.cumsum(records["side"] * records["units"])))
+        last = np.searchsorted(records["bar"], np.arange(start, n), side="right")
+        self.net_wealths = pd.DataFrame({"net_wealth": units[last] * price + amounts[last]},
+                                        index=self.data.index[start:n])
+
+    def _finish(self, account, bar):
+        """
+        빠른 엔진의 계좌 상태를 객체로 옮기고, 기록해 둔 주문을 place_*_order와 같은 형식으로
+        출력한 뒤 close_out 한다. 날짜 문자열은 여기서 주문이 있던 봉에 대해서만 만든다.
+        """
+        self.amount = account.amount
+        self.units = account.units
+        self.position = account.position
+        self.trades = account.trades
+        if self.verbose:
+            sides = {BUY: "buying", SELL: "selling"}
+            for order_bar, side, units, price, _, amount, net_wealth in account.ledger.records.tolist():
+                date = str(self.data.index[order_bar])[:10]
+                self.sink.write(f"{date} | {sides[side]} {units} units at {price:.2f}")
+                self.sink.write(f"{date} | current balance {amount:.2f}")
+                self.sink.write(f"{date} | current net wealth {net_wealth:.2f}")
+        self.close_out(bar)
 
 
 # 이벤트 기반 백테스트를 위한 롱 전용 클래스
@@ -137,13 +435,16 @@ class BacktestLongOnly(BacktestBase):
         msg = f'\n\nRunning SMA strategy | SMA1={SMA1} & SMA2={SMA2}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
-        self.data["SMA1"] = self.data["price"].rolling(SMA1).mean()
-        self.data["SMA2"] = self.data["price"].rolling(SMA2).mean()
+        self.add_indicator("SMA1", RollingMean(SMA1))
+        self.add_indicator("SMA2", RollingMean(SMA2))
+        if self.engine != "pandas":
+            return self._run_fast(*self._sma_rules(SMA1, SMA2))
 
         for bar in range(SMA2, len(self.data)):
             if self.position == 0:
@@ -154,7 +455,7 @@ class BacktestLongOnly(BacktestBase):
                 if self.data["SMA1"].iloc[bar] < self.data["SMA2"].iloc[bar]:
                     self.place_sell_order(bar, amount=self.amount)
                     self.position = 0  # 중립 포지션
-            self.close_out(bar)
+        self.close_out(bar)
 
     def run_momentum_strategy(self, momentum):
         """
@@ -166,12 +467,15 @@ class BacktestLongOnly(BacktestBase):
         msg = f'\n\nRunning momentum strategy | {momentum} days'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
-        self.data["momentum"] = self.data["return"].rolling(momentum).mean()
+        self.add_indicator("momentum", RollingMean(momentum), source="return")
+        if self.engine != "pandas":
+            return self._run_fast(*self._momentum_rules(momentum))
         for bar in range(momentum, len(self.data)):
             if self.position == 0:
                 if self.data['momentum'].iloc[bar] > 0:
@@ -181,7 +485,7 @@ class BacktestLongOnly(BacktestBase):
                 if self.data['momentum'].iloc[bar] < 0:
                     self.place_sell_order(bar, amount=self.amount)
                     self.position = 0
-            self.close_out(bar)
+        self.close_out(bar)
 
     def run_mean_reversion_strategy(self, SMA, threshold):
         """
@@ -195,12 +499,15 @@ class BacktestLongOnly(BacktestBase):
         msg = f'\n\nRunning mean reversion strategy | SMA={SMA} & thr={threshold}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
-        self.data["SMA"] = self.data["price"].rolling(SMA).mean()
+        self.add_indicator("SMA", RollingMean(SMA))
+        if self.engine != "pandas":
+            return self._run_fast(*self._mean_reversion_rules(SMA, threshold))
 
         for bar in range(SMA, len(self.data)):
             if self.position == 0:
@@ -211,7 +518,99 @@ class BacktestLongOnly(BacktestBase):
                 if self.data['price'].iloc[bar] >= self.data["SMA"].iloc[bar]:
                     self.place_sell_order(bar, amount=self.amount)
                     self.position = 0
-            self.close_out(bar)
+        self.close_out(bar)
+
+    def _lockstep_sma(self, account, params, price):
+        sma1 = self._rolling_means("price", params["SMA1"])
+        sma2 = self._rolling_means("price", params["SMA2"])
+        first = params["SMA2"].values
+        active = self._active(first, len(price))
+        buy_signal = active & (sma1 > sma2)
+        sell_signal = active & (sma1 < sma2)
+        for bar in range(first.min(), len(price)):
+            buy = buy_signal[bar] & (account.position == 0)
+            sell = sell_signal[bar] & (account.position == 1)
+            account.buy(buy, price[bar], amount=account.amount)
+            account.position[buy] = 1
+            account.sell(sell, price[bar], amount=account.amount)
+            account.position[sell] = 0
+
+    def _lockstep_momentum(self, account, params, price):
+        mom = self._rolling_means("return", params["momentum"])
+        first = params["momentum"].values
+        active = self._active(first, len(price))
+        buy_signal = active & (mom > 0)
+        sell_signal = active & (mom < 0)
+        for bar in range(first.min(), len(price)):
+            buy = buy_signal[bar] & (account.position == 0)
+            sell = sell_signal[bar] & (account.position == 1)
+            account.buy(buy, price[bar], amount=account.amount)
+            account.position[buy] = 1
+            account.sell(sell, price[bar], amount=account.amount)
+            account.position[sell] = 0
+
+    def _lockstep_mean_reversion(self, account, params, price):
+        sma = self._rolling_means("price", params["SMA"])
+        threshold = params["threshold"].values
+        first = params["SMA"].values
+        active = self._active(first, len(price))
+        buy_signal = active & (price[:, None] < sma - threshold)
+        sell_signal = active & (price[:, None] >= sma)
+        for bar in range(first.min(), len(price)):
+            buy = buy_signal[bar] & (account.position == 0)
+            sell = sell_signal[bar] & (account.position == 1)
+            account.buy(buy, price[bar], amount=account.amount)
+            account.position[buy] = 1
+            account.sell(sell, price[bar], amount=account.amount)
+            account.position[sell] = 0
+
+    def _sma_rules(self, SMA1, SMA2):
+        """run_sma_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, sma1, sma2 = self._arrays("price", "SMA1", "SMA2")
+        SMA1_, SMA2_ = self.data["SMA1"].values, self.data["SMA2"].values
+
+        def step(account, bar):
+            if account.position == 0:
+                if sma1[bar] > sma2[bar]:
+                    account.buy(bar, price[bar], amount=account.amount)
+                    account.position = 1
+            elif account.position == 1:
+                if sma1[bar] < sma2[bar]:
+                    account.sell(bar, price[bar], amount=account.amount)
+                    account.position = 0
+        return SMA2, {0: SMA1_ > SMA2_, 1: SMA1_ < SMA2_}, step
+
+    def _momentum_rules(self, momentum):
+        """run_momentum_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, mom = self._arrays("price", "momentum")
+        mom_ = self.data["momentum"].values
+
+        def step(account, bar):
+            if account.position == 0:
+                if mom[bar] > 0:
+                    account.buy(bar, price[bar], amount=account.amount)
+                    account.position = 1
+            elif account.position == 1:
+                if mom[bar] < 0:
+                    account.sell(bar, price[bar], amount=account.amount)
+                    account.position = 0
+        return momentum, {0: mom_ > 0, 1: mom_ < 0}, step
+
+    def _mean_reversion_rules(self, SMA, threshold):
+        """run_mean_reversion_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, sma = self._arrays("price", "SMA")
+        price_, sma_ = self.data["price"].values, self.data["SMA"].values
+
+        def step(account, bar):
+            if account.position == 0:
+                if price[bar] < sma[bar] - threshold:
+                    account.buy(bar, price[bar], amount=account.amount)
+                    account.position = 1
+            elif account.position == 1:
+                if price[bar] >= sma[bar]:
+                    account.sell(bar, price[bar], amount=account.amount)
+                    account.position = 0
+        return SMA, {0: price_ < sma_ - threshold, 1: price_ >= sma_}, step
 
 
 class BacktestLongShort(BacktestBase):
@@ -247,13 +646,16 @@ class BacktestLongShort(BacktestBase):
         msg = f'\n\nRunning SMA strategy | SMA1={SMA1} & SMA2={SMA2}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
-        self.data["SMA1"] = self.data["price"].rolling(SMA1).mean()
-        self.data["SMA2"] = self.data["price"].rolling(SMA2).mean()
+        self.add_indicator("SMA1", RollingMean(SMA1))
+        self.add_indicator("SMA2", RollingMean(SMA2))
+        if self.engine != "pandas":
+            return self._run_fast(*self._sma_rules(SMA1, SMA2))
 
         for bar in range(SMA2, len(self.data)):
             if self.position in [0, -1]:
@@ -265,7 +667,7 @@ class BacktestLongShort(BacktestBase):
                 if self.data["SMA1"].iloc[bar] < self.data["SMA2"].iloc[bar]:
                     self.go_short(bar, amount='all')
                     self.position = -1  # 숏 포지션
-            self.close_out(bar)
+        self.close_out(bar)
 
     def run_momentum_strategy(self, momentum):
         """
@@ -277,13 +679,16 @@ class BacktestLongShort(BacktestBase):
         msg = f'\n\nRunning momentum strategy | {momentum} days'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
 
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
-        self.data["momentum"] = self.data["return"].rolling(momentum).mean()
+        self.add_indicator("momentum", RollingMean(momentum), source="return")
+        if self.engine != "pandas":
+            return self._run_fast(*self._momentum_rules(momentum))
 
         for bar in range(momentum, len(self.data)):
             if self.position in [0, -1]:
@@ -295,7 +700,7 @@ class BacktestLongShort(BacktestBase):
                 if self.data['momentum'].iloc[bar] <= 0:
                     self.go_short(bar, amount='all')
                     self.position = -1
-            self.close_out(bar)
+        self.close_out(bar)
 
     def run_mean_reversion_strategy(self, SMA, threshold):
         """
@@ -309,13 +714,16 @@ class BacktestLongShort(BacktestBase):
         msg = f'\n\nRunning mean reversion strategy | SMA={SMA} & thr={threshold}'
         msg += f'\nfixed costs {self.ftc} | '
         msg += f'proportional costs {self.ptc}'
-        print(msg)
-        print("=" * 55)
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
         self.position = 0  # 초기 뉴트럴 포지션
         self.trades = 0  # 아직 거래 없음
+        self.ledger.reset()
         self.amount = self.initial_amount  # 초기 금액을 재설정
 
-        self.data["SMA"] = self.data["price"].rolling(SMA).mean()
+        self.add_indicator("SMA", RollingMean(SMA))
+        if self.engine != "pandas":
+            return self._run_fast(*self._mean_reversion_rules(SMA, threshold))
 
         for bar in range(SMA, len(self.data)):
             if self.position == 0:
@@ -337,4 +745,115 @@ class BacktestLongShort(BacktestBase):
                     self.place_buy_order(bar, units=-self.units)
                     self.position = 0
 
-            self.close_out(bar)
+        self.close_out(bar)
+
+    def _lockstep_sma(self, account, params, price):
+        sma1 = self._rolling_means("price", params["SMA1"])
+        sma2 = self._rolling_means("price", params["SMA2"])
+        first = params["SMA2"].values
+        active = self._active(first, len(price))
+        long_signal = active & (sma1 > sma2)
+        short_signal = active & (sma1 < sma2)
+        for bar in range(first.min(), len(price)):
+            # run_sma_strategy의 if/elif와 같이 봉이 시작할 때의 포지션으로 분기를 정한다.
+            long = long_signal[bar] & (account.position <= 0)
+            short = short_signal[bar] & (account.position == 1)
+            account.go_long(long, price[bar], amount='all')
+            account.position[long] = 1
+            account.go_short(short, price[bar], amount='all')
+            account.position[short] = -1
+
+    def _lockstep_momentum(self, account, params, price):
+        mom = self._rolling_means("return", params["momentum"])
+        first = params["momentum"].values
+        active = self._active(first, len(price))
+        long_signal = active & (mom > 0)
+        short_signal = active & (mom <= 0)
+        for bar in range(first.min(), len(price)):
+            long = long_signal[bar] & (account.position <= 0)
+            short = short_signal[bar] & (account.position == 1)
+            account.go_long(long, price[bar], amount='all')
+            account.position[long] = 1
+            account.go_short(short, price[bar], amount='all')
+            account.position[short] = -1
+
+    def _lockstep_mean_reversion(self, account, params, price):
+        sma = self._rolling_means("price", params["SMA"])
+        threshold = params["threshold"].values
+        first = params["SMA"].values
+        active = self._active(first, len(price))
+        long_signal = active & (price[:, None] < sma - threshold)
+        short_signal = active & ~long_signal & (price[:, None] > sma + threshold)
+        exit_long_signal = active & (price[:, None] >= sma)
+        exit_short_signal = active & (price[:, None] <= sma)
+        for bar in range(first.min(), len(price)):
+            neutral = account.position == 0
+            long = long_signal[bar] & neutral
+            short = short_signal[bar] & neutral
+            exit_long = exit_long_signal[bar] & (account.position == 1)
+            exit_short = exit_short_signal[bar] & (account.position == -1)
+            account.go_long(long, price[bar], amount=self.initial_amount)
+            account.go_short(short, price[bar], amount=self.initial_amount)
+            account.sell(exit_long, price[bar], units=account.units)
+            account.buy(exit_short, price[bar], units=-account.units)
+            account.position[long] = 1
+            account.position[short] = -1
+            account.position[exit_long | exit_short] = 0
+
+    def _sma_rules(self, SMA1, SMA2):
+        """run_sma_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, sma1, sma2 = self._arrays("price", "SMA1", "SMA2")
+        SMA1_, SMA2_ = self.data["SMA1"].values, self.data["SMA2"].values
+
+        def step(account, bar):
+            if account.position in [0, -1]:
+                if sma1[bar] > sma2[bar]:
+                    account.go_long(bar, price[bar], amount='all')
+                    account.position = 1
+            elif account.position in [0, 1]:
+                if sma1[bar] < sma2[bar]:
+                    account.go_short(bar, price[bar], amount='all')
+                    account.position = -1
+        long = SMA1_ > SMA2_
+        return SMA2, {0: long, -1: long, 1: SMA1_ < SMA2_}, step
+
+    def _momentum_rules(self, momentum):
+        """run_momentum_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, mom = self._arrays("price", "momentum")
+        mom_ = self.data["momentum"].values
+
+        def step(account, bar):
+            if account.position in [0, -1]:
+                if mom[bar] > 0:
+                    account.go_long(bar, price[bar], amount="all")
+                    account.position = 1
+            elif account.position in [0, 1]:
+                if mom[bar] <= 0:
+                    account.go_short(bar, price[bar], amount='all')
+                    account.position = -1
+        return momentum, {0: mom_ > 0, -1: mom_ > 0, 1: mom_ <= 0}, step
+
+    def _mean_reversion_rules(self, SMA, threshold):
+        """run_mean_reversion_strategy의 (시작 봉, 포지션별 주문 조건, 봉 처리 함수)"""
+        price, sma = self._arrays("price", "SMA")
+        price_, sma_ = self.data["price"].values, self.data["SMA"].values
+
+        def step(account, bar):
+            if account.position == 0:
+                if price[bar] < sma[bar] - threshold:
+                    account.go_long(bar, price[bar], amount=self.initial_amount)
+                    account.position = 1
+                elif price[bar] > sma[bar] + threshold:
+                    account.go_short(bar, price[bar], amount=self.initial_amount)
+                    account.position = -1
+            elif account.position == 1:
+                if price[bar] >= sma[bar]:
+                    account.sell(bar, price[bar], units=account.units)
+                    account.position = 0
+            elif account.position == -1:
+                if price[bar] <= sma[bar]:
+                    account.buy(bar, price[bar], units=-account.units)
+                    account.position = 0
+        triggers = {0: (price_ < sma_ - threshold) | (price_ > sma_ + threshold),
+                    1: price_ >= sma_, -1: price_ <= sma_}
+        return SMA, triggers, step
@@ -1,8 +1,9 @@
 # Event Based Backtesting
 # --Base class (1)
+from trade_ledger import TradeLedger, ConsoleSink, BUY, SELL, CLOSE
 
 class BacktestBase:
-    def __init__(self, env, model, amount, ftc, ptc, verbose=False):
+    def __init__(self, env, model, amount, ftc, ptc, verbose=False, sink=None):
         self.env = env
         self.model = model
         self.initial_amount = amount
@@ -12,6 +13,10 @@ class BacktestBase:
         self.verbose = verbose
         self.units = 0  # 초기 포트폴리오의 수단으로 삼은것의 단위 (주식수)
         self.trades = 0
+        # console output is buffered in the sink and flushed by close_out
+        self.sink = sink if sink is not None else ConsoleSink()
+        # one row per trade: bar, side, units, price, cost, balance, net wealth
+        self.ledger = TradeLedger()
 
     def get_date_price(self, bar):
         """Returns date and price for a given bar."""
@@ -21,17 +26,29 @@ class BacktestBase:
 
     def print_balance(self, bar):
         """Prints the current cash balance for a given bar."""
+        self._log_balance(bar)
+        self.sink.flush()
+
+    def _log_balance(self, bar):
         date, price = self.get_date_price(bar)
-        print(f"{date} | current balance {self.current_balance:.2f}")
+        self.sink.write(f"{date} | current balance {self.current_balance:.2f}")
 
     def calculate_net_wealth(self, price):
         return self.current_balance + self.units * price
 
     def print_net_wealth(self, bar):
         """Prints the net wealth for a given bar (cash + position)"""
+        self._log_net_wealth(bar)
+        self.sink.flush()
+
+    def _log_net_wealth(self, bar):
         date, price = self.get_date_price(bar)
         net_wealth = self.calculate_net_wealth(price)
-        print(f"{date} | current net wealth {net_wealth:.2f}")
+        self.sink.write(f"{date} | current net wealth {net_wealth:.2f}")
+
+    def get_ledger(self):
+        """Returns the trade ledger of the last backtest as a DataFrame."""
+        return self.ledger.to_frame(self.env.data.index)
 
     def place_buy_order(self, bar, amount=None, units=None):
         """Places a buy order for a given bar and for a given amount or
@@ -43,10 +60,12 @@ class BacktestBase:
         self.current_balance -= (1 + self.ptc) * units * price + self.ftc
         self.units += units
         self.trades += 1
+        self.ledger.append(bar, BUY, units, price, self.ptc * units * price + self.ftc,
+                           self.current_balance, self.calculate_net_wealth(price))
         if self.verbose:
-            print(f"{date} | buy {units} units at {price:.4f}")
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+            self.sink.write(f"{date} | buy {units} units at {price:.4f}")
+            self._log_balance(bar)
+            self._log_net_wealth(bar)
 
     def place_sell_order(self, bar, amount=None, units=None):
         """Places a sell order for a given bar and for a given amount or
@@ -57,31 +76,37 @@ class BacktestBase:
         self.current_balance += (1 - self.ptc) * units * price - self.ftc
         self.units -= units
         self.trades += 1
+        self.ledger.append(bar, SELL, units, price, self.ptc * units * price + self.ftc,
+                           self.current_balance, self.calculate_net_wealth(price))
         if self.verbose:
-            print(f"{date} | sell {units} units at {price:.2f}")
-            self.print_balance(bar)
-            self.print_net_wealth(bar)
+            self.sink.write(f"{date} | sell {units} units at {price:.2f}")
+            self._log_balance(bar)
+            self._log_net_wealth(bar)
 
     def close_out(self, bar):
         """Closes out any open position at a given bar."""
         date, price = self.get_date_price(bar)
-        print("=" * 50)
-        print(f'{date} | *** CLOSING OUT ***')
+        self.sink.write("=" * 50)
+        self.sink.write(f'{date} | *** CLOSING OUT ***')
         if self.units < 0:
             self.place_buy_order(bar, units=-self.units)
         else:
             self.place_sell_order(bar, units=self.units)
 
+        inventory = self.units
         self.current_balance += self.units * price
         self.units = 0
         self.trades += 1
+        self.ledger.append(bar, CLOSE, inventory, price, 0., self.current_balance,
+                           self.current_balance)
         if not self.verbose:
-            print(f"{date} | current balance = {self.current_balance:.2f}")
+            self.sink.write(f"{date} | current balance = {self.current_balance:.2f}")
 
         perf = (self.current_balance / self.initial_amount - 1) * 100
-        print(f"{date} | Net Performance [%] {perf:.4f}")
-        print(f"{date} Number of trades [#] {self.trades}")
-        print("=" * 50)
+        self.sink.write(f"{date} | Net Performance [%] {perf:.4f}")
+        self.sink.write(f"{date} Number of trades [#] {self.trades}")
+        self.sink.write("=" * 50)
+        self.sink.flush()
 
 
 # Event Based Backtesting
@@ -107,13 +132,16 @@ class BacktestBaseRM(BacktestBase):
         if units is None:
             units = int(amount / price)
 
-        self.current_balance -= (1 - self.ptc) * units * price + self.ftc
+        # buying pays the proportional costs on top of the price, as in BacktestBase
+        self.current_balance -= (1 + self.ptc) * units * price + self.ftc
         self.units += units
         self.trades += 1
         self.set_price(price)  # 매매가 실행된 후 관련 가격 설정
+        self.ledger.append(bar, BUY, units, price, self.ptc * units * price + self.ftc,
+                           self.current_balance, self.calculate_net_wealth(price))
         if self.verbose:
-            print(f"{date} | buy {units} units for {price:.4f}")
-            self.print_balance(bar)
+            self.sink.write(f"{date} | buy {units} units for {price:.4f}")
+            self._log_balance(bar)
 
     def place_sell_order(self, bar, amount=None, units=None, gprice=None):
         """places a sell order for a given bar and for a given amount or number of units"""
@@ -126,6 +154,8 @@ class BacktestBaseRM(BacktestBase):
         self.units -= units
         self.trades += 1
         self.set_price(price)  # 매매가 실행된 후 관련 가격 설정
+        self.ledger.append(bar, SELL, units, price, self.ptc * units * price + self.ftc,
+                           self.current_balance, self.calculate_net_wealth(price))
         if self.verbose:
-            print(f"{date} | sell {units} units for {price:.4f}")
-            self.print_balance(bar)
+            self.sink.write(f"{date} | sell {units} units for {price:.4f}")
+            self._log_balance(bar)
@@ -3,6 +3,9 @@ import math
 import random
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from price_store import get_store
+from indicators import RollingMean, RollingMeanStd
 
 
 class observation_space:
@@ -46,8 +49,8 @@ class Finance:
         self._prepare_data()
 
     def _get_data(self):
-        self.raw = pd.read_csv(self.url, index_col=0,
-                               parse_dates=True).dropna()
+        symbol = "CLOSE" if self.intraday else self.symbol
+        self.raw = get_store(self.url).get_frame(symbol, copy=False)
         if self.intraday:
             self.raw = self.raw.resample("30min", label="right").last()
             self.raw = pd.DataFrame(self.raw["CLOSE"])
@@ -58,9 +61,9 @@ class Finance:
         self.data = self.data.iloc[self.start:]
         self.data["r"] = np.log(self.data / self.data.shift(1))
         self.data.dropna(inplace=True)
-        self.data["s"] = self.data[self.symbol].rolling(self.window).mean()
-        self.data["m"] = self.data["r"].rolling(self.window).mean()
-        self.data["v"] = self.data["r"].rolling(self.window).std()
+        self.indicators = {"s": RollingMean(self.window), "mv": RollingMeanStd(self.window)}
+        self.data["s"] = self.indicators["s"].batch(self.data[self.symbol].values)
+        self.data["m"], self.data["v"] = self.indicators["mv"].batch(self.data["r"].values)
         self.data.dropna(inplace=True)
         if self.mu is None:
             self.mu = self.data.mean()
@@ -71,12 +74,24 @@ class Finance:
         if self.end is not None:
             self.data = self.data.iloc[:self.end - self.start]
             self.data_ = self.data_.iloc[:self.end - self.start]
+        self._prepare_arrays()
+
+    def _prepare_arrays(self):
+        """Precomputes the states of all bars as read-only views into one
+        contiguous float32 feature array; states[bar - lags] is the state of
+        bar, shape (lags, n_features). 'r' and 'd' become plain arrays."""
+        self.feature_array = np.ascontiguousarray(
+            self.data_[self.features].values, dtype=np.float32)
+        self.states = sliding_window_view(
+            self.feature_array, (self.lags, self.n_features))[:, 0]
+        self.r = self.data["r"].values
+        self.d = self.data["d"].values
 
     def _get_state(self):
-        return self.data_[self.features].iloc[self.bar - self.lags:self.bar]
+        return self.states[self.bar - self.lags]
 
     def get_state(self, bar):
-        return self.data_[self.features].iloc[bar - self.lags:bar]
+        return self.states[bar - self.lags]
 
     def seed(self, seed):
         random.seed(seed)
@@ -87,13 +102,11 @@ class Finance:
         self.accuracy = 0
         self.performance = 1
         self.bar = self.lags
-        state = self.data_[self.features].iloc[self.bar - self.lags:self.bar]
-
-        return state.values
+        return self._get_state()
 
     def step(self, action):
-        correct = action == self.data["d"].iloc[self.bar]
-        ret = self.data["r"].iloc[self.bar] * self.leverage
+        correct = action == self.d[self.bar]
+        ret = self.r[self.bar] * self.leverage
         reward_1 = 1 if correct else 0
         reward_2 = abs(ret) if correct else -abs(ret)
         self.treward += reward_1
@@ -110,8 +123,7 @@ class Finance:
             done = True
         else:
             done = False
-        state = self._get_state()
         info = {}
-        return state.values, reward_1 + reward_2 * 5, done, info
+        return self._get_state(), reward_1 + reward_2 * 5, done, info
 
 
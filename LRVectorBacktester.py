@@ -1,6 +1,8 @@
 # 선형회귀 기반 전력의 벡터화 백테스트를 위한 클래스
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from price_store import get_store
 
 
 class LRVectorBacktester(object):
@@ -30,6 +32,10 @@ class LRVectorBacktester(object):
             회귀 단계를 구현한다.
        run_strategy:
            회귀 기반 전략에 대한 백테스트를 실행
+       run_walk_forward:
+           매일 회귀 계수를 재귀적으로 갱신하는 전진 분석(walk-forward) 백테스트를 실행
+       evaluate_lags:
+           시차 수 1..max_lags 전체를 한 번에 적합하고 표본 내/외 성과를 비교
        plot_results:
            종목코드와 비교되는 전략의 성과를 그려낸다.
        """
@@ -44,10 +50,7 @@ class LRVectorBacktester(object):
         self.get_data()
 
     def get_data(self):
-        raw = pd.read_csv("http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-                          index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start: self.end]
+        raw = get_store().get_frame(self.symbol, self.start, self.end, copy=False)
         raw.rename(columns={self.symbol: 'price'}, inplace=True)
         raw["return"] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
@@ -59,13 +62,10 @@ class LRVectorBacktester(object):
     def prepare_lags(self, start, end):
         """회귀 및 예측 단계에 대해 시차 처리한 데이터를 준비한다."""
         data = self.select_data(start, end)
-        self.cols = []
-        for lag in range(1, self.lags + 1):
-            col = f'lag_{lag}'
-            data[col] = data["return"].shift(lag)
-            self.cols.append(col)
-        data.dropna(inplace=True)
-        self.lagged_data = data
+        self.cols = [f'lag_{lag}' for lag in range(1, self.lags + 1)]
+        lagged = pd.DataFrame(self._lag_matrix(data["return"].values),
+                              index=data.index[self.lags:], columns=self.cols)
+        self.lagged_data = data.iloc[self.lags:].join(lagged)
 
     def fit_model(self, start, end):
         self.prepare_lags(start, end)
@@ -73,8 +73,15 @@ class LRVectorBacktester(object):
                               np.sign(self.lagged_data["return"]), rcond=None)[0]
         self.reg = reg
 
-    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3):
+    def run_strategy(self, start_in, end_in, start_out, end_out, lags=3, results="full"):
+        """
+        :param results: str
+            'full'이면 결과 데이터프레임을 self.results에 남기고,
+            'summary'면 NumPy 배열로만 계산해서 최종 성과만 반환한다.
+        """
         self.lags = lags
+        if results == "summary":
+            return self._summary(start_in, end_in, start_out, end_out)
         self.fit_model(start_in, end_in)
         self.results = self.select_data(start_out, end_out).iloc[lags:]
 
@@ -82,6 +89,10 @@ class LRVectorBacktester(object):
 
         prediction = np.sign(np.dot(self.lagged_data[self.cols], self.reg))
         self.results["prediction"] = prediction
+        return self._evaluate_results()
+
+    def _evaluate_results(self):
+        """self.results의 예측 열로 전략 수익과 누적 성과를 계산한다."""
         self.results["strategy"] = self.results["prediction"] * self.results["return"]
 
         # 거래 성사 시기를 결정한다.
@@ -99,6 +110,126 @@ class LRVectorBacktester(object):
         operf = aperf - self.results['creturns'].iloc[-1]
         return round(aperf, 2), round(operf, 2),
 
+    def run_walk_forward(self, start_in, end_in, end_out, lags=3, forgetting=1.):
+        """
+        표본 내 구간으로 처음 적합한 뒤, 표본 외 구간에서는 하루씩 예측하고 그날의 수익률로
+        회귀 계수를 재귀 최소제곱(RLS)으로 갱신한다. 하루 갱신 비용은 O(lags²)이고,
+        forgetting=1이면 매일 처음부터 lstsq로 다시 적합한 것과 같다.
+        :param start_in: str
+        :param end_in: str
+            처음 적합에 쓸 표본 내 구간
+        :param end_out: str
+            표본 외 구간의 끝 (시작은 end_in 다음 날)
+        :param lags: int
+            시차 수
+        :param forgetting: float
+            망각 계수 (1보다 작으면 최근 관측치에 더 큰 가중치를 준다, 예: 0.99)
+        :return:
+        """
+        self.lags = lags
+        index = self.data.index
+        rows = (index >= start_in) & (index <= end_out)
+        returns = self.data["return"].values[rows]
+        dates = index[rows][lags:]
+        X = self._lag_matrix(returns)
+        y = np.sign(returns[lags:])
+        n_in = int((dates <= end_in).sum())
+
+        # 표본 내 구간의 (가중) 정규방정식 충분통계량으로 처음 계수를 구한다.
+        weights = forgetting ** np.arange(n_in - 1, -1, -1)
+        gram = (X[:n_in] * weights[:, None]).T @ X[:n_in]
+        P = np.linalg.pinv(gram)
+        reg = P @ (X[:n_in].T @ (weights * y[:n_in]))
+
+        prediction = np.empty(len(X) - n_in)
+        coefficients = np.empty((len(X) - n_in, lags))
+        for i, t in enumerate(range(n_in, len(X))):
+            x = X[t]
+            coefficients[i] = reg
+            prediction[i] = np.sign(x @ reg)
+            # 그날의 수익률을 관측한 뒤 RLS로 계수와 역 그람 행렬을 갱신한다.
+            Px = P @ x
+            gain = Px / (forgetting + x @ Px)
+            reg = reg + gain * (y[t] - x @ reg)
+            P = (P - np.outer(gain, Px)) / forgetting
+        self.reg = reg
+        self.cols = [f'lag_{lag}' for lag in range(1, lags + 1)]
+        self.coefficients = pd.DataFrame(coefficients, index=dates[n_in:], columns=self.cols)
+        self.results = self.data.loc[dates[n_in:]].copy()
+        self.results["prediction"] = prediction
+        return self._evaluate_results()
+
+    def _select_returns(self, start, end):
+        index = self.data.index
+        return self.data["return"].values[(index >= start) & (index <= end)]
+
+    def _lag_matrix(self, returns, lags=None):
+        """
+        prepare_lags의 lag_1 ... lag_n 열과 같은 시차 수익률 행렬을 수익률 배열에 대한
+        슬라이딩 윈도 뷰로 만든다 (복사 없음, 행: lags 번째 날부터).
+        """
+        lags = lags or self.lags
+        return sliding_window_view(returns[:-1], lags)[:, ::-1]
+
+    def evaluate_lags(self, start_in, end_in, start_out, end_out, max_lags=10):
+        """
+        시차 수 1..max_lags 의 회귀를 한 번에 적합한다. 가장 긴 시차로 만든 설계 행렬 하나의
+        그람 행렬에서 앞쪽 k x k 블록이 시차 k의 정규방정식이 되는 점을 이용한다.
+        시차 k의 결과는 run_strategy(start_in, end_in, start_out, end_out, lags=k)와 같은
+        표본을 쓴다 (수치 오차 범위 내).
+        :param max_lags: int
+            비교할 가장 긴 시차 수
+        :return: pd.DataFrame
+            시차 수별 표본 내 (aperf_in, operf_in)과 표본 외 (aperf_out, operf_out) 성과
+        """
+        lags = np.arange(1, max_lags + 1)
+        returns_in = self._select_returns(start_in, end_in)
+        X = self._padded_lag_matrix(returns_in, max_lags)
+        y = np.sign(returns_in)
+        # 시차 k는 k 번째 날부터의 행을 쓰므로, 뒤에서부터 누적한 그람 행렬을 만든다.
+        gram = X[max_lags:].T @ X[max_lags:]
+        moment = X[max_lags:].T @ y[max_lags:]
+        coefficients = np.zeros((max_lags, max_lags))
+        for k in lags[::-1]:
+            coefficients[:k, k - 1] = np.linalg.lstsq(gram[:k, :k], moment[:k], rcond=None)[0]
+            gram = gram + np.outer(X[k - 1], X[k - 1])
+            moment = moment + X[k - 1] * y[k - 1]
+
+        results = {}
+        for sample, returns in (("in", returns_in),
+                                ("out", self._select_returns(start_out, end_out))):
+            prediction = np.sign(self._padded_lag_matrix(returns, max_lags) @ coefficients)
+            active = np.arange(len(returns))[:, None] >= lags
+            trades = (prediction[1:] != prediction[:-1]) & active[:-1]
+            strategy = np.where(active, prediction * returns[:, None], 0.).sum(axis=0)
+            strategy -= self.tc * trades.sum(axis=0)
+            benchmark = np.where(active, returns[:, None], 0.).sum(axis=0)
+            aperf = self.amount * np.exp(strategy)
+            results[f'aperf_{sample}'] = aperf.round(2)
+            results[f'operf_{sample}'] = (aperf - self.amount * np.exp(benchmark)).round(2)
+        self.lag_coefficients = pd.DataFrame(coefficients, columns=pd.Index(lags, name="lags"),
+                                             index=[f'lag_{lag}' for lag in lags])
+        return pd.DataFrame(results, index=pd.Index(lags, name="lags"))
+
+    def _padded_lag_matrix(self, returns, lags):
+        """첫 행부터 시작하고 아직 없는 시차는 0으로 채운 (len(returns), lags) 시차 행렬"""
+        padded = np.concatenate((np.zeros(lags), returns))
+        return sliding_window_view(padded[:-1], lags)[:, ::-1]
+
+    def _summary(self, start_in, end_in, start_out, end_out):
+        """run_strategy와 같은 계산을 데이터프레임 없이 배열로만 한다."""
+        returns = self._select_returns(start_in, end_in)
+        self.reg = np.linalg.lstsq(self._lag_matrix(returns),
+                                   np.sign(returns[self.lags:]), rcond=None)[0]
+        returns = self._select_returns(start_out, end_out)
+        prediction = np.sign(np.dot(self._lag_matrix(returns), self.reg))
+        returns = returns[self.lags:]
+        trades = np.concatenate(([False], prediction[1:] != prediction[:-1]))
+        strategy = prediction * returns - self.tc * trades
+        aperf = self.amount * np.exp(np.cumsum(strategy)[-1])
+        operf = aperf - self.amount * np.exp(np.cumsum(returns)[-1])
+        return round(aperf, 2), round(operf, 2),
+
     def plot_results(self):
         if self.results is None:
             print("No results to plot yet. Run a strategy.")
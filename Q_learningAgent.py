@@ -4,16 +4,18 @@ import os
 import tensorflow as tf
 import logging
 import random
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import deque
+from checkpoint import save_checkpoint, load_checkpoint
 
 tf.get_logger().setLevel(logging.ERROR)
 from tensorflow.python.framework.ops import disable_eager_execution
 
 disable_eager_execution()
 from keras.layers import Dense, Dropout
-from keras.models import Sequential
+from keras.models import Sequential, load_model
 from keras.optimizers import Adam, RMSprop
 
 os.environ["PYTHONHASHSEED"] = '0'
@@ -89,9 +91,17 @@ class TradingBot:
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
 
-    def learn(self, episodes):
-        """Method to train the DQL agent."""
-        for e in range(1, episodes + 1):
+    def learn(self, episodes, checkpoint=None, every=10):
+        """Method to train the DQL agent.
+
+        With a checkpoint path, the agent's state is saved to that file
+        after every `every` episodes, so that an interrupted training can be
+        continued with resume(checkpoint)."""
+        self._learn(1, episodes, checkpoint, every)
+
+    def _learn(self, first, episodes, checkpoint, every):
+        """Trains the agent from episode first to episodes."""
+        for e in range(first, episodes + 1):
             state = self.learn_env.reset()
             state = np.reshape(state, [1, self.learn_env.lags, self.learn_env.n_features])
 
@@ -124,8 +134,61 @@ class TradingBot:
                 self.validate(e, episodes)
             if len(self.memory) > self.batch_size:
                 self.replay()
+            if checkpoint is not None and (e % every == 0 or e == episodes):
+                self.save_checkpoint(checkpoint, e, episodes, every)
         print()
 
+    def save_checkpoint(self, path, episode, episodes, every=10):
+        """Saves the agent's state after a given episode: model weights and
+        optimizer state, replay memory, epsilon, the metric lists, the states
+        of the random number generators and the TF graph seed.
+
+        The per-op random state of the dropout layers lives inside the TF
+        session and cannot be saved. The agent therefore continues with the
+        model read back from the saved bytes, just as resume does, so the
+        dropout ops of both runs restart from the same graph and op seeds."""
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "model.h5")
+            self.model.save(model_path)
+            with open(model_path, "rb") as f:
+                model = f.read()
+        save_checkpoint(path, dict(
+            kind="TradingBot", episode=episode, episodes=episodes, every=every,
+            model=model, memory=list(self.memory), maxlen=self.memory.maxlen,
+            epsilon=self.epsilon, max_treward=self.max_treward,
+            averages=self.averages, trewards=self.trewards,
+            performances=self.performances, aperformances=self.aperformances,
+            vperformances=self.vperformances,
+            random_state=random.getstate(), np_random_state=np.random.get_state(),
+            tf_seed=tf.compat.v1.get_default_graph().seed))
+        self.model = self._read_model(model)
+
+    def _read_model(self, model):
+        """Builds a model from h5 bytes written by save_checkpoint."""
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, "model.h5")
+            with open(model_path, "wb") as f:
+                f.write(model)
+            return load_model(model_path)
+
+    def resume(self, path, checkpoint=None):
+        """Continues a learn run from a checkpoint file. The agent needs the
+        same environments; the training keeps saving to the same file unless
+        checkpoint is given. The result is the same as that of the
+        uninterrupted run, dropout included (see save_checkpoint)."""
+        state = load_checkpoint(path, kind="TradingBot")
+        if state['tf_seed'] is not None:
+            tf.random.set_seed(state['tf_seed'])
+        self.model = self._read_model(state['model'])
+        self.memory = deque(state['memory'], maxlen=state['maxlen'])
+        for name in ('epsilon', 'max_treward', 'averages', 'trewards', 'performances',
+                     'aperformances', 'vperformances'):
+            setattr(self, name, state[name])
+        random.setstate(state['random_state'])
+        np.random.set_state(state['np_random_state'])
+        self._learn(state['episode'] + 1, state['episodes'],
+                    path if checkpoint is None else checkpoint, state['every'])
+
     def validate(self, e, episodes):
         """Method to validate the performance of the DQL agent."""
         state = self.valid_env.reset()
@@ -1,7 +1,49 @@
 # 머신러닝 기반 전략에 대한 벡터화 백테스팅
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn import linear_model
+from sklearn.base import clone
 import pandas as pd
+from price_store import get_store
+
+
+def _partial_fit(model, chunks):
+    """(특징 행렬, 목표값) 청크들로 스트리밍 모델을 partial_fit 한다."""
+    for features, target in chunks:
+        if isinstance(model, linear_model.SGDClassifier):
+            model.partial_fit(features, target, classes=[-1., 0., 1.])
+        else:
+            model.partial_fit(features, target)
+
+
+_folds = {}
+
+
+def _init_folds(model, features, returns, streaming, chunksize, epochs):
+    _folds.update(model=model, features=features, returns=returns, streaming=streaming,
+                  chunksize=chunksize, epochs=epochs)
+
+
+def _score_fold(task):
+    """
+    한 폴드의 학습 구간으로 모델을 적합하고 검증 구간의 예측을 반환한다.
+    특징 행렬은 워커마다 한 번 받아 둔 것을 행과 열로 잘라서만 쓴다.
+    """
+    lags, train, test = task
+    features = _folds["features"][:, :lags]
+    target = np.sign(_folds["returns"])
+    model = clone(_folds["model"])
+    if _folds["streaming"]:
+        chunksize = _folds["chunksize"]
+        for _ in range(_folds["epochs"]):
+            _partial_fit(model, ((features[row:min(row + chunksize, train.stop)],
+                                  target[row:min(row + chunksize, train.stop)])
+                                 for row in range(train.start, train.stop, chunksize)))
+    else:
+        model.fit(features[train], target[train])
+    return model.predict(features[test])
 
 
 class ScikitVectorBacktester(object):
@@ -21,6 +63,11 @@ class ScikitVectorBacktester(object):
        model: str
 
        '회귀' 메서드 또는 '로지스틱' 메서드
+       ('sgd_regression', 'sgd_classification'은 partial_fit으로 청크 단위 학습)
+       chunksize: int
+           스트리밍 모델이 한 번에 다룰 행 수
+       epochs: int
+           스트리밍 모델이 학습 구간을 도는 횟수
        =======
        get_data:
            기본 데이터 집합을 검색해 준비해 둔다
@@ -28,20 +75,27 @@ class ScikitVectorBacktester(object):
             데이터의 부분집합 한 개를 선택한다.
        prepare_features:
             모델들을 접합시키기 위한, 특징들이 있는 데이터를 준비한다.
+       iter_features:
+            시차 특징 행렬을 청크 단위로 만들어 내보낸다.
        fit_model:
             회귀 단계를 구현한다.
        run_strategy:
            회귀 기반 전략에 대한 백테스트를 실행
+       cross_validate:
+           purge를 적용한 전진 분석 교차 검증을 워커 프로세스에서 폴드별로 병렬 실행
        plot_results:
            종목코드와 비교되는 전략의 성과를 그려낸다.
        """
 
-    def __init__(self, symbol, start, end, amount, tc, model):
+    def __init__(self, symbol, start, end, amount, tc, model, chunksize=10000, epochs=1):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.amount = amount
         self.tc = tc
+        self.chunksize = chunksize
+        self.epochs = epochs
+        self.streaming = model.startswith("sgd")
         self.results = None
         if model == "regression":
             self.model = linear_model.LinearRegression()
@@ -50,15 +104,16 @@ class ScikitVectorBacktester(object):
                                                          solver="lbfgs",
                                                          multi_class="ovr",
                                                          max_iter=1000)
+        elif model == "sgd_regression":
+            self.model = linear_model.SGDRegressor(random_state=100)
+        elif model == "sgd_classification":
+            self.model = linear_model.SGDClassifier(loss="log_loss", random_state=100)
         else:
             raise ValueError("Model not known or not yet implemented.")
         self.get_data()
 
     def get_data(self):
-        raw = pd.read_csv("http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-                          index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start: self.end]
+        raw = get_store().get_frame(self.symbol, self.start, self.end, copy=False)
         raw.rename(columns={self.symbol: 'price'}, inplace=True)
         raw["return"] = np.log(raw / raw.shift(1))
         self.data = raw.dropna()
@@ -77,19 +132,60 @@ class ScikitVectorBacktester(object):
             self.feature_columns.append(col)
         self.data_subset.dropna(inplace=True)
 
+    def iter_features(self, start, end):
+        """
+        prepare_features와 같은 시차 특징과 목표값을 self.chunksize 행씩 만들어 내보낸다.
+        청크 경계에서는 앞 청크의 마지막 수익률 lags 개를 이어 붙여 쓴다.
+        :return: generator
+            (특징 행렬, 수익률 부호) 튜플
+        """
+        index = self.data.index
+        first = index.searchsorted(pd.Timestamp(start))
+        last = index.searchsorted(pd.Timestamp(end), side="right")
+        returns = self.data["return"].values
+        for row in range(first + self.lags, last, self.chunksize):
+            window = returns[row - self.lags:min(row + self.chunksize, last)]
+            yield sliding_window_view(window[:-1], self.lags)[:, ::-1], np.sign(window[self.lags:])
+
     def fit_model(self, start, end):
+        if self.streaming:
+            self.feature_columns = [f'lag_{lag}' for lag in range(1, self.lags + 1)]
+            # partial_fit은 앞선 학습에 이어서 하므로 적합할 때마다 새 모델로 시작한다.
+            self.model = clone(self.model)
+            for _ in range(self.epochs):
+                _partial_fit(self.model, self.iter_features(start, end))
+            return
         self.prepare_features(start, end)
         self.model.fit(self.data_subset[self.feature_columns],
                        np.sign(self.data_subset["return"]))
 
+    def predict_chunks(self, start, end):
+        """
+        표본 외 구간을 청크 단위로 예측하고 run_strategy와 같은 모양의 data_subset을 만든다.
+        시차 열과 예측은 미리 할당한 data_subset 행과 배열에 청크마다 바로 쓴다.
+        """
+        self.data_subset = self.select_data(start, end).iloc[self.lags:].copy()
+        for col in self.feature_columns:
+            self.data_subset[col] = np.nan
+        columns = [self.data_subset.columns.get_loc(col) for col in self.feature_columns]
+        prediction = np.empty(len(self.data_subset))
+        row = 0
+        for chunk, _ in self.iter_features(start, end):
+            self.data_subset.iloc[row:row + len(chunk), columns] = chunk
+            prediction[row:row + len(chunk)] = self.model.predict(chunk)
+            row += len(chunk)
+        return prediction
+
     def run_strategy(self, start_in, end_in, start_out, end_out, lags=3):
         self.lags = lags
         self.fit_model(start_in, end_in)
-        self.prepare_features(start_out, end_out)
-
-        prediction = self.model.predict(
-            self.data_subset[self.feature_columns]
-        )
+        if self.streaming:
+            prediction = self.predict_chunks(start_out, end_out)
+        else:
+            self.prepare_features(start_out, end_out)
+            prediction = self.model.predict(
+                self.data_subset[self.feature_columns]
+            )
         self.data_subset["prediction"] = prediction
         self.data_subset["strategy"] = self.data_subset["prediction"] * self.data_subset["return"]
 
@@ -107,6 +203,79 @@ class ScikitVectorBacktester(object):
         operf = aperf - self.results['creturns'].iloc[-1]
         return round(aperf, 2), round(operf, 2),
 
+    def cross_validate(self, start, end, lags=3, folds=5, purge=None, expanding=True,
+                       max_workers=None):
+        """
+        [start, end] 구간을 folds + 1 개의 연속된 블록으로 나누고, k 번째 폴드는 k 번째 블록을
+        검증 구간으로, 그 앞의 블록들 (expanding=False면 바로 앞 블록 하나)을 학습 구간으로 쓴다.
+        시차 특징 행렬은 가장 긴 시차로 한 번만 만들고 폴드와 시차 수별로 잘라서 쓴다.
+        학습 구간의 끝 purge 개 행은 버려서, 학습에 쓴 목표 수익률이 검증 구간의 시차 특징에
+        들어가지 않게 한다.
+        :param lags: int 또는 int 시퀀스
+            비교할 시차 수 (모든 시차 수가 같은 행을 쓰도록 가장 긴 시차 다음 날부터 시작한다)
+        :param folds: int
+            검증 폴드 수
+        :param purge: int
+            학습 구간 끝에서 버릴 행 수 (None이면 가장 긴 시차 수)
+        :param expanding: bool
+            True면 학습 구간이 처음부터 늘어나고, False면 고정 길이로 이동한다.
+        :param max_workers: int
+            워커 프로세스 수 (None이면 CPU 코어 수)
+        :return: (pd.DataFrame, pd.DataFrame)
+            (시차 수, 폴드)별 구간과 aperf, operf, hit_rate, 그리고
+            시차 수별로 모든 검증 구간을 이어 붙인 aperf, operf, hit_rate
+        """
+        lags_list = np.atleast_1d(np.asarray(lags, dtype=int))
+        max_lags = int(lags_list.max())
+        purge = max_lags if purge is None else purge
+        returns = self.select_data(start, end)["return"].values
+        dates = self.select_data(start, end).index[max_lags:]
+        features = np.ascontiguousarray(sliding_window_view(returns[:-1], max_lags)[:, ::-1])
+        returns = returns[max_lags:]
+        bounds = np.linspace(0, len(returns), folds + 2).astype(int)
+        if np.any(bounds[1:-1] - purge <= 0) or np.any(np.diff(bounds) == 0):
+            raise ValueError("Not enough data for the number of folds.")
+        if not expanding and np.any(np.diff(bounds)[:-1] <= purge):
+            # 고정 길이 학습 구간은 한 블록에서 purge 개 행을 빼므로 블록이 purge보다 길어야 한다.
+            raise ValueError("Training blocks must be longer than purge.")
+
+        tasks, keys = [], []
+        for k in range(1, folds + 1):
+            train = slice(0 if expanding else bounds[k - 1], bounds[k] - purge)
+            test = slice(bounds[k], bounds[k + 1])
+            for lag in lags_list:
+                tasks.append((int(lag), train, test))
+                keys.append((int(lag), k))
+        with ProcessPoolExecutor(max_workers or os.cpu_count(), initializer=_init_folds,
+                                 initargs=(self.model, features, returns, self.streaming,
+                                           self.chunksize, self.epochs)) as pool:
+            predictions = list(pool.map(_score_fold, tasks))
+
+        rows, strategy = [], {int(lag): [] for lag in lags_list}
+        for (lag, k), (_, train, test), prediction in zip(keys, tasks, predictions):
+            r = returns[test]
+            # run_strategy와 같이 폴드의 첫날은 거래로 세지 않는다.
+            trades = np.concatenate(([False], prediction[1:] != prediction[:-1]))
+            s = prediction * r - self.tc * trades
+            strategy[lag].append((s, r, np.sign(prediction) == np.sign(r)))
+            aperf = self.amount * np.exp(s.sum())
+            rows.append({"lags": lag, "fold": k,
+                         "train_start": dates[train.start], "train_end": dates[train.stop - 1],
+                         "test_start": dates[test.start], "test_end": dates[test.stop - 1],
+                         "aperf": round(aperf, 2),
+                         "operf": round(aperf - self.amount * np.exp(r.sum()), 2),
+                         "hit_rate": round(np.mean(np.sign(prediction) == np.sign(r)), 4)})
+        self.cv_results = pd.DataFrame(rows).set_index(["lags", "fold"])
+
+        total = []
+        for lag, parts in strategy.items():
+            s, r, hits = (np.concatenate(part) for part in zip(*parts))
+            aperf = self.amount * np.exp(s.sum())
+            total.append({"lags": lag, "aperf": round(aperf, 2),
+                          "operf": round(aperf - self.amount * np.exp(r.sum()), 2),
+                          "hit_rate": round(hits.mean(), 4)})
+        return self.cv_results, pd.DataFrame(total).set_index("lags")
+
     def plot_results(self):
         if self.results is None:
             print("No results to plot yet. Run a strategy.")
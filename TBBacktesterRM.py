@@ -5,6 +5,9 @@
 import numpy as np
 import pandas as pd
 from BacktestingBase import BacktestBaseRM
+from risk_overlay import first_exit, sweep_risk
+from trade_ledger import TradeLedger
+from checkpoint import save_checkpoint, load_checkpoint
 
 
 class TBBacktesterRM(BacktestBaseRM):
@@ -12,123 +15,267 @@ class TBBacktesterRM(BacktestBaseRM):
         """Helper method to reshape state objects"""
         return np.reshape(state, [1, self.env.lags, self.env.n_features])
 
-    def backtest_strategy(self, sl=None, tsl=None, tp=None, wait=5, guarantee=False):
+    def predict_signal(self, bar):
+        """Returns the trading bot's signal for a given bar (1 long, -1 short)."""
+        state = self.env.get_state(bar)
+        action = np.argmax(self.model.predict(self._reshape(state))[0, 0])
+        return 1 if action == 1 else -1
+
+    def get_states(self):
+        """Returns the states of all bars from env.lags on as one array of
+        shape (bars, lags, n_features); row i equals env.get_state(lags + i)."""
+        # the window ending on the last bar is not the state of any bar
+        return np.ascontiguousarray(self.env.states[:len(self.env.data) - self.env.lags])
+
+    def predict_signals(self):
+        """Returns the signals for all bars from env.lags on as an array,
+        using a single batched predict call. The model input only depends
+        on the environment data, not on the position."""
+        q = self.model.predict(self.get_states())
+        actions = np.argmax(q[:, 0], axis=-1)
+        return np.where(actions == 1, 1, -1)
+
+    def backtest_strategy(self, sl=None, tsl=None, tp=None, wait=5, guarantee=False,
+                          mode="loop", checkpoint=None, every=10000):
         """Event-based backtesting of the trading bot's performance.
-        Incl, Stop loss, trailing stop loss and take profit>"""
+        Incl, Stop loss, trailing stop loss and take profit>
+
+        The signals of all bars are predicted up front in one batch
+        (predict_signals). Mode 'loop' then runs the order logic on every
+        bar, mode 'event' only on the bars where an order or a risk exit can
+        happen; the net wealth of the bars in between is filled in
+        vectorially. Both modes give the same trades and net wealths.
+
+        With a checkpoint path, the state of the run is saved to that file
+        at least every `every` bars (in mode 'event' also inside the spans
+        between events), so that an interrupted run can be continued with
+        resume(checkpoint)."""
+        if mode not in ("loop", "event"):
+            raise ValueError("mode must be 'loop' or 'event'")
         self.units = 0
         self.position = 0
-        self.trads = 0
+        self.trades = 0
+        self.ledger.reset()
         self.sl = sl
         self.tsl = tsl
         self.tp = tp
         self.wait = 0
         self.current_balance = self.initial_amount
-        self.net_wealths = list()
-        for bar in range(self.env.lags, len(self.env.data)):
-            self.wait = max(0, self.wait - 1)
-            date, price = self.get_date_price(bar)
-            if self.trads == 0:
-                print(50 * "=")
-                print(f"{date} | *** START BACKTEST ***")
-                self.print_balance(bar)
-                print(50 * "=")
-
-            # stop loss order
-            if sl is not None and self.position != 0:
-                rc = (price - self.entry_price) / self.entry_price
-                if self.position == 1 and rc < -self.sl:
-                    print(50 * "-")
-                    if guarantee:
-                        price = self.entry_price * (1 - self.sl)
-                        print(f"*** STOP LOSS (LONG | {-self.sl:.4f}) ***")
-                    else:
-                        print(f"*** STOP LOSS (LONG | {rc:.4f}) ***")
-                    self.place_sell_order(bar, units=self.units, gprice=price)
-                    self.wait = wait
-                    self.position = 0
-                elif self.position == -1 and rc > self.sl:
-                    print(50 * "-")
-                    if guarantee:
-                        price = self.entry_price * (1 + self.sl)
-                        print(f"*** STOP LOSS (SHORT | -{-self.sl:.4f}) ***")
-                    else:
-                        print(f"*** STOP LOSS (SHORT | -{rc:.4f}) ***")
-                    self.place_buy_order(bar, units=self.units, gprice=price)
-                    self.wait = wait
-                    self.position = 0
-
-                # trailing stop loss order
-                if tsl is not None and self.position != 0:
-                    self.max_price = max(self.max_price, price)
-                    self.min_price = min(self.min_price, price)
-                    rc_1 = (price - self.max_price) / self.entry_price
-                    rc_2 = (self.min_price - price) / self.entry_price
-                    if self.position == 1 and rc_1 < -self.tsl:
-                        print(50 * "-")
-                        print(f"*** TRAILING SL (LONG | {rc_1:.4f}) ***")
-                        self.place_sell_order(bar, units=self.units)
-                        self.wait = wait
-                        self.position = 0
-
-                    elif self.position == -1 and rc_2 < -self.tsl:
-                        print(50 * "-")
-                        print(f"*** TRAILING SL (SHORT | {rc_2:.4f}) ***")
-                        self.place_buy_order(bar, units=-self.units)
-                        self.wait = wait
-                        self.position = 0
-
-                # take profit order
-                if tp is not None and self.position != 0:
-                    rc = (price - self.entry_price) / self.entry_price
-                    if self.position == 1 and rc > self.tp:
-                        print(50 * "-")
-                        if guarantee:
-                            price = self.entry_price * (1 + self.tp)
-                            print(f"*** TAKE PROFIT (LONG | {self.tp:.4f}) ***")
-                        else:
-                            print(f"*** TAKE PROFIT (LONG | {rc:.4f}) ***")
-                        self.place_sell_order(bar, units=self.units, gprice=price)
-                        self.wait = wait
-                        self.position = 0
-
-                    elif self.position == -1 and rc < -self.tp:
-                        print(50 * "-")
-                        if guarantee:
-                            price = self.entry_price * (1 - self.tp)
-                            print(f"*** TAKE PROFIT (SHORT | {self.tp:.4f}) ***")
-                        else:
-                            print(f"*** TAKE PROFIT (SHORT | {-rc:.4f}) ***")
-                        self.place_buy_order(bar, units=-self.units, gprice=price)
-                        self.wait = wait
-                        self.position = 0
-
-                state = self.env.get_state(bar)
-                action = np.argmax(self.model.predict(
-                    self._reshape(state.values))[0, 0])
-                position = 1 if action == 1 else -1
-                if self.position in [0, -1] and position == 1 and self.wait == 0:
-                    if self.verbose:
-                        print(50 * "-")
-                        print(f"{date} | *** GOING LONG ***")
-                    if self.position == -1:
-                        self.place_buy_order(bar - 1, units=-self.units)
-                    self.place_buy_order(bar - 1, amount=self.current_balance)
-                    if self.verbose:
-                        self.print_net_wealth(bar)
-                    self.position = 1
-                elif self.position in [0, 1] and position == -1 and self.wait == 0:
-                    if self.verbose:
-                        print(50 * "-")
-                        print(f"{date} | *** GOING SHORT ***")
-                    if self.position == 1:
-                        self.place_sell_order(bar - 1, units=self.units)
-                    self.place_sell_order(bar - 1, amount=self.current_balance)
-                    if self.verbose:
-                        self.print_net_wealth(bar)
-                    self.position = -1
-
-                self.net_wealths.append((date, self.calculate_net_wealth(price)))
-            self.net_wealths = pd.DataFrame(self.net_wealths, columns=['date', 'net_wealth'])
-            self.net_wealths.set_index('date', inplace=True)
-            self.net_wealths.index = pd.DatetimeIndex(self.net_wealths.index)
-            self.close_out(bar)
+        self._settings = dict(wait=wait, guarantee=guarantee, mode=mode, every=every)
+        lags, n = self.env.lags, len(self.env.data)
+        self._net_wealths = np.empty(n - lags)
+        # signals by bar, 0 for the bars before the first state
+        self._signals = np.concatenate((np.zeros(lags, dtype=int), self.predict_signals()))
+        self._run(lags, checkpoint)
+
+    def save_checkpoint(self, path, bar):
+        """Saves the state of a backtest_strategy run that has processed
+        all bars before a given bar."""
+        lags = self.env.lags
+        save_checkpoint(path, dict(
+            kind="TBBacktesterRM", bar=bar, n=len(self.env.data),
+            settings=self._settings, sl=self.sl, tsl=self.tsl, tp=self.tp,
+            current_balance=self.current_balance, units=self.units,
+            position=self.position, trades=self.trades, wait=self.wait,
+            entry_price=getattr(self, 'entry_price', None),
+            max_price=getattr(self, 'max_price', None),
+            min_price=getattr(self, 'min_price', None),
+            net_wealths=self._net_wealths[:bar - lags].copy(),
+            signals=self._signals, ledger=self.ledger.records.copy()))
+        self.sink.flush()
+
+    def resume(self, path, checkpoint=None):
+        """Continues a backtest_strategy run from a checkpoint file. The
+        backtester needs the same environment data; the signals are taken
+        from the checkpoint, so the model is not called again. The run
+        keeps saving to the same file unless checkpoint is given."""
+        state = load_checkpoint(path, kind="TBBacktesterRM")
+        if state['n'] != len(self.env.data):
+            raise ValueError("checkpoint was saved for different data")
+        self._settings = state['settings']
+        for name in ('sl', 'tsl', 'tp', 'current_balance', 'units', 'position',
+                     'trades', 'wait', 'entry_price', 'max_price', 'min_price'):
+            setattr(self, name, state[name])
+        self.ledger = TradeLedger.from_records(state['ledger'])
+        self._signals = state['signals']
+        self._net_wealths = np.empty(state['n'] - self.env.lags)
+        self._net_wealths[:len(state['net_wealths'])] = state['net_wealths']
+        self._run(state['bar'], path if checkpoint is None else checkpoint)
+
+    def _run(self, bar, checkpoint):
+        """Runs backtest_strategy from a given bar on and closes out."""
+        lags, n = self.env.lags, len(self.env.data)
+        wait, guarantee = self._settings['wait'], self._settings['guarantee']
+        every = self._settings['every']
+        net_wealths, signals = self._net_wealths, self._signals
+        saved = bar
+        if self._settings['mode'] == "loop":
+            while bar < n:
+                net_wealths[bar - lags] = self._step(
+                    bar, signals[bar], wait, guarantee)
+                bar += 1
+                if checkpoint is not None and bar - saved >= every:
+                    self.save_checkpoint(checkpoint, bar)
+                    saved = bar
+        else:
+            prices = self.env.data[self.env.symbol].values
+            while bar < n:
+                event = self._next_event(bar, prices, signals)
+                # a long quiet span is cut where the next checkpoint is due
+                cut = checkpoint is not None and saved + every <= event
+                stop = saved + every if cut else event
+                # nothing but the wait countdown and the trailing prices
+                # changes on the bars before the event
+                skipped = prices[bar:stop]
+                self.wait = max(0, self.wait - len(skipped))
+                if self.tsl is not None and self.position != 0 and len(skipped):
+                    self.max_price = max(self.max_price, skipped.max())
+                    self.min_price = min(self.min_price, skipped.min())
+                net_wealths[bar - lags:stop - lags] = (
+                    self.current_balance + self.units * skipped)
+                if cut:
+                    bar = saved = stop
+                    self.save_checkpoint(checkpoint, bar)
+                    continue
+                if event == n:
+                    break
+                net_wealths[event - lags] = self._step(
+                    event, signals[event], wait, guarantee)
+                bar = event + 1
+                if checkpoint is not None and bar - saved >= every:
+                    self.save_checkpoint(checkpoint, bar)
+                    saved = bar
+        self.net_wealths = pd.DataFrame(
+            {'net_wealth': net_wealths},
+            index=pd.DatetimeIndex(self.env.data.index[lags:]).normalize().rename('date'))
+        self.close_out(n - 1)
+
+    def _step(self, bar, position, wait, guarantee):
+        """Runs the order logic for a given bar and signal and returns the
+        net wealth at that bar."""
+        self.wait = max(0, self.wait - 1)
+        date, price = self.get_date_price(bar)
+        if self.trades == 0:
+            self.sink.write(50 * "=")
+            self.sink.write(f"{date} | *** START BACKTEST ***")
+            self._log_balance(bar)
+            self.sink.write(50 * "=")
+
+        # stop loss order
+        if self.sl is not None and self.position != 0:
+            rc = (price - self.entry_price) / self.entry_price
+            if self.position == 1 and rc < -self.sl:
+                self.sink.write(50 * "-")
+                if guarantee:
+                    price = self.entry_price * (1 - self.sl)
+                    self.sink.write(f"*** STOP LOSS (LONG | {-self.sl:.4f}) ***")
+                else:
+                    self.sink.write(f"*** STOP LOSS (LONG | {rc:.4f}) ***")
+                self.place_sell_order(bar, units=self.units, gprice=price)
+                self.wait = wait
+                self.position = 0
+            elif self.position == -1 and rc > self.sl:
+                self.sink.write(50 * "-")
+                if guarantee:
+                    price = self.entry_price * (1 + self.sl)
+                    self.sink.write(f"*** STOP LOSS (SHORT | -{-self.sl:.4f}) ***")
+                else:
+                    self.sink.write(f"*** STOP LOSS (SHORT | -{rc:.4f}) ***")
+                self.place_buy_order(bar, units=-self.units, gprice=price)
+                self.wait = wait
+                self.position = 0
+
+        # trailing stop loss order
+        if self.tsl is not None and self.position != 0:
+            self.max_price = max(self.max_price, price)
+            self.min_price = min(self.min_price, price)
+            rc_1 = (price - self.max_price) / self.entry_price
+            rc_2 = (self.min_price - price) / self.entry_price
+            if self.position == 1 and rc_1 < -self.tsl:
+                self.sink.write(50 * "-")
+                self.sink.write(f"*** TRAILING SL (LONG | {rc_1:.4f}) ***")
+                self.place_sell_order(bar, units=self.units)
+                self.wait = wait
+                self.position = 0
+
+            elif self.position == -1 and rc_2 < -self.tsl:
+                self.sink.write(50 * "-")
+                self.sink.write(f"*** TRAILING SL (SHORT | {rc_2:.4f}) ***")
+                self.place_buy_order(bar, units=-self.units)
+                self.wait = wait
+                self.position = 0
+
+        # take profit order
+        if self.tp is not None and self.position != 0:
+            rc = (price - self.entry_price) / self.entry_price
+            if self.position == 1 and rc > self.tp:
+                self.sink.write(50 * "-")
+                if guarantee:
+                    price = self.entry_price * (1 + self.tp)
+                    self.sink.write(f"*** TAKE PROFIT (LONG | {self.tp:.4f}) ***")
+                else:
+                    self.sink.write(f"*** TAKE PROFIT (LONG | {rc:.4f}) ***")
+                self.place_sell_order(bar, units=self.units, gprice=price)
+                self.wait = wait
+                self.position = 0
+
+            elif self.position == -1 and rc < -self.tp:
+                self.sink.write(50 * "-")
+                if guarantee:
+                    price = self.entry_price * (1 - self.tp)
+                    self.sink.write(f"*** TAKE PROFIT (SHORT | {self.tp:.4f}) ***")
+                else:
+                    self.sink.write(f"*** TAKE PROFIT (SHORT | {-rc:.4f}) ***")
+                self.place_buy_order(bar, units=-self.units, gprice=price)
+                self.wait = wait
+                self.position = 0
+
+        if self.position in [0, -1] and position == 1 and self.wait == 0:
+            if self.verbose:
+                self.sink.write(50 * "-")
+                self.sink.write(f"{date} | *** GOING LONG ***")
+            if self.position == -1:
+                self.place_buy_order(bar - 1, units=-self.units)
+            self.place_buy_order(bar - 1, amount=self.current_balance)
+            if self.verbose:
+                self._log_net_wealth(bar)
+            self.position = 1
+        elif self.position in [0, 1] and position == -1 and self.wait == 0:
+            if self.verbose:
+                self.sink.write(50 * "-")
+                self.sink.write(f"{date} | *** GOING SHORT ***")
+            if self.position == 1:
+                self.place_sell_order(bar - 1, units=self.units)
+            self.place_sell_order(bar - 1, amount=self.current_balance)
+            if self.verbose:
+                self._log_net_wealth(bar)
+            self.position = -1
+
+        return self.calculate_net_wealth(price)
+
+    def _next_event(self, bar, prices, signals):
+        """Returns the first bar from a given bar on at which the order logic
+        can act (len(env.data) if there is none).
+
+        Flat, only the end of the wait countdown matters. In a position, the
+        first opposite signal or stop loss, trailing stop loss or take profit
+        hit (risk_overlay.first_exit)."""
+        if self.position == 0:
+            return min(bar + max(0, self.wait - 1), len(prices))
+        return first_exit(prices, signals, bar, self.position, self.entry_price,
+                          self.max_price, self.min_price, self.sl, self.tsl, self.tp)[0]
+
+    def backtest_risk_grid(self, grid, wait=5, guarantee=False):
+        """Backtests combinations of stop loss, trailing stop loss and take
+        profit levels over the same predicted signals.
+
+        grid is a list of dicts or a dict of value lists with the keys 'sl',
+        'tsl' and 'tp' (None switches the order off). Each combination runs
+        through risk_overlay.risk_overlay, which jumps from trade to trade,
+        and returns the final balance and number of trades that
+        backtest_strategy would give."""
+        lags = self.env.lags
+        prices = self.env.data[self.env.symbol].values
+        signals = np.concatenate((np.zeros(lags, dtype=int), self.predict_signals()))
+        return sweep_risk(prices, signals, lags, grid, self.initial_amount,
+                          self.ftc, self.ptc, wait=wait, guarantee=guarantee)
@@ -1,7 +1,8 @@
 # SMA 기반 전략들을 대상으로 벡터화 백테스트를 하는 데 쓸 클래스
 import pandas as pd
 import numpy as np
-from scipy.optimize import brute
+from price_store import get_store
+from indicators import rolling_means, RollingMean
 
 
 class SMAVectorBacktester(object):
@@ -30,6 +31,10 @@ class SMAVectorBacktester(object):
         종목코드와 비교한 전략의 성과를 그려 낸다.
     update_and_run:
         SMA 파라미터들을 갱신하고 (부정적인) 절대 성과를 반환한다.
+    append:
+        새 봉들을 이어 붙이고 새 행들에 대해서만 전략 결과를 갱신한다.
+    evaluate_grid:
+        SMA 파라미터 격자 전체의 성과 곡면을 한 번에 계산한다.
     optimize_parameters:
         두 가지 SMA 파라미터들에 대한 전수 대입(brute-force) 최적화를 구현한다.
     """
@@ -41,41 +46,111 @@ class SMAVectorBacktester(object):
         self.start = start
         self.end = end
         self.results = None
+        self.surface = None
+        self._carry = None
         self.get_data()
 
     def get_data(self):
-        raw = pd.read_csv("http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-                          index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start: self.end]
+        raw = get_store().get_frame(self.symbol, self.start, self.end, copy=False)
         raw.rename(columns={self.symbol: 'price'}, inplace=True)
         raw["return"] = np.log(raw / raw.shift(1))
-        raw["SMA1"] = raw['price'].rolling(self.SMA1).mean()
-        raw["SMA2"] = raw['price'].rolling(self.SMA2).mean()
+        self.indicators = {"SMA1": RollingMean(self.SMA1), "SMA2": RollingMean(self.SMA2)}
+        for column, indicator in self.indicators.items():
+            raw[column] = indicator.batch(raw["price"].values)
         self.data = raw
 
     def set_parameter(self, SMA1=None, SMA2=None):
+        # 파라미터가 바뀌면 append가 이어 갈 이전 결과가 없다.
+        self._carry = None
         if SMA1 is not None:
             self.SMA1 = SMA1
-            self.data["SMA1"] = self.data["price"].rolling(self.SMA1).mean()
+            self.indicators["SMA1"] = RollingMean(self.SMA1)
+            self.data["SMA1"] = self.indicators["SMA1"].batch(self.data["price"].values)
         if SMA2 is not None:
             self.SMA2 = SMA2
-            self.data["SMA2"] = self.data["price"].rolling(self.SMA2).mean()
+            self.indicators["SMA2"] = RollingMean(self.SMA2)
+            self.data["SMA2"] = self.indicators["SMA2"].batch(self.data["price"].values)
 
-    def run_strategy(self):
+    def run_strategy(self, results="full"):
+        """
+        :param results: str
+            'full'이면 결과 데이터프레임을 self.results에 남기고,
+            'summary'면 NumPy 배열로만 계산해서 최종 성과만 반환한다.
+        """
+        if results == "summary":
+            return self._summary()
         data = self.data.copy().dropna()
         data["position"] = np.where(data["SMA1"] > data["SMA2"], 1, -1)
         data["strategy"] = data["position"].shift(1) * data["return"]
         data.dropna(inplace=True)
-        data["creturns"] = data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = data["strategy"].cumsum().apply(np.exp)
+        creturns = data["return"].cumsum()
+        cstrategy = data["strategy"].cumsum()
+        data["creturns"] = creturns.apply(np.exp)
+        data["cstrategy"] = cstrategy.apply(np.exp)
         self.results = data
+        # append에서 이어서 누적할 수 있도록 마지막 누적 로그 수익을 남긴다.
+        self._carry = {"creturns": creturns.values[-1:], "cstrategy": cstrategy.values[-1:]}
         # 전략의 총 성과
         aperf = data["cstrategy"].iloc[-1]
         # 전략의 초과성과/미달성과
         operf = aperf - data['creturns'].iloc[-1]
         return round(aperf, 2), round(operf, 2),
 
+    def append(self, bars):
+        """
+        새 봉들을 self.data 뒤에 이어 붙이고, 보관한 SMA 상태와 마지막 포지션, 누적 수익에서
+        이어서 새 행들의 포지션, 전략 수익, 누적 성과만 계산한다. 몇 번을 이어 붙여도 결과는
+        늘어난 데이터 전체에 run_strategy를 다시 실행한 것과 같다.
+        :param bars: pd.Series 또는 pd.DataFrame
+            날짜 인덱스의 종가 ('price' 열이나 종목 코드 열이 있는 데이터프레임도 된다)
+        :return: tuple
+            run_strategy와 같은 (aperf, operf), 아직 run_strategy를 실행하지 않았으면 None
+        """
+        if isinstance(bars, pd.DataFrame):
+            bars = bars["price"] if "price" in bars else bars[self.symbol]
+        bars = bars.dropna()
+        if len(bars) and not (bars.index.is_monotonic_increasing and bars.index.is_unique
+                              and (self.data.empty or bars.index[0] > self.data.index[-1])):
+            raise ValueError("New bars must be in date order and after the last date in the data.")
+        price = bars.values.astype(np.float64)
+        last = self.data["price"].values[-1:] if len(self.data) else [np.nan]
+        previous = np.concatenate((last, price[:-1]))
+        new = pd.DataFrame({"price": price, "return": np.log(price / previous)},
+                           index=pd.DatetimeIndex(bars.index, name=self.data.index.name))
+        for column, indicator in self.indicators.items():
+            new[column] = [indicator.update(value) for value in price]
+        self.data = pd.concat([self.data, new])
+        if self._carry is None:
+            return None
+        if len(self.results) == 0:
+            # 아직 두 SMA가 모두 있는 날이 없었으면 늘어난 데이터로 다시 실행한다.
+            return self.run_strategy()
+
+        new["position"] = np.where(new["SMA1"] > new["SMA2"], 1, -1)
+        previous = np.concatenate((self.results["position"].values[-1:],
+                                   new["position"].values[:-1]))
+        new["strategy"] = previous * new["return"].values
+        for column in ["creturns", "cstrategy"]:
+            source = "return" if column == "creturns" else "strategy"
+            cumulative = np.cumsum(np.concatenate((self._carry[column], new[source].values)))
+            self._carry[column] = cumulative[-1:]
+            new[column] = np.exp(cumulative[1:])
+        self.results = pd.concat([self.results, new[self.results.columns]])
+        aperf = self.results["cstrategy"].iloc[-1]
+        operf = aperf - self.results['creturns'].iloc[-1]
+        return round(aperf, 2), round(operf, 2),
+
+    def _summary(self):
+        """run_strategy와 같은 계산을 데이터프레임 없이 배열로만 한다."""
+        columns = [self.data[col].values for col in ["price", "return", "SMA1", "SMA2"]]
+        rows = ~np.any([np.isnan(col) for col in columns], axis=0)
+        price, returns, sma1, sma2 = [col[rows] for col in columns]
+        position = np.where(sma1 > sma2, 1, -1)
+        strategy = position[:-1] * returns[1:]
+        aperf = np.exp(np.cumsum(strategy)[-1])
+        operf = aperf - np.exp(np.cumsum(returns[1:])[-1])
+        return round(aperf, 2), round(operf, 2),
+
     def plot_results(self):
         if self.results is None:
             print("No results to plot yet. Run a strategy.")
@@ -93,15 +168,56 @@ class SMAVectorBacktester(object):
         :return: 
         """
         self.set_parameter(int(SMA[0]), int(SMA[1]))
-        return -self.run_strategy()[0]
+        return -self.run_strategy(results="summary")[0]
+
+    def evaluate_grid(self, SMA1_range, SMA2_range):
+        """
+        모든 (SMA1, SMA2) 조합의 성과를 누적합 한 번과 배열 연산으로 계산한다.
+        각 조합의 결과는 run_strategy의 (aperf, operf)와 같다.
+        :param SMA1_range: tuple
+        :param SMA2_range: tuple
+        (시작, 종료, 단계 크기) 형식으로 된 튜플 (brute와 같은 규칙)
+        :return: pd.DataFrame
+            (SMA1, SMA2) 조합별 aperf, operf
+        """
+        SMA1 = np.mgrid[slice(*SMA1_range)].astype(int)
+        SMA2 = np.mgrid[slice(*SMA2_range)].astype(int)
+        price = self.data["price"].values
+        returns = self.data["return"].values
+        windows = np.unique(np.concatenate([SMA1, SMA2]))
+        smas = rolling_means(price, windows)
+        sma1 = smas[np.searchsorted(windows, SMA1)][:, None, :]
+        sma2 = smas[np.searchsorted(windows, SMA2)][None, :, :]
+        # run_strategy의 dropna()처럼 두 SMA와 수익률이 모두 있는 날부터 포지션을 잡는다.
+        valid = ~np.isnan(sma1) & ~np.isnan(sma2)
+        valid[..., 0] = False
+        position = np.where(sma1 > sma2, 1., -1.) * valid
+        strategy = position[..., :-1] @ returns[1:]
+        # 첫 포지션 다음 날부터 기본 수익률을 누적한다.
+        first = np.maximum(np.maximum(SMA1[:, None], SMA2[None, :]), 2)
+        creturns = np.concatenate(([0.], np.cumsum(returns[1:])))
+        last = len(returns) - 1
+        benchmark = creturns[last] - creturns[np.minimum(first - 1, last)]
+        aperf = np.exp(strategy)
+        operf = aperf - np.exp(benchmark)
+        aperf[first > last] = np.nan
+        operf[first > last] = np.nan
+        index = pd.MultiIndex.from_product([SMA1, SMA2], names=["SMA1", "SMA2"])
+        return pd.DataFrame({"aperf": aperf.ravel(), "operf": operf.ravel()},
+                            index=index).round(2)
 
     def optimize_parameters(self, SMA1_range, SMA2_range):
         """
         주어진 SMA 파라미터 범위 내의 전역 최대 (global maximum, 최댓값)를 찾는다.
+        격자 전체의 성과 곡면은 self.surface 에 남긴다.
         :param SMA1_range: tuple
         :param SMA2_range: tuple
         (시작, 종료, 단계 크기) 형식으로 된 튜플
         :return:
         """
-        opt = brute(self.update_and_run, (SMA1_range, SMA2_range), finish=None)
-        return opt, -self.update_and_run(opt),
+        self.surface = self.evaluate_grid(SMA1_range, SMA2_range)
+        # brute와 같이 격자 순서상 처음 나오는 최댓값을 고른다.
+        opt = np.array(self.surface["aperf"].idxmax(), dtype=float)
+        # 최적 파라미터로 전체 결과를 남겨 plot_results에서 쓸 수 있게 한다.
+        self.set_parameter(int(opt[0]), int(opt[1]))
+        return opt, self.run_strategy()[0],
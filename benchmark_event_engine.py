@@ -0,0 +1,115 @@
+# 이벤트 기반 백테스트의 pandas 엔진과 numpy 엔진의 초당 처리 봉 수,
+# run_lockstep 파라미터 스윕과 단일 실행의 시간, 포트폴리오 백테스트의 시간,
+# 그리고 소켓 재생 스트림을 처리하는 LiveRunner의 속도를 비교하는 벤치마크
+import io
+import sys
+import time
+import asyncio
+import contextlib
+import numpy as np
+import pandas as pd
+from BacktestBase import BacktestLongOnly, BacktestLongShort
+from portfolio_backtest import BacktestPortfolio
+from live_runner import ReplayServer, LiveRunner, SMAStrategy, socket_feed
+
+STRATEGIES = [("run_sma_strategy", (42, 252)),
+              ("run_momentum_strategy", (60,)),
+              ("run_mean_reversion_strategy", (50, 5))]
+
+
+def benchmark(cls, engine, symbol="AAPL.O", start="2010-1-1", end="2019-12-31", repeat=3):
+    """
+    전략마다 repeat 번 실행한 가장 빠른 시간으로 초당 처리 봉 수를 구한다.
+    :return: dict
+        {전략 메서드 이름: (초당 봉 수, 최종 잔고, 거래 횟수)}
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        bt = cls(symbol, start, end, 10000, 10.0, 0.01, verbose=False, engine=engine)
+    results = {}
+    for method, args in STRATEGIES:
+        best = float("inf")
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                getattr(bt, method)(*args)
+                best = min(best, time.perf_counter() - t0)
+        results[method] = (len(bt.data) / best, bt.amount, bt.trades)
+    return results
+
+
+def benchmark_lockstep(cls, symbol="AAPL.O", start="2010-1-1", end="2019-12-31"):
+    """
+    200개 (SMA1, SMA2) 조합을 run_lockstep으로 한 번에 실행한 시간과
+    pandas 엔진으로 한 번 실행한 시간을 반환한다.
+    """
+    grid = {"SMA1": list(range(10, 60, 5)), "SMA2": list(range(100, 300, 10))}
+    with contextlib.redirect_stdout(io.StringIO()):
+        bt = cls(symbol, start, end, 10000, 10.0, 0.01, verbose=False)
+        t0 = time.perf_counter()
+        bt.run_sma_strategy(42, 252)
+        single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    results = bt.run_lockstep("sma", grid)
+    return len(results), time.perf_counter() - t0, single
+
+
+def benchmark_portfolio(symbols=500, bars=5040, seed=0):
+    """
+    기하 브라운 운동으로 만든 (bars x symbols) 가격으로 BacktestPortfolio.run_sma_strategy를
+    실행한 시간을 반환한다 (기본값은 500 종목, 약 20년의 일별 데이터).
+    """
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0., 0.01, (bars, symbols))
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)),
+                          index=pd.bdate_range("2000-01-03", periods=bars),
+                          columns=[f"S{i}" for i in range(symbols)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        bt = BacktestPortfolio(None, None, None, 1000000, 1.0, 0.001, prices=prices)
+        t0 = time.perf_counter()
+        bt.run_sma_strategy(42, 252)
+    return time.perf_counter() - t0, bt.trades
+
+
+def benchmark_live(bars=100000, seed=0):
+    """
+    ReplayServer가 최대 속도로 보내는 bars 개의 분봉을 LiveRunner와 SMAStrategy로 처리한다.
+    :return: pd.Series
+        LiveRunner.latency_stats()
+    """
+    rng = np.random.default_rng(seed)
+    series = pd.Series(100 * np.exp(np.cumsum(rng.normal(0., 0.001, bars))),
+                       index=pd.date_range("2020-01-01", periods=bars, freq="min"))
+
+    async def replay():
+        async with ReplayServer(series) as server:
+            runner = LiveRunner(SMAStrategy(42, 252), 10000, 10.0, 0.01)
+            await runner.run(socket_feed(server.host, server.port))
+        return runner
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner = asyncio.run(replay())
+    return runner.latency_stats()
+
+
+if __name__ == '__main__':
+    symbol = sys.argv[1] if len(sys.argv) > 1 else "AAPL.O"
+    print(f"{'class':18s} {'strategy':28s} {'pandas bars/s':>14s} {'numpy bars/s':>14s} {'speedup':>8s}")
+    for cls in (BacktestLongOnly, BacktestLongShort):
+        slow = benchmark(cls, "pandas", symbol)
+        fast = benchmark(cls, "numpy", symbol)
+        for method, _ in STRATEGIES:
+            # 두 엔진의 최종 잔고와 거래 횟수는 같아야 한다.
+            assert slow[method][1:] == fast[method][1:], method
+            print(f"{cls.__name__:18s} {method:28s} {slow[method][0]:14,.0f} "
+                  f"{fast[method][0]:14,.0f} {fast[method][0] / slow[method][0]:7.1f}x")
+    print()
+    for cls in (BacktestLongOnly, BacktestLongShort):
+        combinations, lockstep, single = benchmark_lockstep(cls, symbol)
+        print(f"{cls.__name__:18s} run_lockstep {combinations} combinations {lockstep:.3f}s "
+              f"= {lockstep / single:.1f} single pandas runs ({single:.3f}s)")
+    print()
+    seconds, trades = benchmark_portfolio()
+    print(f"BacktestPortfolio  run_sma_strategy 500 symbols x 5040 bars {seconds:.3f}s ({trades} trades)")
+    stats = benchmark_live()
+    print(f"LiveRunner         socket replay {stats['bars']:.0f} bars {stats['bars_per_sec']:,.0f} bars/s "
+          f"| latency p50 {stats['p50_us']:.1f}us p99 {stats['p99_us']:.1f}us")
@@ -0,0 +1,32 @@
+# 오래 걸리는 백테스트와 강화학습 실행의 상태를 로컬 파일에 저장하고 다시 읽는 도구
+import os
+import pickle
+
+
+def save_checkpoint(path, state):
+    """
+    상태 딕셔너리 (NumPy 배열, 파이썬 값)를 pickle 이진 파일 하나로 저장한다.
+    임시 파일에 먼저 쓰고 바꿔 넣으므로, 저장 중에 중단돼도 이전 체크포인트는 남는다.
+    :param path: str
+        체크포인트 파일 경로
+    :param state: dict
+        저장할 상태
+    """
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, kind=None):
+    """
+    :param kind: str
+        주면 save_checkpoint 할 때 state['kind']와 같은지 확인한다.
+    :return: dict
+        저장한 상태
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if kind is not None and state.get("kind") != kind:
+        raise ValueError(f"{path} is not a {kind} checkpoint.")
+    return state
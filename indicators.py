@@ -0,0 +1,302 @@
+# 백테스트 클래스들이 함께 쓰는 기술 지표 계산 함수
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def rolling_sums(values, windows):
+    """
+    누적합 한 번으로 여러 시간 창의 이동 합계를 한꺼번에 계산한다.
+    :param values: np.ndarray
+        (n,) 형태의 값 배열 (가격, 수익률 등) 또는 (n, 종목 수) 형태의 패널 (첫 축이 일자)
+    :param windows: int 시퀀스
+        시간 창 (일)
+    :return: np.ndarray
+        (len(windows),) + values.shape 형태,
+        pandas rolling(window).sum() 처럼 처음 window-1 개는 NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    windows = np.asarray(windows, dtype=np.int64)
+    n = len(values)
+    csum = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)))
+    w = windows[:, None]
+    t = np.arange(n)[None, :]
+    sums = csum[t + 1] - csum[np.maximum(t + 1 - w, 0)]
+    sums[t < w - 1] = np.nan
+    return sums
+
+
+def rolling_means(values, windows):
+    """
+    누적합 한 번으로 여러 시간 창의 단순 이동 평균을 한꺼번에 계산한다.
+    :param values: np.ndarray
+        (n,) 형태의 값 배열 (가격, 수익률 등) 또는 (n, 종목 수) 형태의 패널 (첫 축이 일자)
+    :param windows: int 시퀀스
+        시간 창 (일)
+    :return: np.ndarray
+        (len(windows),) + values.shape 형태,
+        pandas rolling(window).mean() 처럼 처음 window-1 개는 NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    windows = np.asarray(windows, dtype=np.int64)
+    # 누적합의 크기를 줄여 차분할 때의 반올림 오차를 작게 한다.
+    offset = values[0] if len(values) else 0.
+    divisor = windows.reshape((-1,) + (1,) * values.ndim)
+    return rolling_sums(values - offset, windows) / divisor + offset
+
+
+def ffill(values):
+    """
+    마지막 축을 따라 NaN을 직전 값으로 채운다 (pandas ffill의 배열 버전).
+    :param values: np.ndarray
+    :return: np.ndarray
+        앞쪽에 채울 값이 없는 NaN은 그대로 남는다.
+    """
+    n = values.shape[-1]
+    idx = np.where(np.isnan(values), 0, np.arange(n))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(values, idx, axis=-1)
+
+
+class RollingMean(object):
+    """
+    누적합으로 계산하는 단순 이동 평균 (SMA, 모멘텀).
+    batch로 배열 전체를 한 번에 계산한 뒤 update로 값을 하나씩 이어 붙일 수 있고,
+    이어 붙인 결과는 늘어난 배열 전체에 batch를 다시 실행한 것과 비트 단위로 같다.
+    값이 없는 시간 창이 NaN을 포함하면 pandas rolling(window).mean() 처럼 NaN이다.
+
+    속성
+    window: int
+        시간 창 (일)
+
+    메서드
+    =======
+    batch:
+        배열 전체의 이동 평균을 계산하고, 상태를 배열의 마지막 값까지로 맞춘다.
+    update:
+        값 하나를 이어 붙이고 새 이동 평균을 O(1)로 반환한다.
+    """
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("window must be a positive integer.")
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.offset = None
+        self.total = 0.
+        self.nans = 0
+        # 값을 더하기 직전의 누적합과 NaN 개수를 시간 창 길이만큼 돌려 쓴다.
+        self._sums = np.zeros(self.window)
+        self._nans = np.zeros(self.window, dtype=np.int64)
+        self.value = np.nan
+
+    def batch(self, values):
+        """
+        :param values: np.ndarray
+            (n,) 형태의 값 배열
+        :return: np.ndarray
+            (n,) 형태, 처음 window-1 개는 NaN
+        """
+        self.reset()
+        values = np.asarray(values, dtype=np.float64)
+        n, w = len(values), self.window
+        missing = np.isnan(values)
+        if n and not missing.all():
+            # rolling_means와 같이 첫 값을 빼서 누적합의 크기를 줄인다.
+            self.offset = values[np.argmin(missing)]
+        csum = np.concatenate(([0.], np.cumsum(np.where(missing, 0., values - (self.offset or 0.)))))
+        cnan = np.concatenate(([0], np.cumsum(missing)))
+        t = np.arange(n)
+        first = np.maximum(t + 1 - w, 0)
+        means = (csum[t + 1] - csum[first]) / w + (self.offset or 0.)
+        means[(t < w - 1) | (cnan[t + 1] - cnan[first] > 0)] = np.nan
+
+        self.count = n
+        self.total = csum[n]
+        self.nans = cnan[n]
+        tail = np.arange(max(n - w, 0), n)
+        self._sums[tail % w] = csum[tail]
+        self._nans[tail % w] = cnan[tail]
+        if n:
+            self.value = means[-1]
+        return means
+
+    def update(self, value):
+        """
+        :param value: float
+            새 봉의 값
+        :return: float
+            새 봉까지의 이동 평균 (아직 window 개가 안 되면 NaN)
+        """
+        w, i = self.window, self.count % self.window
+        missing = value != value
+        if self.offset is None and not missing:
+            self.offset = value
+        self._sums[i] = self.total
+        self._nans[i] = self.nans
+        if not missing:
+            self.total += value - self.offset
+        self.nans += missing
+        self.count += 1
+        j = self.count % w
+        if self.count < w or self.nans - self._nans[j] > 0:
+            self.value = np.nan
+        else:
+            self.value = (self.total - self._sums[j]) / w + self.offset
+        return self.value
+
+
+class RollingMeanStd(object):
+    """
+    웰퍼드(Welford) 방식으로 갱신하는 이동 평균과 이동 표준편차 (변동성).
+    update는 시간 창에서 빠지는 값을 빼고 새 값을 더해서 평균과 제곱편차합을 O(1)로 갱신한다.
+    batch는 누적합으로 한 번에 계산한 뒤 마지막 시간 창으로 웰퍼드 상태를 맞춘다.
+
+    속성
+    window: int
+        시간 창 (일)
+    ddof: int
+        표준편차의 자유도 보정 (pandas rolling(window).std()와 같은 1이 기본)
+
+    메서드
+    =======
+    batch:
+        배열 전체의 (이동 평균, 이동 표준편차)를 계산하고 상태를 마지막 값까지로 맞춘다.
+    update:
+        값 하나를 이어 붙이고 새 (이동 평균, 이동 표준편차)를 O(1)로 반환한다.
+    """
+
+    def __init__(self, window, ddof=1):
+        if window <= ddof:
+            raise ValueError("window must be larger than ddof.")
+        self.window = int(window)
+        self.ddof = ddof
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self._values = np.zeros(self.window)
+
+    @property
+    def std(self):
+        if self.count < self.window:
+            return np.nan
+        return np.sqrt(max(self.m2, 0.) / (self.window - self.ddof))
+
+    def batch(self, values):
+        """
+        :param values: np.ndarray
+            (n,) 형태의 값 배열 (NaN 없음)
+        :return: (np.ndarray, np.ndarray)
+            (n,) 형태의 이동 평균과 이동 표준편차, 처음 window-1 개는 NaN
+        """
+        self.reset()
+        values = np.asarray(values, dtype=np.float64)
+        n, w = len(values), self.window
+        if n < w:
+            for value in values:
+                self.update(value)
+            return np.full(n, np.nan), np.full(n, np.nan)
+        means = rolling_means(values, [w])[0]
+        centered = values - values[0]
+        squares = rolling_sums(centered ** 2, [w])[0]
+        sums = rolling_sums(centered, [w])[0]
+        stds = np.sqrt(np.maximum(squares - sums ** 2 / w, 0.) / (w - self.ddof))
+
+        # 웰퍼드 상태는 마지막 시간 창에서 두 번 지나가는 방식으로 정확히 구한다.
+        last = values[n - w:]
+        self.count = n
+        self.mean = last.mean()
+        self.m2 = ((last - self.mean) ** 2).sum()
+        self._values[np.arange(n - w, n) % w] = last
+        return means, stds
+
+    def update(self, value):
+        """
+        :param value: float
+            새 봉의 값
+        :return: (float, float)
+            새 봉까지의 이동 평균과 이동 표준편차 (아직 window 개가 안 되면 NaN)
+        """
+        w, i = self.window, self.count % self.window
+        if self.count < w:
+            delta = value - self.mean
+            self.mean += delta / (self.count + 1)
+            self.m2 += delta * (value - self.mean)
+        else:
+            old = self._values[i]
+            mean = self.mean + (value - old) / w
+            self.m2 += (value - old) * (value - mean + old - self.mean)
+            self.mean = mean
+        self._values[i] = value
+        self.count += 1
+        if self.count < w:
+            return np.nan, np.nan
+        return self.mean, self.std
+
+
+class RollingLags(object):
+    """
+    링 버퍼에 최근 값 lags 개를 두고 시차 특징 (lag_1 ... lag_n)을 만든다.
+
+    속성
+    lags: int
+        시차 수
+
+    메서드
+    =======
+    batch:
+        배열 전체의 시차 특징 행렬을 만들고, 상태를 배열의 마지막 값까지로 맞춘다.
+    update:
+        새 봉의 시차 특징을 반환하고 그 봉의 값을 링 버퍼에 넣는다 (O(lags)).
+    features:
+        다음 봉의 시차 특징 (가장 최근 값이 lag_1)
+    """
+
+    def __init__(self, lags):
+        if lags < 1:
+            raise ValueError("lags must be a positive integer.")
+        self.lags = int(lags)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._values = np.full(self.lags, np.nan)
+
+    @property
+    def features(self):
+        order = (self.count - 1 - np.arange(self.lags)) % self.lags
+        return self._values[order]
+
+    def batch(self, values):
+        """
+        :param values: np.ndarray
+            (n,) 형태의 값 배열
+        :return: np.ndarray
+            (n, lags) 형태, k 번째 열은 pandas shift(k)와 같다 (앞쪽은 NaN).
+        """
+        self.reset()
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        padded = np.concatenate((np.full(self.lags, np.nan), values))
+        lagged = sliding_window_view(padded[:-1], self.lags)[:, ::-1].copy()
+        tail = np.arange(max(n - self.lags, 0), n)
+        self._values[tail % self.lags] = values[tail]
+        self.count = n
+        return lagged
+
+    def update(self, value):
+        """
+        :param value: float
+            새 봉의 값
+        :return: np.ndarray
+            새 봉의 (lag_1, ..., lag_n)
+        """
+        lagged = self.features
+        self._values[self.count % self.lags] = value
+        self.count += 1
+        return lagged
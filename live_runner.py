@@ -0,0 +1,457 @@
+# 가격 봉을 스트림으로 받아 이벤트 기반 전략을 실행하는 asyncio 러너와 로컬 재생 서버
+import time
+import math
+import asyncio
+import numpy as np
+import pandas as pd
+from price_store import get_store
+from indicators import RollingMean, RollingMeanStd
+from BacktestBase import Account
+from TBBacktesterRM import TBBacktesterRM
+from trade_ledger import ConsoleSink, BUY, CLOSE
+
+
+def load_series(source, start=None, end=None, column=None):
+    """
+    :param source: str
+        CSV 파일 경로 (.csv) 또는 가격 저장소의 RIC 종목 코드
+    :param column: str
+        CSV에서 쓸 열 (None이면 첫 열)
+    :return: pd.Series
+        날짜 인덱스의 가격 (NaN 제외)
+    """
+    if source.endswith(".csv"):
+        raw = pd.read_csv(source, index_col=0, parse_dates=True)
+        series = raw[column if column is not None else raw.columns[0]].loc[start:end]
+    else:
+        series = get_store().get_frame(source, start, end)[source]
+    return series.dropna()
+
+
+def _encode(series):
+    """봉마다 'date,price\\n' 한 줄. 가격은 repr로 써서 받는 쪽에서 같은 float로 읽힌다."""
+    return [f"{date},{price!r}\n".encode() for date, price in
+            zip(series.index.astype(str), series.values.astype(float).tolist())]
+
+
+def _chunk(rate, batch):
+    """rate 봉/초로 보낼 때 한 번에 보낼 봉 수 (대략 10ms 단위)"""
+    if rate is None:
+        return batch
+    return max(1, min(batch, int(rate / 100)))
+
+
+async def replay_feed(series, rate=None, batch=256):
+    """
+    가격 시계열을 (날짜 문자열, 가격) 봉으로 내보내는 비동기 이터레이터 (소켓 없이).
+    :param rate: float
+        초당 봉 수 (None이면 기다리지 않고 batch 봉마다 이벤트 루프에 양보만 한다)
+    """
+    dates = series.index.astype(str).tolist()
+    prices = series.values.astype(float).tolist()
+    chunk = _chunk(rate, batch)
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    for first in range(0, len(prices), chunk):
+        for i in range(first, min(first + chunk, len(prices))):
+            yield dates[i], prices[i]
+        delay = 0. if rate is None else t0 + (first + chunk) / rate - loop.time()
+        await asyncio.sleep(max(delay, 0.))
+
+
+async def socket_feed(host, port):
+    """ReplayServer에 접속해서 받은 줄을 (날짜 문자열, 가격) 봉으로 내보낸다."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        async for line in reader:
+            date, price = line.decode().split(",")
+            yield date, float(price)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+class ReplayServer(object):
+    """
+    가격 시계열 하나를 TCP 소켓으로 재생하는 로컬 서버. 접속마다 처음부터 끝까지
+    'date,price' 줄을 정해진 속도로 보내고 연결을 닫는다.
+
+    속성
+    series: pd.Series
+        재생할 가격 (load_series로 CSV나 가격 저장소에서 읽는다)
+    host: str
+        바인드할 주소
+    port: int
+        바인드할 포트 (0이면 빈 포트를 골라 start 뒤에 self.port로 알려 준다)
+    rate: float
+        초당 봉 수 (None이면 최대한 빨리)
+    batch: int
+        한 번의 write로 보낼 최대 봉 수
+
+    메서드
+    =======
+    start:
+        서버를 열고 포트를 반환한다.
+    close:
+        서버를 닫는다.
+    """
+
+    def __init__(self, series, host="127.0.0.1", port=0, rate=None, batch=256):
+        self.series = series
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.batch = batch
+        self._lines = _encode(series)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _serve(self, reader, writer):
+        lines, chunk = self._lines, _chunk(self.rate, self.batch)
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        try:
+            for first in range(0, len(lines), chunk):
+                writer.write(b"".join(lines[first:first + chunk]))
+                await writer.drain()
+                if self.rate is not None:
+                    delay = t0 + (first + chunk) / self.rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class SMAStrategy(object):
+    """
+    BacktestLongShort.run_sma_strategy (long_only면 BacktestLongOnly)와 같은 규칙을
+    RollingMean.update로 봉마다 계산한다. BacktestBase.get_data는 수익률이 없는 첫 행을
+    버리므로 첫 가격은 봉으로 세지 않는다 (warmup). 그래서 가격 저장소의 같은 구간
+    (load_series)을 재생하면 봉 번호와 주문이 백테스트와 같다.
+    """
+    warmup = 1
+
+    def __init__(self, SMA1, SMA2, long_only=False):
+        self.SMA1 = SMA1
+        self.SMA2 = SMA2
+        self.long_only = long_only
+        self.reset()
+
+    def reset(self):
+        self.sma1 = RollingMean(self.SMA1)
+        self.sma2 = RollingMean(self.SMA2)
+
+    def warm_up(self, price):
+        pass
+
+    def on_bar(self, account, bar, price):
+        sma1, sma2 = self.sma1.update(price), self.sma2.update(price)
+        if bar < self.SMA2:
+            return
+        if self.long_only:
+            if account.position == 0 and sma1 > sma2:
+                account.buy(bar, price, amount=account.amount)
+                account.position = 1
+            elif account.position == 1 and sma1 < sma2:
+                account.sell(bar, price, amount=account.amount)
+                account.position = 0
+        elif account.position in [0, -1]:
+            if sma1 > sma2:
+                account.go_long(bar, price, amount='all')
+                account.position = 1
+        elif sma1 < sma2:
+            account.go_short(bar, price, amount='all')
+            account.position = -1
+
+
+class MomentumStrategy(object):
+    """
+    BacktestLongShort.run_momentum_strategy와 같은 규칙 (최근 momentum 봉의 평균 로그 수익률의 부호).
+    첫 가격은 첫 봉의 수익률을 계산하는 데만 쓴다 (BacktestBase.get_data의 dropna와 같다).
+    """
+    warmup = 1
+
+    def __init__(self, momentum):
+        self.momentum = momentum
+        self.reset()
+
+    def reset(self):
+        self.mean = RollingMean(self.momentum)
+        self.last = math.nan
+
+    def warm_up(self, price):
+        self.last = price
+
+    def on_bar(self, account, bar, price):
+        mom = self.mean.update(math.log(price / self.last))
+        self.last = price
+        if bar < self.momentum:
+            return
+        if account.position in [0, -1]:
+            if mom > 0:
+                account.go_long(bar, price, amount='all')
+                account.position = 1
+        elif mom <= 0:
+            account.go_short(bar, price, amount='all')
+            account.position = -1
+
+
+class _StreamBacktesterRM(TBBacktesterRM):
+    """봉의 날짜와 가격을 env.data 대신 LiveRunner가 받은 봉에서 읽는 TBBacktesterRM"""
+
+    def __init__(self, runner, env, model):
+        super().__init__(env, model, runner.initial_amount, runner.ftc, runner.ptc,
+                         runner.verbose, runner.sink)
+        self.dates = runner.dates
+        self.prices = runner.prices
+
+    def get_date_price(self, bar):
+        return self.dates[bar][:10], self.prices[bar]
+
+    @property
+    def amount(self):
+        return self.current_balance
+
+
+class ModelStrategy(object):
+    """
+    TBBacktesterRM.backtest_strategy를 스트림에서 실행한다. 신호는 env.get_state(bar)에 대한
+    model.predict의 argmax이고, 주문은 TBBacktesterRM._step을 그대로 써서 손절 (sl),
+    추적 손절 (tsl), 이익 실현 (tp), 대기 (wait)와 BacktestBaseRM의 주문 계산 (전 봉 가격)이 같다.
+    Finance 환경의 특징 (가격, r, s, m, v)은 RollingMean, RollingMeanStd.update로 이어서
+    계산하고, 학습 환경의 mu, std로 정규화한 최근 lags 개의 행을 float32 상태로 쓴다.
+    env.raw[env.symbol]을 env.start부터 재생하면 특징이 다 생기기 전의 window 개 가격은
+    봉으로 세지 않으므로 (warmup), 봉 번호와 주문이 백테스트와 같다.
+
+    속성
+    model: object
+        predict((1, lags, n_features)) -> (1, lags, 2)인 모델
+    env: Finance
+        특징, 시간 창, lags, mu, std를 가져올 환경
+    sl, tsl, tp, wait, guarantee:
+        TBBacktesterRM.backtest_strategy의 인자
+    signals: list
+        상태가 만들어진 봉마다의 신호 (1, -1)
+    """
+
+    def __init__(self, model, env, sl=None, tsl=None, tp=None, wait=5, guarantee=False):
+        self.model = model
+        self.env = env
+        self.sl = sl
+        self.tsl = tsl
+        self.tp = tp
+        self.wait = wait
+        self.guarantee = guarantee
+        self.warmup = env.window
+        self.mu = env.mu[env.features].values
+        self.std = env.std[env.features].values
+        self.reset()
+
+    def reset(self):
+        env = self.env
+        self.s = RollingMean(env.window)
+        self.mv = RollingMeanStd(env.window)
+        self.last = math.nan
+        self.rows = np.zeros((env.lags, env.n_features), dtype=np.float32)
+        self.count = 0
+        self.signals = []
+
+    def account(self, runner):
+        """backtest_strategy의 시작 상태와 같은 계좌 (주문은 TBBacktesterRM의 것을 쓴다)"""
+        bt = _StreamBacktesterRM(runner, self.env, self.model)
+        bt.position = 0
+        bt.wait = 0
+        bt.sl, bt.tsl, bt.tp = self.sl, self.tsl, self.tp
+        return bt
+
+    def warm_up(self, price):
+        self._update(price)
+
+    def _update(self, price):
+        """이 봉의 특징 행을 링 버퍼에 넣는다 (특징이 다 있는 봉만)."""
+        if self.last != self.last:
+            self.last = price
+            return
+        r = math.log(price / self.last)
+        self.last = price
+        values = {self.env.symbol: price, "r": r, "s": self.s.update(price)}
+        values["m"], values["v"] = self.mv.update(r)
+        row = np.array([values[feature] for feature in self.env.features])
+        if np.isnan(row).any():
+            return
+        self.rows[self.count % self.env.lags] = (row - self.mu) / self.std
+        self.count += 1
+
+    def on_bar(self, account, bar, price):
+        lags = self.env.lags
+        net_wealth = None
+        if self.count >= lags:
+            state = np.roll(self.rows, -(self.count % lags), axis=0)
+            action = np.argmax(self.model.predict(state[None])[0, 0])
+            signal = 1 if action == 1 else -1
+            self.signals.append(signal)
+            net_wealth = account._step(bar, signal, self.wait, self.guarantee)
+        self._update(price)
+        return net_wealth
+
+
+class LiveRunner(object):
+    """
+    비동기 이터레이터 (replay_feed, socket_feed)에서 (날짜, 가격) 봉을 받을 때마다
+    strategy.on_bar(account, bar, price)를 불러 주문을 내게 하고, 봉마다의 결정 지연 시간
+    (봉을 받은 뒤 전략과 순자산 평가가 끝날 때까지)을 나노초로 기록한다.
+    계좌는 BacktestBase의 빠른 엔진과 같은 Account를 쓰므로 주문 계산과 거래 기록이 같다.
+    전략에 account(runner)가 있으면 그 계좌를 쓰고 (ModelStrategy는 TBBacktesterRM),
+    on_bar가 순자산을 반환하면 그 값을 기록한다. 처음 strategy.warmup 개의 가격은
+    봉으로 세지 않고 strategy.warm_up(price)에만 넘긴다 (오프라인 백테스터가 버리는 행).
+
+    속성
+    strategy: object
+        reset(), warm_up(price), on_bar(account, bar, price)가 있는 전략
+        (SMAStrategy, MomentumStrategy, ModelStrategy)
+    amount: float
+        처음 잔고
+    ftc: float
+        거래당 고정 거래 비용
+    ptc: float
+        거래당 비례 거래비용
+    verbose: bool
+        주문이 날 때마다 주문, 잔고, 순자산 줄을 sink에 쓴다.
+    sink: object
+        콘솔 출력을 받을 write(줄), flush() 객체 (None이면 ConsoleSink)
+
+    메서드
+    =======
+    run:
+        피드가 끝날 때까지 봉을 처리하고 마지막 봉에서 close_out 한다 (코루틴).
+    latency_stats:
+        결정 지연 시간의 분포와 처리 속도를 반환한다.
+    get_ledger:
+        거래 기록을 데이터프레임으로 반환한다.
+    """
+
+    def __init__(self, strategy, amount, ftc=0., ptc=0., verbose=False, sink=None):
+        self.strategy = strategy
+        self.initial_amount = amount
+        self.ftc = ftc
+        self.ptc = ptc
+        self.verbose = verbose
+        self.sink = sink if sink is not None else ConsoleSink()
+        self.reset()
+
+    def reset(self):
+        self.dates = []
+        self.prices = []
+        if hasattr(self.strategy, "account"):
+            self.account = self.strategy.account(self)
+        else:
+            self.account = Account(self.initial_amount, self.ftc, self.ptc)
+        self.latencies = None
+        self.net_wealths = None
+        self.elapsed = 0.
+
+    async def run(self, feed):
+        """
+        :param feed: async iterator
+            (날짜 문자열, 가격) 봉을 내보내는 비동기 이터레이터
+        """
+        self.strategy.reset()
+        self.reset()
+        account, ledger = self.account, self.account.ledger
+        dates, prices, wealths, latencies = self.dates, self.prices, [], []
+        on_bar, clock = self.strategy.on_bar, time.perf_counter_ns
+        warmup = getattr(self.strategy, "warmup", 0)
+        log = self.verbose and isinstance(account, Account)
+        logged = 0
+        t_start = time.perf_counter()
+        async for date, price in feed:
+            if warmup:
+                warmup -= 1
+                self.strategy.warm_up(price)
+                continue
+            t0 = clock()
+            bar = len(prices)
+            dates.append(date)
+            prices.append(price)
+            net_wealth = on_bar(account, bar, price)
+            wealths.append(account.units * price + account.amount
+                           if net_wealth is None else net_wealth)
+            latencies.append(clock() - t0)
+            if log and len(ledger) > logged:
+                self._log_orders(ledger.records[logged:])
+                logged = len(ledger)
+        self.elapsed = time.perf_counter() - t_start
+        self.latencies = np.array(latencies, dtype=np.int64)
+        self.net_wealths = pd.DataFrame({"net_wealth": wealths},
+                                        index=pd.DatetimeIndex(dates, name="date"))
+        if prices:
+            self.close_out(len(prices) - 1)
+
+    def _log_orders(self, records):
+        for bar, side, units, price, _, amount, net_wealth in records.tolist():
+            date = self.dates[bar][:10]
+            self.sink.write(f"{date} | {'buying' if side == BUY else 'selling'} {units} units at {price:.2f}")
+            self.sink.write(f"{date} | current balance {amount:.2f}")
+            self.sink.write(f"{date} | current net wealth {net_wealth:.2f}")
+
+    def close_out(self, bar):
+        """BacktestBase.close_out과 같이 남은 단위를 정리하고 거래를 하나 센다."""
+        if not isinstance(self.account, Account):
+            return self.account.close_out(bar)
+        account, price = self.account, self.prices[bar]
+        inventory = account.units
+        account.amount += account.units * price
+        account.units = 0
+        account.trades += 1
+        account.ledger.append(bar, CLOSE, inventory, price, 0., account.amount, account.amount)
+        if self.verbose:
+            self.sink.write(f"{self.dates[bar][:10]} | inventory {account.units} units at {price:.2f}")
+            self.sink.write("=" * 55)
+        self.sink.write("Final balance [$] {:.2f}".format(account.amount))
+        perf = ((account.amount - self.initial_amount) / self.initial_amount * 100)
+        self.sink.write("Net Performance [%] {:.2f}".format(perf))
+        self.sink.write("Trades Executed [#] {:.2f}".format(account.trades))
+        self.sink.write("=" * 55)
+        self.sink.flush()
+
+    @property
+    def amount(self):
+        return self.account.amount
+
+    @property
+    def trades(self):
+        return self.account.trades
+
+    def latency_stats(self):
+        """
+        :return: pd.Series
+            처리한 봉 수 (bars), 초당 봉 수 (bars_per_sec), 결정 지연 시간의
+            평균과 50/90/99 백분위수, 최대 [마이크로초]
+        """
+        us = self.latencies / 1000.
+        p50, p90, p99 = np.percentile(us, [50, 90, 99]) if len(us) else (np.nan,) * 3
+        return pd.Series({"bars": len(us),
+                          "bars_per_sec": len(us) / self.elapsed if self.elapsed else np.nan,
+                          "mean_us": us.mean() if len(us) else np.nan,
+                          "p50_us": p50, "p90_us": p90, "p99_us": p99,
+                          "max_us": us.max() if len(us) else np.nan})
+
+    def get_ledger(self):
+        return self.account.ledger.to_frame(pd.DatetimeIndex(self.dates))
@@ -1,6 +1,8 @@
 # 모멘텀 기반 전략들을 대상으로 벡터화 백테스트를 하는 데 쓸 클래스
 import pandas as pd
 import numpy as np
+from price_store import get_store
+from indicators import rolling_means, ffill, RollingMean
 
 
 class MomVectorBacktester(object):
@@ -25,6 +27,10 @@ class MomVectorBacktester(object):
         기본 데이터 집합을 검색해 준비해 둔다
     run_strategy:
         모멘텀기반 전략에 대한 백테스트를 실행
+    run_many:
+        여러 모멘텀 기간에 대한 백테스트를 한 번에 실행
+    append:
+        새 봉들을 이어 붙이고 새 행들에 대해서만 전략 결과를 갱신
     plot_results:
         종목코드와 비교되는 전략의 성과를 그려낸다.
     """
@@ -36,36 +42,152 @@ class MomVectorBacktester(object):
         self.start = start
         self.end = end
         self.results = None
+        self.indicators = {}
+        self._carry = None
         self.get_data()
 
     def get_data(self):
-        raw = pd.read_csv("http://hilpisch.com/pyalgo_eikon_eod_data.csv",
-                          index_col=0, parse_dates=True).dropna()
-        raw = pd.DataFrame(raw[self.symbol])
-        raw = raw.loc[self.start: self.end]
+        raw = get_store().get_frame(self.symbol, self.start, self.end, copy=False)
         raw.rename(columns={self.symbol: 'price'}, inplace=True)
         raw["return"] = np.log(raw / raw.shift(1))
         self.data = raw
 
-    def run_strategy(self, momentum=1):
+    def run_strategy(self, momentum=1, results="full"):
+        """
+        :param momentum: int
+            평균 수익 계산 일수
+        :param results: str
+            'full'이면 결과 데이터프레임을 self.results에 남기고,
+            'summary'면 NumPy 배열로만 계산해서 최종 성과만 반환한다.
+        """
         self.momentum = momentum
+        if results == "summary":
+            aperf, operf, trades = self._momentum_performance([momentum])
+            return round(aperf[0], 2), round(operf[0], 2),
         data = self.data.copy().dropna()
-        data["position"] = np.sign(data["return"].rolling(momentum).mean())
+        self.indicators["momentum"] = RollingMean(momentum)
+        data["position"] = np.sign(self.indicators["momentum"].batch(data["return"].values))
         data["strategy"] = data["position"].shift(1) * data['return']
         # 거래 성사 시기를 결정한다.
         data.dropna(inplace=True)
         trades = data["position"].diff().fillna(0) != 0
         # 거래가 성사시 수익에서 거래 비용을 뺀다.
         data["strategy"][trades] -= self.tc
-        data["creturns"] = self.amount * data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = self.amount * data['strategy'].cumsum().apply(np.exp)
+        return self._accumulate(data, {"momentum": momentum})
+
+    def _accumulate(self, data, params):
+        """
+        누적 성과 열을 붙여 self.results로 두고, append가 이어서 누적할 수 있도록
+        마지막 누적 로그 수익과 전략 파라미터를 남긴다.
+        """
+        creturns = data["return"].cumsum()
+        cstrategy = data["strategy"].cumsum()
+        data["creturns"] = self.amount * creturns.apply(np.exp)
+        data["cstrategy"] = self.amount * cstrategy.apply(np.exp)
         self.results = data
+        self._carry = {"params": params,
+                       "creturns": np.nan_to_num(creturns.values[-1:]),
+                       "cstrategy": np.nan_to_num(cstrategy.values[-1:])}
         # 전략의 절대 성과
         aperf = data["cstrategy"].iloc[-1]
         # 전략의 초과성과/미달성과
         operf = aperf - data['creturns'].iloc[-1]
         return round(aperf, 2), round(operf, 2),
 
+    def append(self, bars):
+        """
+        새 봉들을 self.data 뒤에 이어 붙이고, 보관한 지표 상태와 마지막 포지션, 누적 수익에서
+        이어서 새 행들의 포지션, 전략 수익, 누적 성과만 계산한다. 몇 번을 이어 붙여도 결과는
+        늘어난 데이터 전체에 run_strategy를 다시 실행한 것과 같다.
+        :param bars: pd.Series 또는 pd.DataFrame
+            날짜 인덱스의 종가 ('price' 열이나 종목 코드 열이 있는 데이터프레임도 된다)
+        :return: tuple
+            run_strategy와 같은 (aperf, operf), 아직 run_strategy를 실행하지 않았으면 None
+        """
+        new = self._extend_data(bars)
+        if self._carry is None:
+            return None
+        if len(self.results) == 0:
+            # 아직 시간 창을 채운 날이 없었으면 늘어난 데이터로 다시 실행한다.
+            return self.run_strategy(**self._carry["params"])
+        new = self._update_positions(new)
+        previous = np.concatenate((self.results["position"].values[-1:],
+                                   new["position"].values[:-1]))
+        new["strategy"] = previous * new["return"].values
+        # 거래가 성사시 수익에서 거래 비용을 뺀다.
+        trades = new["position"].values != previous
+        new.loc[trades, "strategy"] -= self.tc
+        for column in ["creturns", "cstrategy"]:
+            source = "return" if column == "creturns" else "strategy"
+            cumulative = np.cumsum(np.concatenate((self._carry[column], new[source].values)))
+            self._carry[column] = cumulative[-1:]
+            new[column] = self.amount * np.exp(cumulative[1:])
+        self.results = pd.concat([self.results, new[self.results.columns]])
+        aperf = self.results["cstrategy"].iloc[-1]
+        operf = aperf - self.results['creturns'].iloc[-1]
+        return round(aperf, 2), round(operf, 2),
+
+    def _extend_data(self, bars):
+        """새 봉들의 수익률을 계산해 self.data 뒤에 붙이고 새 행들을 반환한다."""
+        if isinstance(bars, pd.DataFrame):
+            bars = bars["price"] if "price" in bars else bars[self.symbol]
+        bars = bars.dropna()
+        if len(bars) and not (bars.index.is_monotonic_increasing and bars.index.is_unique
+                              and (self.data.empty or bars.index[0] > self.data.index[-1])):
+            raise ValueError("New bars must be in date order and after the last date in the data.")
+        price = bars.values.astype(np.float64)
+        last = self.data["price"].values[-1:] if len(self.data) else [np.nan]
+        previous = np.concatenate((last, price[:-1]))
+        new = pd.DataFrame({"price": price, "return": np.log(price / previous)},
+                           index=pd.DatetimeIndex(bars.index, name=self.data.index.name))
+        self.data = pd.concat([self.data, new])
+        return new
+
+    def _update_positions(self, new):
+        """보관한 모멘텀 상태로 새 행들의 포지션을 계산한다."""
+        momentum = self.indicators["momentum"]
+        new["position"] = np.sign([momentum.update(value) for value in new["return"].values])
+        return new
+
+    def run_many(self, momenta):
+        """
+        여러 모멘텀 기간에 대한 전략 성과를 결과 데이터프레임을 만들지 않고 한 번에 계산한다.
+        각 기간의 aperf, operf는 run_strategy(momentum)와 같다.
+        :param momenta: int 시퀀스
+            평균 수익 계산 일수
+        :return: pd.DataFrame
+            모멘텀 기간별 aperf, operf, trades
+        """
+        momenta = np.asarray(momenta, dtype=int)
+        aperf, operf, trades = self._momentum_performance(momenta)
+        return pd.DataFrame({"aperf": aperf.round(2), "operf": operf.round(2),
+                             "trades": trades},
+                            index=pd.Index(momenta, name="momentum"))
+
+    def _momentum_performance(self, momenta):
+        """모멘텀 기간별 (aperf, operf, 거래 횟수) 배열을 반올림 없이 반환한다."""
+        returns = self.data["return"].values
+        returns = returns[~(np.isnan(returns) | np.isnan(self.data["price"].values))]
+        momenta = np.asarray(momenta, dtype=int)
+        n = len(returns)
+
+        # run_strategy의 RollingMean.batch와 비트 단위로 같은 이동 평균의 부호
+        position = np.sign(rolling_means(returns, momenta))
+        # run_strategy의 dropna() 이후 구간: 전략 수익은 momentum 번째 날부터,
+        # 거래는 그 다음 날부터 센다.
+        day = np.arange(1, n)
+        trades = (position[:, 1:] != position[:, :-1]) & (day > momenta[:, None])
+        strategy = np.where(day >= momenta[:, None], position[:, :-1] * returns[1:], 0.)
+        strategy = strategy.sum(axis=1) - self.tc * trades.sum(axis=1)
+        creturns = np.concatenate(([0.], np.cumsum(returns)))
+        benchmark = creturns[n] - creturns[np.minimum(momenta, n)]
+
+        aperf = self.amount * np.exp(strategy)
+        operf = aperf - self.amount * np.exp(benchmark)
+        aperf[momenta >= n] = np.nan
+        operf[momenta >= n] = np.nan
+        return aperf, operf, trades.sum(axis=1)
+
     def plot_results(self):
         if self.results is None:
             print("No results to plot yet. Run a strategy.")
@@ -97,13 +219,30 @@ class MRVectorBacktester(MomVectorBacktester):
         기본 데이터 집합을 검색해 준비해 둔다
     run_strategy:
         평균 회귀 기반 전략에 대한 백테스트를 실행
+    sweep:
+        (SMA, 임계값) 격자 전체에 대한 백테스트를 한 번에 실행
+    append:
+        새 봉들을 이어 붙이고 새 행들에 대해서만 전략 결과를 갱신
     plot_results:
         종목코드와 비교되는 전략의 성과를 그려낸다.
     """
 
-    def run_strategy(self, SMA, threshold):
+    def run_strategy(self, SMA, threshold, results="full"):
+        """
+        :param SMA: int
+            일 단위 단순 이동 평균
+        :param threshold: float
+            SMA에 대한 편차 기반 신호의 절대 값
+        :param results: str
+            'full'이면 결과 데이터프레임을 self.results에 남기고,
+            'summary'면 NumPy 배열로만 계산해서 최종 성과만 반환한다.
+        """
+        if results == "summary":
+            aperf, operf = self._mean_reversion_performance([SMA], [threshold])
+            return round(aperf[0, 0], 2), round(operf[0, 0], 2),
         data = self.data.copy().dropna()
-        data["sma"] = data["price"].rolling(SMA).mean()
+        self.indicators["sma"] = RollingMean(SMA)
+        data["sma"] = self.indicators["sma"].batch(data["price"].values)
         data["distance"] = data["price"] - data["sma"]
         data.dropna(inplace=True)
 
@@ -123,11 +262,74 @@ class MRVectorBacktester(MomVectorBacktester):
 
         # 거래가 성사 되었을 때 수익에서 거래 비용을 뺀다.
         data["strategy"][trades] -= self.tc
-        data["creturns"] = self.amount * data["return"].cumsum().apply(np.exp)
-        data["cstrategy"] = self.amount * data['strategy'].cumsum().apply(np.exp)
-        self.results = data
-        # 전략의 절대 성과
-        aperf = data["cstrategy"].iloc[-1]
-        # 전략의 초과성과/미달성과
-        operf = aperf - data['creturns'].iloc[-1]
-        return round(aperf, 2), round(operf, 2),
+        return self._accumulate(data, {"SMA": SMA, "threshold": threshold})
+
+    def _update_positions(self, new):
+        """보관한 SMA 상태와 마지막 거리, 포지션으로 새 행들의 포지션을 계산한다."""
+        threshold = self._carry["params"]["threshold"]
+        sma = self.indicators["sma"]
+        new["sma"] = [sma.update(value) for value in new["price"].values]
+        new["distance"] = new["price"] - new["sma"]
+        distance = new["distance"].values
+        previous = np.concatenate((self.results["distance"].values[-1:], distance[:-1]))
+        position = np.where(distance > threshold, -1, np.nan)
+        position = np.where(distance < -threshold, 1, position)
+        position = np.where(distance * previous < 0, 0, position)
+        position = ffill(np.concatenate((self.results["position"].values[-1:], position)))
+        new["position"] = position[1:]
+        return new
+
+    def sweep(self, SMAs, thresholds):
+        """
+        (SMA, threshold) 격자 전체에 대한 평균 회귀 전략의 성과를 배열 연산으로 한 번에 계산한다.
+        각 칸의 결과는 run_strategy(SMA, threshold)와 같다.
+        :param SMAs: int 시퀀스
+            일 단위 단순 이동 평균
+        :param thresholds: float 시퀀스
+            SMA에 대한 편차 기반 신호의 절대 값
+        :return: pd.DataFrame
+            (SMA, threshold) 조합별 aperf, operf
+        """
+        SMAs = np.asarray(SMAs, dtype=int)
+        thresholds = np.asarray(thresholds, dtype=float)
+        aperf, operf = self._mean_reversion_performance(SMAs, thresholds)
+        index = pd.MultiIndex.from_product([SMAs, thresholds], names=["SMA", "threshold"])
+        return pd.DataFrame({"aperf": aperf.ravel(), "operf": operf.ravel()},
+                            index=index).round(2)
+
+    def _mean_reversion_performance(self, SMAs, thresholds):
+        """(SMA, threshold) 조합별 (aperf, operf) 배열을 반올림 없이 반환한다."""
+        price = self.data["price"].values
+        returns = self.data["return"].values
+        rows = ~(np.isnan(price) | np.isnan(returns))
+        price, returns = price[rows], returns[rows]
+        SMAs = np.asarray(SMAs, dtype=int)
+        thresholds = np.asarray(thresholds, dtype=float)
+        n = len(price)
+
+        # SMA는 run_strategy의 RollingMean.batch와 비트 단위로 같은 rolling_means로 한 번에 구하고,
+        # 나머지는 (SMA, threshold, 일자) 형태로 브로드캐스트해서 계산한다.
+        sma = rolling_means(price, SMAs)
+        distance = (price - sma)[:, None, :]
+        threshold = thresholds[None, :, None]
+        position = np.where(distance > threshold, -1., np.nan)
+        position = np.where(distance < -threshold, 1., position)
+        cross = np.zeros(distance.shape, dtype=bool)
+        cross[..., 1:] = distance[..., 1:] * distance[..., :-1] < 0
+        position = np.where(cross, 0., position)
+        position = np.nan_to_num(ffill(position))
+
+        # run_strategy의 dropna() 이후 구간: SMA가 처음 정의된 날은 SMA-1,
+        # 전략 수익과 거래는 그 다음 날부터 센다.
+        active = np.arange(1, n) >= SMAs[:, None, None]
+        trades = position[..., 1:] != position[..., :-1]
+        strategy = position[..., :-1] * returns[1:] - self.tc * trades
+        strategy = np.where(active, strategy, 0.).sum(axis=-1)
+        creturns = np.concatenate(([0.], np.cumsum(returns)))
+        benchmark = creturns[n] - creturns[np.minimum(SMAs - 1, n)]
+
+        aperf = self.amount * np.exp(strategy)
+        operf = aperf - self.amount * np.exp(benchmark)[:, None]
+        aperf[SMAs > n] = np.nan
+        operf[SMAs > n] = np.nan
+        return aperf, operf
@@ -0,0 +1,137 @@
+# 여러 종목을 (일자 x 종목) 배열 하나로 한꺼번에 벡터화 백테스트하는 클래스
+import numpy as np
+import pandas as pd
+from price_store import get_store
+from indicators import rolling_means
+
+
+class PanelBacktestBase(object):
+    """
+    종목별로 값이 빠진 날짜가 서로 달라도 한 번에 처리할 수 있도록, 각 종목의 유효한
+    관측치를 배열 위쪽으로 모으고 (종목마다 dropna 한 것과 같음) 남는 아래쪽은 마스크로 처리한다.
+
+    속성
+    symbols: list
+        작업에 쓸 RIC 종목 코드 목록 (None이면 가격 저장소의 모든 종목)
+    start: str
+        데이터 선택한 시작 부분에 해당하는 날짜
+    end: str
+        데이터 선택한 끝 부분에 해당하는 날짜
+    common: bool
+        True면 모든 종목에 값이 있는 날짜만 쓴다 (단일 종목 백테스터의 get_data와 같음)
+
+    메서드
+    =======
+    get_data:
+        기본 데이터 패널을 검색해 준비한다.
+    """
+
+    def __init__(self, symbols, start, end, common=False):
+        if symbols is None:
+            symbols = get_store().symbols
+        self.symbols = list(symbols)
+        self.start = start
+        self.end = end
+        self.common = common
+        self.results = None
+        self.get_data()
+
+    def get_data(self):
+        raw = get_store().get_frame(self.symbols, self.start, self.end, dropna=self.common)
+        values = raw.values
+        valid = ~np.isnan(values)
+        # 종목마다 유효한 관측치를 순서대로 위로 모은다.
+        order = np.argsort(~valid, axis=0, kind="stable")
+        self.price = np.take_along_axis(values, order, axis=0)
+        self.counts = valid.sum(axis=0)
+        self.dates = raw.index.values[order]
+        self.returns = np.full(self.price.shape, np.nan)
+        self.returns[1:] = np.log(self.price[1:] / self.price[:-1])
+
+    def _summarize(self, strategy, returns, kept, amount=1.):
+        """전략 수익과 기본 수익을 종목별로 합해서 aperf, operf 표를 만든다."""
+        strategy = np.where(kept, strategy, 0.).sum(axis=0)
+        benchmark = np.where(kept, returns, 0.).sum(axis=0)
+        aperf = amount * np.exp(strategy)
+        operf = aperf - amount * np.exp(benchmark)
+        aperf[~kept.any(axis=0)] = np.nan
+        operf[~kept.any(axis=0)] = np.nan
+        self.results = pd.DataFrame({"aperf": aperf.round(2), "operf": operf.round(2),
+                                     "days": kept.sum(axis=0)},
+                                    index=pd.Index(self.symbols, name="symbol"))
+        return self.results
+
+
+class SMAPanelBacktester(PanelBacktestBase):
+    """
+    SMA 기반 전략을 여러 종목에 대해 한 번에 백테스트한다.
+    종목별 결과는 그 종목만으로 SMAVectorBacktester.run_strategy를 실행한 것과 같다.
+
+    속성
+    SMA1: int
+        상대적 단기 SMA를 위한 일별 시간 창
+    SMA2: int
+        상대적 장기 SMA를 위한 일별 시간 창
+
+    메서드
+    =======
+    run_strategy:
+        모든 종목에 대해 SMA 기반 전략에 대한 백테스트를 실행한다.
+    """
+
+    def __init__(self, symbols, SMA1, SMA2, start, end, common=False):
+        self.SMA1 = SMA1
+        self.SMA2 = SMA2
+        super().__init__(symbols, start, end, common)
+
+    def run_strategy(self, SMA1=None, SMA2=None):
+        if SMA1 is not None:
+            self.SMA1 = SMA1
+        if SMA2 is not None:
+            self.SMA2 = SMA2
+        sma1, sma2 = rolling_means(self.price, [self.SMA1, self.SMA2])
+        valid = ~(np.isnan(sma1) | np.isnan(sma2) | np.isnan(self.returns))
+        position = np.where(sma1 > sma2, 1., -1.)
+        # 포지션이 있는 날의 다음 날 수익부터 센다.
+        kept = valid[:-1] & valid[1:]
+        strategy = position[:-1] * self.returns[1:]
+        return self._summarize(strategy, self.returns[1:], kept)
+
+
+class MomPanelBacktester(PanelBacktestBase):
+    """
+    모멘텀 기반 전략을 여러 종목에 대해 한 번에 백테스트한다.
+    종목별 결과는 그 종목만으로 MomVectorBacktester.run_strategy를 실행한 것과 같다.
+
+    속성
+    amount: int, float
+        종목마다 처음에 투자할 금액
+    tc: float
+        거래당 비례 거래비용 (예: 0.5% = 0.005)
+
+    메서드
+    =======
+    run_strategy:
+        모든 종목에 대해 모멘텀 기반 전략에 대한 백테스트를 실행한다.
+    """
+
+    def __init__(self, symbols, start, end, amount, tc, common=False):
+        self.amount = amount
+        self.tc = tc
+        super().__init__(symbols, start, end, common)
+
+    def run_strategy(self, momentum=1):
+        self.momentum = momentum
+        # 첫날의 NaN 수익률을 뺀 수익률 패널 (MomVectorBacktester의 dropna()와 같음)
+        returns = self.returns[1:]
+        # 종목마다 첫 수익률을 빼는 rolling_means는 run_strategy의 RollingMean.batch와 같다.
+        position = np.sign(rolling_means(returns, [momentum])[0])
+        valid = ~(np.isnan(position) | np.isnan(returns))
+        kept = valid[:-1] & valid[1:]
+        # 전날과 오늘이 모두 남아 있는 날의 포지션 변화만 거래로 센다.
+        trades = np.zeros(kept.shape, dtype=bool)
+        trades[1:] = kept[1:] & kept[:-1] & (position[2:] != position[1:-1])
+        strategy = position[:-1] * returns[1:] - self.tc * trades
+        results = self._summarize(strategy, returns[1:], kept, self.amount)
+        results["trades"] = trades.sum(axis=0)
+        return results
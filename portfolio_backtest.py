@@ -0,0 +1,197 @@
+# 여러 종목이 현금 계좌 하나를 함께 쓰는 이벤트 기반 포트폴리오 백테스트 클래스
+import numpy as np
+import pandas as pd
+from price_store import get_store
+from indicators import ffill, rolling_sums, rolling_means
+from trade_ledger import ConsoleSink
+
+
+class BacktestPortfolio(object):
+    """
+    종목별 보유 단위를 배열로 두고, 모든 종목을 봉마다 함께 진행한다.
+    주문의 단위 계산 (int(amount / price))과 거래 비용은 BacktestBase.place_buy_order,
+    place_sell_order와 같고, 한 봉에 여러 종목의 주문을 배열로 한 번에 낸다.
+    순자산 (현금 + 보유 단위 * 가격)은 봉마다 벡터로 평가해서 self.net_wealths에 남긴다.
+
+    속성
+    symbols: list
+        작업에 쓸 RIC 종목 코드 목록 (None이면 가격 저장소의 모든 종목)
+    start: str
+        데이터 선택한 시작 부분에 해당하는 날짜
+    end: str
+        데이터 선택한 끝 부분에 해당하는 날짜
+    amount: float
+        처음 현금
+    ftc: float
+        주문당 고정 거래 비용
+    ptc: float
+        주문당 비례 거래비용
+    prices: pd.DataFrame
+        이미 있는 (일자 x 종목) 가격 (주면 가격 저장소를 읽지 않는다)
+    sink: object
+        콘솔 출력을 받을 write(줄), flush() 객체 (None이면 ConsoleSink)
+
+    메서드
+    =======
+    get_data:
+        (일자 x 종목) 가격 배열을 준비한다. 상장 전의 NaN은 주문할 수 없고 가치는 0으로 본다.
+    place_buy_order:
+        종목별 단위 또는 금액 배열로 매수 주문을 넣는다.
+    place_sell_order:
+        종목별 단위 또는 금액 배열로 매도 주문을 넣는다.
+    close_out:
+        모든 종목의 보유 단위를 정리한다.
+    run:
+        봉마다 strategy(bar, 가격 행, 백테스터)를 불러 주문을 내게 하는 백테스트를 실행한다.
+    run_sma_strategy:
+        종목별 SMA 교차 (롱 전용) 전략을 현금을 나눠 쓰며 실행한다.
+    """
+
+    def __init__(self, symbols, start, end, amount, ftc=0., ptc=0., verbose=False,
+                 prices=None, sink=None):
+        self.start = start
+        self.end = end
+        self.initial_amount = amount
+        self.ftc = ftc
+        self.ptc = ptc
+        self.verbose = verbose
+        self.sink = sink if sink is not None else ConsoleSink()
+        if prices is None:
+            if symbols is None:
+                symbols = get_store().symbols
+            prices = get_store().get_frame(symbols, start, end, dropna=False)
+        self.symbols = list(prices.columns)
+        self.get_data(prices)
+        self.reset()
+
+    def get_data(self, prices):
+        self.index = prices.index
+        self.price = np.ascontiguousarray(prices.values, dtype=np.float64)
+        # 쉬는 날은 직전 가격으로 평가하고, 첫 가격 전에는 보유할 수 없으므로 0으로 평가한다.
+        self.marks = np.nan_to_num(ffill(self.price.T).T)
+
+    def reset(self):
+        self.amount = self.initial_amount
+        self.units = np.zeros(len(self.symbols), dtype=np.int64)
+        self.trades = 0
+        self.net_wealths = None
+
+    def _order_units(self, bar, units, amount):
+        """주문할 종목의 마스크와 종목별 단위 (금액이면 int(amount / price)처럼 0 쪽으로 버림)"""
+        price = self.price[bar]
+        if units is None:
+            amount = np.broadcast_to(np.asarray(amount, dtype=np.float64), price.shape)
+            mask = amount != 0
+        else:
+            units = np.broadcast_to(np.asarray(units, dtype=np.int64), price.shape)
+            mask = units != 0
+        # 가격이 없는 종목은 단위를 계산하기 전에 거른다 (NaN을 정수로 바꾸지 않도록).
+        if np.isnan(price[mask]).any():
+            raise ValueError("No price for " + ", ".join(
+                np.asarray(self.symbols)[mask & np.isnan(price)]))
+        if units is None:
+            units = np.zeros(price.shape, dtype=np.int64)
+            units[mask] = np.trunc(amount[mask] / price[mask])
+        return mask, units, price
+
+    def place_buy_order(self, bar, units=None, amount=None):
+        """
+        :param units: int 또는 np.ndarray
+            종목별 매수 단위 (0이면 그 종목은 주문하지 않는다)
+        :param amount: float 또는 np.ndarray
+            종목별 매수 금액 (units가 None일 때)
+        """
+        mask, units, price = self._order_units(bar, units, amount)
+        value = units[mask] * price[mask]
+        self.amount -= np.sum(value * (1 + self.ptc) + self.ftc)
+        self.units[mask] += units[mask]
+        self.trades += int(mask.sum())
+        if self.verbose:
+            self._log_orders(bar, "buying", mask, units, price)
+
+    def place_sell_order(self, bar, units=None, amount=None):
+        mask, units, price = self._order_units(bar, units, amount)
+        value = units[mask] * price[mask]
+        self.amount += np.sum(value * (1 - self.ptc) - self.ftc)
+        self.units[mask] -= units[mask]
+        self.trades += int(mask.sum())
+        if self.verbose:
+            self._log_orders(bar, "selling", mask, units, price)
+
+    def _log_orders(self, bar, side, mask, units, price):
+        date = str(self.index[bar])[:10]
+        for i in np.flatnonzero(mask):
+            self.sink.write(f"{date} | {side} {units[i]} {self.symbols[i]} at {price[i]:.2f}")
+        self.sink.write(f"{date} | current balance {self.amount:.2f}")
+        self.sink.write(f"{date} | current net wealth {self.net_wealth(bar):.2f}")
+
+    def net_wealth(self, bar):
+        return self.amount + self.units @ self.marks[bar]
+
+    def close_out(self, bar):
+        """BacktestBase.close_out과 같이 남은 단위를 비용 없이 정리하고 거래를 하나 센다."""
+        date = str(self.index[bar])[:10]
+        self.amount += self.units @ self.marks[bar]
+        self.units[:] = 0
+        self.trades += 1
+        if self.verbose:
+            self.sink.write(f"{date} | inventory 0 units")
+            self.sink.write("=" * 55)
+        self.sink.write("Final balance [$] {:.2f}".format(self.amount))
+        perf = ((self.amount - self.initial_amount) / self.initial_amount * 100)
+        self.sink.write("Net Performance [%] {:.2f}".format(perf))
+        self.sink.write("Trades Executed [#] {:.2f}".format(self.trades))
+        self.sink.write("=" * 55)
+        self.sink.flush()
+
+    def run(self, strategy, start=0):
+        """
+        :param strategy: callable
+            strategy(bar, price, backtester), price는 그 봉의 모든 종목 가격 행 (뷰, 상장 전은 NaN).
+            백테스터의 place_buy_order, place_sell_order, units, amount를 써서 주문을 낸다.
+        :param start: int
+            첫 봉
+        """
+        self.reset()
+        n = len(self.index)
+        net_wealths = np.empty(n - start)
+        for bar in range(start, n):
+            strategy(bar, self.price[bar], self)
+            net_wealths[bar - start] = self.amount + self.units @ self.marks[bar]
+        self.net_wealths = pd.DataFrame({"net_wealth": net_wealths}, index=self.index[start:])
+        self.close_out(n - 1)
+
+    def run_sma_strategy(self, SMA1, SMA2):
+        """
+        종목마다 SMA1 > SMA2면 롱, SMA1 < SMA2면 청산한다 (BacktestLongOnly와 같은 신호).
+        매수 금액은 봉마다 현금을 그때 포지션이 없는 종목 수로 나눈 값이다.
+        """
+        msg = f'\n\nRunning portfolio SMA strategy | SMA1={SMA1} & SMA2={SMA2}'
+        msg += f' | {len(self.symbols)} symbols'
+        msg += f'\nfixed costs {self.ftc} | '
+        msg += f'proportional costs {self.ptc}'
+        self.sink.write(msg)
+        self.sink.write("=" * 55)
+        # 누적합으로 두 시간 창의 평균을 한 번에 구한다. pandas rolling().mean()처럼
+        # 창 안에 NaN (상장 전, 쉬는 날)이 있으면 그 봉의 평균은 NaN이다.
+        missing = np.isnan(self.price)
+        sma1, sma2 = rolling_means(np.where(missing, 0., self.price), [SMA1, SMA2])
+        gaps = rolling_sums(missing, [SMA1, SMA2]) != 0
+        sma1[gaps[0]] = np.nan
+        sma2[gaps[1]] = np.nan
+        # NaN과의 비교는 False이므로 값이 없는 종목은 주문하지 않는다.
+        above = sma1 > sma2
+        below = sma1 < sma2
+
+        def strategy(bar, price, bt):
+            held = bt.units > 0
+            sell = held & below[bar]
+            if sell.any():
+                bt.place_sell_order(bar, units=np.where(sell, bt.units, 0))
+            flat = bt.units == 0
+            buy = flat & above[bar]
+            if buy.any():
+                budget = bt.amount / flat.sum()
+                bt.place_buy_order(bar, amount=np.where(buy, budget, 0.))
+
+        self.run(strategy, start=SMA2)
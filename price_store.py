@@ -0,0 +1,206 @@
+# 종가 데이터를 로컬 열 지향 바이너리 형식으로 보관하는 가격 저장소
+# 종가 패널은 읽기 전용 메모리 맵으로 열리므로, 같은 머신의 여러 워커 프로세스가
+# 같은 페이지를 복사 없이 공유한다.
+import os
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+
+EOD_URL = "http://hilpisch.com/pyalgo_eikon_eod_data.csv"
+FORMAT_VERSION = 2
+STORE_DIR = os.environ.get("PRICE_STORE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".torress", "price_store"))
+
+
+class PriceStore(object):
+    """
+    CSV 파일을 한 번만 읽어서 (일자 x 종목) float64 패널과 datetime64 인덱스로 저장해 두고,
+    그 뒤로는 요청된 종목 열과 날짜 구간만 읽어 돌려준다.
+    패널은 열 우선(Fortran) 순서로 저장하므로 종목 한 개의 종가는 연속된 배열이다.
+
+    속성
+    url: str
+        원본 CSV 파일의 위치 (URL 또는 로컬 경로)
+    root: str
+        저장소 파일들을 둘 디렉터리
+
+    메서드
+    =======
+    ingest:
+        원본 CSV를 읽어 열 지향 형식으로 저장한다.
+    load:
+        저장된 인덱스와 메타데이터를 읽는다. 저장소가 없으면 먼저 ingest 한다.
+    panel:
+        (일자 x 종목) 종가 패널을 읽기 전용 메모리 맵으로 반환한다.
+    get_frame:
+        종목 코드와 날짜 구간에 해당하는 데이터프레임을 반환한다.
+    """
+
+    def __init__(self, url=EOD_URL, root=None):
+        self.url = url
+        if root is None:
+            name = os.path.splitext(os.path.basename(url))[0]
+            digest = hashlib.md5(url.encode()).hexdigest()[:8]
+            root = os.path.join(STORE_DIR, f'{name}-{digest}')
+        self.root = root
+        self.meta = None
+        self._panel = None
+
+    def ingest(self):
+        """원본 CSV를 한 번 파싱해서 인덱스와 종가 패널 파일로 저장한다."""
+        raw = pd.read_csv(self.url, index_col=0, parse_dates=True)
+        values = raw.values.astype(np.float64)
+        tmp = f'{self.root}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "index.npy"), raw.index.values.astype("datetime64[ns]"))
+        # 원본 get_data의 dropna()와 같도록, 모든 종목 값이 있는 행을 표시해 둔다.
+        np.save(os.path.join(tmp, "complete.npy"), ~np.isnan(values).any(axis=1))
+        np.save(os.path.join(tmp, "panel.npy"), np.asfortranarray(values))
+        meta = {"version": FORMAT_VERSION, "url": self.url,
+                "index_name": raw.index.name, "symbols": list(raw.columns)}
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        if self._version(self.root) == FORMAT_VERSION:
+            # 다른 프로세스가 먼저 같은 형식의 저장소를 만들었으면 그것을 쓴다.
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        if os.path.exists(self.root):
+            # 예전 형식의 저장소만 옆으로 옮긴 뒤 지운다.
+            stale = f'{self.root}.stale-{os.getpid()}'
+            try:
+                os.replace(self.root, stale)
+            except OSError:
+                pass
+            else:
+                if self._version(stale) == FORMAT_VERSION:
+                    # 확인한 사이에 다른 프로세스가 새로 만든 저장소였으면 되돌린다.
+                    try:
+                        os.replace(stale, self.root)
+                    except OSError:
+                        pass
+                shutil.rmtree(stale, ignore_errors=True)
+        try:
+            # 디렉터리 os.replace는 대상이 비어 있지 않으면 실패하므로 다른 저장소를 덮어쓰지 않는다.
+            os.replace(tmp, self.root)
+        except OSError:
+            # 다른 프로세스가 먼저 저장을 끝낸 경우
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def load(self):
+        meta = self._read_meta()
+        if meta is None or meta.get("version") != FORMAT_VERSION:
+            os.makedirs(os.path.dirname(self.root) or ".", exist_ok=True)
+            self.ingest()
+            meta = self._read_meta()
+        self.meta = meta
+        self.positions = {symbol: i for i, symbol in enumerate(meta["symbols"])}
+        self.index = pd.DatetimeIndex(np.load(os.path.join(self.root, "index.npy")),
+                                      name=self.meta["index_name"])
+        self.complete_rows = np.flatnonzero(np.load(os.path.join(self.root, "complete.npy")))
+        self.complete_index = self.index[self.complete_rows]
+        self._panel = None
+
+    def _version(self, root):
+        """root에 있는 저장소의 형식 버전 (없으면 None)"""
+        meta = self._read_meta(root)
+        return None if meta is None else meta.get("version")
+
+    def _read_meta(self, root=None):
+        meta_path = os.path.join(self.root if root is None else root, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def __getstate__(self):
+        # 메모리 맵을 피클하면 패널 전체가 복사되므로, 위치만 넘기고 워커에서 다시 연다.
+        return {"url": self.url, "root": self.root}
+
+    def __setstate__(self, state):
+        self.__init__(state["url"], state["root"])
+
+    @property
+    def symbols(self):
+        if self.meta is None:
+            self.load()
+        return list(self.meta["symbols"])
+
+    @property
+    def panel(self):
+        if self.meta is None:
+            self.load()
+        if self._panel is None:
+            self._panel = np.load(os.path.join(self.root, "panel.npy"), mmap_mode="r")
+        return self._panel
+
+    def column(self, symbol):
+        """종목 한 개의 전체 종가 배열 (패널 열에 대한 뷰)을 반환한다."""
+        return self.panel[:, self.positions[symbol]]
+
+    def get_rows(self, start=None, end=None, dropna=True):
+        """
+        날짜 구간에 해당하는 행 위치를 반환한다.
+        :param dropna: bool
+            True면 어느 종목이든 값이 빠진 행을 제외한다 (원본 CSV의 dropna()와 같음)
+        :return: slice 또는 np.ndarray
+        """
+        if self.meta is None:
+            self.load()
+        if dropna:
+            slc = self.complete_index.slice_indexer(start, end)
+            rows = self.complete_rows[slc]
+            # 연속된 구간이면 슬라이스로 바꿔서 복사 없이 읽는다.
+            if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+                return slice(rows[0], rows[-1] + 1)
+            return rows
+        return self.index.slice_indexer(start, end)
+
+    def get_frame(self, symbols=None, start=None, end=None, dropna=True, copy=True):
+        """
+        종목 코드(들)과 날짜 구간에 해당하는 종가 데이터프레임을 반환한다.
+        :param symbols: str 또는 list
+            None이면 모든 종목
+        :param start: str
+        :param end: str
+            데이터 선택 구간, .loc[start:end] 와 같은 규칙을 따른다.
+        :param copy: bool
+            False면 가능한 경우 (연속된 구간, 종목 한 개 또는 전체) 읽기 전용 패널에 대한
+            뷰를 그대로 쓴다. 뷰가 백테스트 데이터까지 남는 것은 SMA, 모멘텀 벡터 백테스터
+            (backtest.py, momentum_backtest.py)뿐이다. BacktestBase, LRVectorBacktester,
+            ScikitVectorBacktester, Finance의 get_data는 수익률 열을 더한 뒤 dropna() 하거나
+            열을 골라 새 데이터프레임을 만들므로 그 단계에서 복사한다.
+        :return: pd.DataFrame
+        """
+        if symbols is None:
+            symbols = self.symbols
+        elif isinstance(symbols, str):
+            symbols = [symbols]
+        rows = self.get_rows(start, end, dropna)
+        values = self.get_values(symbols, rows)
+        if copy:
+            values = np.array(values)
+        return pd.DataFrame(values, index=self.index[rows], columns=symbols, copy=False)
+
+    def get_values(self, symbols, rows=slice(None)):
+        """(행 x 종목) 종가 배열을 반환한다. 연속된 행과 열이면 패널의 뷰가 된다."""
+        cols = [self.positions[symbol] for symbol in symbols]
+        if cols == list(range(cols[0], cols[-1] + 1)):
+            cols = slice(cols[0], cols[-1] + 1)
+        elif not isinstance(rows, slice):
+            rows, cols = np.ix_(rows, cols)
+        return np.asarray(self.panel[rows, cols])
+
+
+_stores = {}
+
+
+def get_store(url=EOD_URL):
+    """프로세스마다 URL 당 하나의 PriceStore를 만들어 재사용한다."""
+    if url not in _stores:
+        store = PriceStore(url)
+        store.load()
+        _stores[url] = store
+    return _stores[url]
@@ -0,0 +1,244 @@
+# 이벤트 기반 백테스터의 단계별 (모델 예측, 상태, 가격 조회, 주문, 출력) 시간을 재는 선택적 프로파일러
+import os
+import json
+import time
+import contextlib
+import functools
+import numpy as np
+import pandas as pd
+
+# attach가 감쌀 수 있는 단계: (속성 경로, 단계 이름). 객체에 없는 단계는 건너뛴다.
+STAGES = [("backtest_strategy", "backtest_strategy"),
+          ("_step", "step"),
+          ("_next_event", "next_event"),
+          ("predict_signals", "predict_signals"),
+          ("get_date_price", "get_date_price"),
+          ("get_data_price", "get_data_price"),
+          ("calculate_net_wealth", "calculate_net_wealth"),
+          ("place_buy_order", "place_buy_order"),
+          ("place_sell_order", "place_sell_order"),
+          ("go_long", "go_long"),
+          ("go_short", "go_short"),
+          ("close_out", "close_out"),
+          ("model.predict", "model.predict"),
+          ("env.get_state", "env.get_state"),
+          ("sink.write", "sink.write"),
+          ("sink.flush", "sink.flush")]
+
+# 지연 시간 히스토그램의 구간: 2 ** (k-1) <= 나노초 < 2 ** k 를 k 번째 구간에 센다.
+BUCKETS = 64
+
+
+def percentile(hist, q, peak=None):
+    """
+    지연 시간 히스토그램에서 백분위수를 구한다. 호출마다의 시간을 남기지 않으므로
+    메모리는 단계마다 BUCKETS 개로 일정하고, 값은 해당 구간 [2 ** (k-1), 2 ** k) 안에서
+    선형 보간한 근삿값이다 (오차는 구간 폭, 즉 값의 두 배 이내).
+    :param hist: np.ndarray
+        (BUCKETS,) 구간별 호출 수
+    :param q: float 또는 시퀀스
+        백분위 (0 ~ 100)
+    :param peak: int
+        관측한 최대 ns (주면 결과가 이 값을 넘지 않는다)
+    :return: np.ndarray
+        나노초
+    """
+    q = np.asarray(q, dtype=np.float64)
+    cum = np.cumsum(hist)
+    # 가장 작은 값의 순위는 1이므로 0 백분위도 처음으로 호출이 있는 구간에 놓인다.
+    rank = np.maximum(q / 100. * cum[-1], 1)
+    k = np.minimum(np.searchsorted(cum, rank), BUCKETS - 1)
+    lower = np.where(k > 0, 2. ** (k - 1), 0.)
+    upper = 2. ** k
+    below = np.where(k > 0, cum[k - 1], 0)
+    inside = np.maximum(hist[k], 1)
+    value = lower + (upper - lower) * np.clip((rank - below) / inside, 0., 1.)
+    if peak is not None:
+        value = np.minimum(value, peak)
+    return value
+
+
+class Profiler(object):
+    """
+    단계 (메서드 호출)마다 호출 수, 전체 시간, 자기 시간 (안쪽 단계를 뺀 시간),
+    지연 시간 히스토그램을 모으고, 호출마다의 구간을 크롬 트레이스 이벤트로 남긴다.
+    attach는 객체의 인스턴스 속성으로 시간을 재는 래퍼를 넣었다가 끝나면 지우므로,
+    붙이지 않은 백테스터의 실행 경로에는 아무것도 더하지 않는다.
+
+    속성
+    max_events: int
+        남길 트레이스 이벤트의 최대 수 (넘으면 집계만 하고 이벤트는 버린다)
+    counters: dict
+        count로 센 이름별 값
+
+    메서드
+    =======
+    attach:
+        백테스터 (와 그 model, env, sink)의 단계에 타이머를 붙이는 컨텍스트 매니저
+    wrap:
+        함수 하나를 이름 붙인 단계로 시간을 재는 함수로 감싼다.
+    timer:
+        with 블록을 이름 붙인 단계로 잰다.
+    count:
+        이름 붙인 카운터를 늘린다.
+    to_frame:
+        단계별 집계를 데이터프레임으로 반환한다.
+    histogram:
+        단계별 지연 시간 히스토그램을 데이터프레임으로 반환한다.
+    save_trace:
+        크롬 트레이스 (chrome://tracing, Perfetto) JSON 파일로 저장한다.
+    """
+
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self._stats = {}
+        self._events = []
+        self._dropped = 0
+        # 열린 단계마다 안쪽 단계에 쓴 시간을 쌓는다 (자기 시간 계산).
+        self._children = []
+        self._origin = time.perf_counter_ns()
+
+    def _stat(self, name):
+        stat = self._stats.get(name)
+        if stat is None:
+            # [호출 수, 전체 ns, 자기 ns, 최대 ns, 히스토그램]
+            stat = self._stats[name] = [0, 0, 0, 0, np.zeros(BUCKETS, dtype=np.int64)]
+        return stat
+
+    def _enter(self):
+        self._children.append(0)
+        return time.perf_counter_ns()
+
+    def _exit(self, stat, name, t0):
+        dur = time.perf_counter_ns() - t0
+        children = self._children.pop()
+        if self._children:
+            self._children[-1] += dur
+        stat[0] += 1
+        stat[1] += dur
+        stat[2] += dur - children
+        if dur > stat[3]:
+            stat[3] = dur
+        stat[4][min(dur.bit_length(), BUCKETS - 1)] += 1
+        if len(self._events) < self.max_events:
+            self._events.append((name, t0, dur))
+        else:
+            self._dropped += 1
+
+    def wrap(self, name, func):
+        """func를 부를 때마다 name 단계로 시간을 잰다."""
+        stat = self._stat(name)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            t0 = self._enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._exit(stat, name, t0)
+        return timed
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        stat = self._stat(name)
+        t0 = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(stat, name, t0)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def attach(self, backtester, stages=None):
+        """
+        :param backtester: object
+            TBBacktesterRM, BacktestBase 등. 'model.predict'처럼 점이 있는 단계는
+            backtester.model의 predict를 감싼다.
+        :param stages: list
+            감쌀 속성 경로 목록 (None이면 STAGES 중 객체에 있는 것 전부)
+        """
+        names = dict(STAGES)
+        patched = []
+        for path in (stages if stages is not None else names):
+            *owner_path, attr = path.split(".")
+            owner = backtester
+            for part in owner_path:
+                owner = getattr(owner, part, None)
+            func = getattr(owner, attr, None)
+            if owner is None or not callable(func):
+                continue
+            own = getattr(owner, "__dict__", {})
+            had, old = attr in own, own.get(attr)
+            try:
+                setattr(owner, attr, self.wrap(names.get(path, path), func))
+            except AttributeError:
+                # __slots__ 객체처럼 인스턴스 속성을 둘 수 없으면 재지 않는다.
+                continue
+            patched.append((owner, attr, had, old))
+        try:
+            yield self
+        finally:
+            for owner, attr, had, old in reversed(patched):
+                if had:
+                    setattr(owner, attr, old)
+                else:
+                    delattr(owner, attr)
+
+    def to_frame(self):
+        """
+        :return: pd.DataFrame
+            단계별 calls, total_ms, self_ms (안쪽 단계를 뺀 시간), mean_us, p50_us, p99_us,
+            max_us, share (자기 시간의 비율). 카운터는 calls 열에만 값이 있는 행이다.
+            p50_us, p99_us는 히스토그램에서 구한 근삿값이다 (percentile 참고).
+        """
+        rows = {}
+        for name, (calls, total, own, peak, hist) in self._stats.items():
+            if not calls:
+                continue
+            p50, p99 = percentile(hist, [50, 99], peak) / 1000.
+            rows[name] = dict(calls=calls, total_ms=total / 1e6, self_ms=own / 1e6,
+                              mean_us=total / calls / 1000., p50_us=p50, p99_us=p99,
+                              max_us=peak / 1000.)
+        frame = pd.DataFrame.from_dict(rows, orient="index")
+        if len(frame):
+            frame["share"] = frame["self_ms"] / frame["self_ms"].sum()
+            frame = frame.sort_values("self_ms", ascending=False)
+        for name, value in self.counters.items():
+            frame.loc[name, "calls"] = value
+        frame.index.name = "stage"
+        return frame
+
+    def histogram(self):
+        """
+        :return: pd.DataFrame
+            (단계 x 구간) 호출 수, 열은 구간의 상한 [마이크로초] (2 ** k ns)
+        """
+        names = [name for name, stat in self._stats.items() if stat[0]]
+        counts = np.array([self._stats[name][4] for name in names]).reshape(len(names), BUCKETS)
+        used = np.flatnonzero(counts.any(axis=0))
+        columns = 2. ** used / 1000. if len(used) else []
+        return pd.DataFrame(counts[:, used], index=pd.Index(names, name="stage"),
+                            columns=pd.Index(columns, name="upper_us"))
+
+    def save_trace(self, path):
+        """
+        호출마다 완료 이벤트 ('X', 마이크로초 단위)를 쓰고, 카운터는 마지막 시점의
+        카운터 이벤트 ('C')로 쓴다.
+        """
+        pid = os.getpid()
+        origin = self._origin
+        events = [{"name": name, "ph": "X", "ts": (t0 - origin) / 1000., "dur": dur / 1000.,
+                   "pid": pid, "tid": 0} for name, t0, dur in self._events]
+        if self.counters:
+            end = max((t0 + dur for _, t0, dur in self._events), default=origin)
+            events.append({"name": "counters", "ph": "C", "ts": (end - origin) / 1000.,
+                           "pid": pid, "tid": 0, "args": dict(self.counters)})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ns",
+                       "otherData": {"dropped_events": self._dropped}}, f)
@@ -0,0 +1,168 @@
+# 고정된 신호 열에 손절 (SL), 추적 손절 (TSL), 이익 실현 (TP)을 거래 구간 단위로 적용하는 엔진
+import numpy as np
+import pandas as pd
+from sweep import parameter_grid
+
+END, SL, TSL, TP, SIGNAL = 0, 1, 2, 3, 4
+
+SEGMENT_DTYPE = np.dtype([("entry_bar", np.int64), ("side", np.int8), ("entry_price", np.float64),
+                          ("exit_bar", np.int64), ("exit_reason", np.int8),
+                          ("exit_price", np.float64)])
+
+
+def first_exit(prices, signals, bar, side, entry, max_price, min_price,
+               sl=None, tsl=None, tp=None, chunk=64):
+    """
+    bar 이후로 포지션 (side)이 닫힐 수 있는 첫 봉과 그 이유를 찾는다. 반대 신호와
+    SL, TSL, TP 조건을 크기를 두 배씩 늘리는 구간 단위로 벡터 계산하고, 추적 가격은
+    구간의 누적 최대/최소에 앞 구간까지의 값 (max_price, min_price)을 이어 붙인다.
+    같은 봉에서 여러 조건이 맞으면 TBBacktesterRM과 같이 SL, TSL, TP, 신호 순서다.
+    :param signals: np.ndarray
+        prices와 같은 길이의 봉별 신호 (1, -1, 신호가 없는 봉은 0)
+    :param entry: float
+        진입 가격 (SL, TP, TSL 수익률의 분모)
+    :return: (int, int)
+        (봉, 이유), 닫히지 않으면 (len(prices), END)
+    """
+    n = len(prices)
+    while bar < n:
+        stop = min(bar + chunk, n)
+        price = prices[bar:stop]
+        conditions = []
+        rc = (price - entry) / entry
+        if sl is not None:
+            conditions.append((SL, rc < -sl if side == 1 else rc > sl))
+        if tsl is not None:
+            if side == 1:
+                rc_1 = (price - np.maximum(np.maximum.accumulate(price), max_price)) / entry
+                conditions.append((TSL, rc_1 < -tsl))
+            else:
+                rc_2 = (np.minimum(np.minimum.accumulate(price), min_price) - price) / entry
+                conditions.append((TSL, rc_2 < -tsl))
+            max_price = max(max_price, price.max())
+            min_price = min(min_price, price.min())
+        if tp is not None:
+            conditions.append((TP, rc > tp if side == 1 else rc < -tp))
+        conditions.append((SIGNAL, signals[bar:stop] == -side))
+        hit = np.logical_or.reduce([condition for _, condition in conditions])
+        if hit.any():
+            i = int(np.argmax(hit))
+            for reason, condition in conditions:
+                if condition[i]:
+                    return bar + i, reason
+        bar = stop
+        chunk *= 2
+    return n, END
+
+
+def risk_overlay(prices, signals, start, sl=None, tsl=None, tp=None, wait=5, guarantee=False):
+    """
+    TBBacktesterRM.backtest_strategy와 같은 규칙으로 신호 열을 거래 구간으로 나눈다.
+    구간마다 first_exit로 끝나는 봉만 찾으므로 봉 단위로 진행하지 않는다.
+    - start 봉과 대기 (wait)가 끝난 봉에서 그 봉의 신호 방향으로 전 봉 가격에 진입한다.
+    - 반대 신호가 나오면 그 봉에서 전 봉 가격으로 반대 포지션으로 바꾼다.
+    - SL, TSL, TP에 걸리면 그 봉 가격 (guarantee면 SL, TP는 보장 가격)으로 닫고
+      wait 봉 뒤에 다시 진입한다 (wait=0이면 같은 봉에서 바로 진입).
+    :param prices: np.ndarray
+        봉별 가격
+    :param signals: np.ndarray
+        prices와 같은 길이의 봉별 신호 (1, -1)
+    :param start: int
+        첫 봉 (TBBacktesterRM에서는 env.lags)
+    :return: np.ndarray
+        SEGMENT_DTYPE 구조화 배열 (구간마다 진입 봉, 방향, 진입 가격, 청산 봉, 이유, 청산 가격).
+        끝까지 열린 구간은 마지막 봉, END로 끝난다.
+    """
+    n = len(prices)
+    segments = []
+    bar = start
+    while bar < n:
+        side = int(signals[bar])
+        entry = prices[bar - 1]
+        exit_bar, reason = first_exit(prices, signals, bar + 1, side, entry, entry, entry,
+                                      sl, tsl, tp)
+        if reason == END:
+            segments.append((bar, side, entry, n - 1, END, prices[n - 1]))
+            break
+        if reason == SIGNAL:
+            exit_price = prices[exit_bar - 1]
+            next_bar = exit_bar
+        else:
+            exit_price = prices[exit_bar]
+            if guarantee and reason == SL:
+                exit_price = entry * (1 - sl) if side == 1 else entry * (1 + sl)
+            elif guarantee and reason == TP:
+                exit_price = entry * (1 + tp) if side == 1 else entry * (1 - tp)
+            next_bar = exit_bar + wait
+        segments.append((bar, side, entry, exit_bar, reason, exit_price))
+        bar = next_bar
+    return np.array(segments, dtype=SEGMENT_DTYPE)
+
+
+def positions(segments, n):
+    """구간 배열로 봉별 포지션 (봉의 처리가 끝난 뒤의 1, 0, -1)을 만든다."""
+    change = np.zeros(n + 1, dtype=np.int64)
+    end = np.where(segments["exit_reason"] == END, n, segments["exit_bar"])
+    np.add.at(change, segments["entry_bar"], segments["side"])
+    np.add.at(change, end, -segments["side"].astype(np.int64))
+    return np.cumsum(change[:-1])
+
+
+def settle(segments, prices, amount, ftc, ptc):
+    """
+    구간 배열을 BacktestBaseRM의 주문 계산 (진입은 잔고 전부, int 단위)과 close_out으로
+    정산한다. 거래 수만큼만 반복한다.
+    :return: (float, int)
+        최종 잔고와 거래 횟수 (backtest_strategy 뒤의 current_balance, trades와 같다)
+    """
+    balance, units, position, trades = amount, 0, 0, 0
+    for entry_bar, side, entry, exit_bar, reason, exit_price in segments.tolist():
+        # 반대 신호로 바뀌는 경우 앞 구간의 청산은 여기서 진입 가격으로 한다.
+        # 주문은 단위가 0이어도 포지션을 기준으로 낸다 (거래 횟수도 같게).
+        if position == -1:
+            balance -= (1 + ptc) * -units * entry + ftc
+            units, trades = 0, trades + 1
+        elif position == 1:
+            balance += (1 - ptc) * units * entry - ftc
+            units, trades = 0, trades + 1
+        size = int(balance / entry)
+        if side == 1:
+            balance -= (1 + ptc) * size * entry + ftc
+            units = size
+        else:
+            balance += (1 - ptc) * size * entry - ftc
+            units = -size
+        position = side
+        trades += 1
+        if reason in (SL, TSL, TP):
+            if position == 1:
+                balance += (1 - ptc) * units * exit_price - ftc
+            else:
+                balance -= (1 + ptc) * -units * exit_price + ftc
+            units, position, trades = 0, 0, trades + 1
+    # close_out: 남은 단위를 마지막 봉 가격으로 정리하고 (없으면 0 단위 매도), 거래를 하나 더 센다.
+    price = prices[-1]
+    if units < 0:
+        balance -= (1 + ptc) * -units * price + ftc
+    else:
+        balance += (1 - ptc) * units * price - ftc
+    return balance, trades + 2
+
+
+def sweep_risk(prices, signals, start, grid, amount, ftc=0., ptc=0., wait=5, guarantee=False):
+    """
+    고정된 신호 열에 대해 SL, TSL, TP 조합마다 risk_overlay와 settle을 실행한다.
+    :param grid: list 또는 dict
+        {'sl': [...], 'tsl': [...], 'tp': [...]} (None은 그 주문을 쓰지 않음)
+    :return: pd.DataFrame
+        조합별 파라미터와 최종 잔고 (balance), 성과 [%] (performance), 거래 횟수 (trades)
+    """
+    if isinstance(grid, dict):
+        grid = parameter_grid(**grid)
+    rows = []
+    for params in grid:
+        segments = risk_overlay(prices, signals, start, wait=wait, guarantee=guarantee, **params)
+        balance, trades = settle(segments, prices, amount, ftc, ptc)
+        rows.append(dict(params, balance=balance,
+                         performance=(balance / amount - 1) * 100, trades=trades))
+    return pd.DataFrame(rows)
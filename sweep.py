@@ -0,0 +1,161 @@
+# 백테스트 파라미터 격자를 여러 프로세스에 나눠 실행하는 도구
+import os
+import sys
+import copy
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# 메서드가 아무것도 반환하지 않을 때 (이벤트 기반 백테스트) 대신 모을 속성
+STATE_ATTRIBUTES = ("amount", "current_balance", "units", "position", "trades")
+
+
+def parameter_grid(**ranges):
+    """
+    파라미터별 값 목록의 모든 조합을 만든다.
+    예: parameter_grid(SMA=[25, 42], threshold=[5, 7.5])
+    :return: list
+        {파라미터 이름: 값} 딕셔너리의 목록 (마지막 파라미터가 가장 빨리 바뀐다)
+    """
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*ranges.values())]
+
+
+def share_frame(frame):
+    """
+    데이터프레임의 인덱스와 값을 공유 메모리 블록 하나에 복사한다.
+    :return: (SharedMemory, dict)
+        공유 메모리 블록과 워커에서 다시 붙을 때 쓸 명세
+    """
+    index = frame.index.values.astype("datetime64[ns]").view(np.int64)
+    values = frame.values.astype(np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, index.nbytes + values.nbytes))
+    np.ndarray(index.shape, np.int64, shm.buf)[:] = index
+    np.ndarray(values.shape, np.float64, shm.buf, offset=index.nbytes)[:] = values
+    spec = {"name": shm.name, "shape": values.shape, "columns": list(frame.columns),
+            "index_name": frame.index.name}
+    return shm, spec
+
+
+def attach_frame(spec):
+    """share_frame으로 만든 블록에 붙어서 복사 없이 읽기 전용 데이터프레임을 만든다."""
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    n, k = spec["shape"]
+    index = np.ndarray((n,), np.int64, shm.buf)
+    values = np.ndarray((n, k), np.float64, shm.buf, offset=index.nbytes)
+    values.flags.writeable = False
+    frame = pd.DataFrame(values, columns=spec["columns"], copy=False,
+                         index=pd.DatetimeIndex(index.view("datetime64[ns]"),
+                                                name=spec["index_name"]))
+    return shm, frame
+
+
+def collect_result(backtester, result):
+    """메서드의 반환값을 그대로 쓰고, 반환값이 없으면 계좌 상태 속성을 모은다."""
+    if result is not None:
+        return result
+    return {attr: getattr(backtester, attr) for attr in STATE_ATTRIBUTES
+            if hasattr(backtester, attr)}
+
+
+_worker = {}
+
+
+def _init_worker(backtester, spec, method, collect, quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    shm, backtester.data = attach_frame(spec)
+    _worker.update(backtester=backtester, shm=shm, method=method, collect=collect)
+
+
+def _run_chunk(chunk):
+    backtester = _worker["backtester"]
+    method = getattr(backtester, _worker["method"])
+    return [(i, params, _worker["collect"](backtester, method(**params)))
+            for i, params in chunk]
+
+
+class SweepRunner(object):
+    """
+    이미 데이터를 읽어 둔 백테스트 객체 하나로 파라미터 격자를 프로세스 풀에서 실행한다.
+    객체의 data는 공유 메모리에 한 번만 올리고, 워커는 그 블록에 붙어서 복사 없이 읽는다.
+    spawn 방식의 플랫폼에서는 if __name__ == '__main__': 아래에서 실행해야 한다.
+
+    속성
+    backtester: object
+        SMAVectorBacktester, MRVectorBacktester, LRVectorBacktester, BacktestLongOnly 등
+    method: str
+        파라미터로 호출할 메서드 이름 (예: 'run_strategy', 'run_sma_strategy')
+    max_workers: int
+        워커 프로세스 수 (None이면 CPU 코어 수)
+    chunksize: int
+        워커에 한 번에 넘길 파라미터 조합 수 (None이면 자동)
+    collect: callable
+        collect(backtester, 반환값) -> 결과, 피클 가능한 최상위 함수여야 한다.
+    quiet: bool
+        True면 워커의 print 출력을 버린다.
+
+    메서드
+    =======
+    imap:
+        끝나는 순서대로 (번호, 파라미터, 결과)를 내보낸다.
+    run:
+        격자 순서대로 정렬한 결과 데이터프레임을 반환한다.
+    """
+
+    def __init__(self, backtester, method="run_strategy", max_workers=None,
+                 chunksize=None, collect=collect_result, quiet=True):
+        self.backtester = backtester
+        self.method = method
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.collect = collect
+        self.quiet = quiet
+
+    def imap(self, grid):
+        """
+        :param grid: list 또는 dict
+            파라미터 딕셔너리의 목록, 또는 parameter_grid에 넘길 {이름: 값 목록}
+        """
+        if isinstance(grid, dict):
+            grid = parameter_grid(**grid)
+        tasks = list(enumerate(grid))
+        chunksize = self.chunksize or max(1, -(-len(tasks) // (self.max_workers * 4)))
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+        # 데이터는 공유 메모리로 넘기므로 워커에 피클할 객체에서는 빼 둔다.
+        template = copy.copy(self.backtester)
+        template.data = None
+        if hasattr(template, "results"):
+            template.results = None
+        shm, spec = share_frame(self.backtester.data)
+        try:
+            with ProcessPoolExecutor(self.max_workers, initializer=_init_worker,
+                                     initargs=(template, spec, self.method,
+                                               self.collect, self.quiet)) as pool:
+                futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    for item in future.result():
+                        yield item
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def run(self, grid, columns=("aperf", "operf")):
+        """
+        :param columns: tuple
+            튜플로 반환되는 결과에 붙일 열 이름
+        :return: pd.DataFrame
+            격자 순서대로 파라미터와 결과를 담은 표
+        """
+        rows = []
+        for i, params, result in sorted(self.imap(grid), key=lambda item: item[0]):
+            if isinstance(result, dict):
+                row = dict(params, **result)
+            elif isinstance(result, (tuple, list)):
+                row = dict(params, **dict(zip(columns, result)))
+            else:
+                row = dict(params, result=result)
+            rows.append(row)
+        return pd.DataFrame(rows)
@@ -1,4 +1,5 @@
 import unittest
+import importlib.util
 
 
 class MyTestCase(unittest.TestCase):
@@ -97,6 +98,608 @@ class MyTestCase(unittest.TestCase):
         lobt = BacktestLongShort("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01, verbose=False)
         run_strategies()
 
+    def test_price_store(self):
+        import pandas as pd
+        from price_store import EOD_URL, get_store
+        raw = pd.read_csv(EOD_URL, index_col=0, parse_dates=True).dropna()
+        frame = get_store().get_frame("AAPL.O", "2010-1-1", "2019-12-31")
+        pd.testing.assert_frame_equal(frame, pd.DataFrame(raw["AAPL.O"]).loc["2010-1-1":"2019-12-31"])
+        print(frame.tail())
+
+    def test_price_store_ingest(self):
+        import os
+        import json
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+        from price_store import EOD_URL, FORMAT_VERSION, PriceStore
+        root = os.path.join(tempfile.mkdtemp(), "store")
+        # 여러 프로세스가 동시에 처음 열어도 저장소 하나가 남는다.
+        with ProcessPoolExecutor(4) as pool:
+            list(pool.map(PriceStore.load, [PriceStore(EOD_URL, root) for _ in range(4)]))
+        panel = os.stat(os.path.join(root, "panel.npy")).st_ino
+        # 같은 형식의 저장소가 있으면 ingest는 그것을 지우지 않는다.
+        PriceStore(EOD_URL, root).ingest()
+        self.assertEqual(os.stat(os.path.join(root, "panel.npy")).st_ino, panel)
+        # 예전 형식이면 새로 만든다.
+        with open(os.path.join(root, "meta.json")) as f:
+            meta = json.load(f)
+        meta["version"] = FORMAT_VERSION - 1
+        with open(os.path.join(root, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        store = PriceStore(EOD_URL, root)
+        store.load()
+        self.assertEqual(store.meta["version"], FORMAT_VERSION)
+        self.assertNotEqual(os.stat(os.path.join(root, "panel.npy")).st_ino, panel)
+        print(sorted(os.listdir(os.path.dirname(root))), store.panel.shape)
+        self.assertEqual(os.listdir(os.path.dirname(root)), ["store"])
+
+    def test_price_panel(self):
+        import pickle
+        import numpy as np
+        from price_store import get_store
+        store = get_store()
+        frame = store.get_frame(None, "2015-1-1", "2019-12-31", copy=False)
+        # 워커로 넘길 때는 패널이 아니라 저장소 위치만 피클된다.
+        attached = pickle.loads(pickle.dumps(store))
+        np.testing.assert_array_equal(attached.panel, store.panel)
+        print(frame.shape, store.panel.shape)
+
+    def test_sma_grid(self):
+        from scipy.optimize import brute
+        from backtest import SMAVectorBacktester
+        smabt = SMAVectorBacktester("EUR=", 42, 252,
+                                    "2010-1-1", "2020-12-31")
+        opt = brute(smabt.update_and_run, ((30, 56, 4), (200, 300, 4)), finish=None)
+        result = smabt.optimize_parameters((30, 56, 4), (200, 300, 4))
+        self.assertEqual(tuple(opt), tuple(result[0]))
+        print(smabt.surface.sort_values("aperf").tail())
+
+    def test_mr_sweep(self):
+        from momentum_backtest import MRVectorBacktester
+        mrbt = MRVectorBacktester("GDX", "2010-1-1", "2020-12-31",
+                                  10000, 0.001)
+        surface = mrbt.sweep([25, 42], [5, 7.5])
+        for (SMA, threshold), row in surface.iterrows():
+            self.assertEqual(mrbt.run_strategy(SMA=SMA, threshold=threshold), tuple(row))
+        print(surface)
+
+    def test_mom_run_many(self):
+        from momentum_backtest import MomVectorBacktester
+        mombt = MomVectorBacktester("XAU=", "2010-1-1", "2020-12-31",
+                                    10000, 0.001)
+        summary = mombt.run_many([1, 2, 5, 20])
+        for momentum, row in summary.iterrows():
+            self.assertEqual(mombt.run_strategy(momentum), (row["aperf"], row["operf"]))
+        print(summary)
+
+    def test_summary_mode(self):
+        from backtest import SMAVectorBacktester
+        from momentum_backtest import MomVectorBacktester, MRVectorBacktester
+        from LRVectorBacktester import LRVectorBacktester
+        smabt = SMAVectorBacktester("EUR=", 42, 252, "2010-1-1", "2020-12-31")
+        self.assertEqual(smabt.run_strategy(), smabt.run_strategy(results="summary"))
+        mombt = MomVectorBacktester("XAU=", "2010-1-1", "2020-12-31", 10000, 0.001)
+        self.assertEqual(mombt.run_strategy(2), mombt.run_strategy(2, results="summary"))
+        mrbt = MRVectorBacktester("GDX", "2010-1-1", "2020-12-31", 10000, 0.001)
+        self.assertEqual(mrbt.run_strategy(SMA=25, threshold=5),
+                         mrbt.run_strategy(SMA=25, threshold=5, results="summary"))
+        lrbt = LRVectorBacktester(".SPX", '2010-1-1', '2018-06-29', 10000, 0.001)
+        args = ("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', 5)
+        self.assertEqual(lrbt.run_strategy(*args), lrbt.run_strategy(*args, results="summary"))
+
+    def test_panel_backtest(self):
+        from backtest import SMAVectorBacktester
+        from panel_backtest import SMAPanelBacktester, MomPanelBacktester
+        panel = SMAPanelBacktester(["AAPL.O", "EUR=", "GDX"], 42, 252,
+                                   "2010-1-1", "2020-12-31", common=True)
+        results = panel.run_strategy()
+        smabt = SMAVectorBacktester("GDX", 42, 252, "2010-1-1", "2020-12-31")
+        self.assertEqual(smabt.run_strategy(), tuple(results.loc["GDX", ["aperf", "operf"]]))
+        print(results)
+        mompanel = MomPanelBacktester(None, "2010-1-1", "2020-12-31", 10000, 0.001)
+        print(mompanel.run_strategy(5))
+
+    def test_sweep(self):
+        from momentum_backtest import MRVectorBacktester
+        from sweep import SweepRunner, parameter_grid
+        mrbt = MRVectorBacktester("GDX", "2010-1-1", "2020-12-31", 10000, 0.001)
+        grid = parameter_grid(SMA=[25, 42], threshold=[5, 7.5])
+        results = SweepRunner(mrbt, max_workers=2).run(grid)
+        for _, row in results.iterrows():
+            self.assertEqual(mrbt.run_strategy(SMA=int(row["SMA"]), threshold=row["threshold"]),
+                             (row["aperf"], row["operf"]))
+        print(results)
+
+    def test_walk_forward(self):
+        import numpy as np
+        from LRVectorBacktester import LRVectorBacktester
+        lrbt = LRVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001)
+        print(lrbt.run_walk_forward("2010-1-1", '2015-12-31', '2019-12-31', lags=5))
+        # 망각 계수가 1이면 매일 lstsq로 다시 적합한 것과 같다.
+        returns = lrbt.data["return"].values
+        X, y = lrbt._lag_matrix(returns), np.sign(returns[5:])
+        t = len(X) - len(lrbt.coefficients) + 100
+        reg = np.linalg.lstsq(X[:t], y[:t], rcond=None)[0]
+        np.testing.assert_allclose(lrbt.coefficients.iloc[100], reg)
+        print(lrbt.run_walk_forward("2010-1-1", '2015-12-31', '2019-12-31', lags=5, forgetting=0.99))
+
+    def test_evaluate_lags(self):
+        from LRVectorBacktester import LRVectorBacktester
+        lrbt = LRVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001)
+        results = lrbt.evaluate_lags("2010-1-1", '2015-12-31', '2016-1-1', '2019-12-31', max_lags=8)
+        self.assertEqual(lrbt.run_strategy("2010-1-1", '2015-12-31', '2016-1-1', '2019-12-31', lags=5),
+                         tuple(results.loc[5, ["aperf_out", "operf_out"]]))
+        print(results)
+
+    def test_streaming_model(self):
+        from ScikitVectorBacktester import ScikitVectorBacktester
+        lrbt = ScikitVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001, 'logistic')
+        print(lrbt.run_strategy("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', lags=5))
+        sgdbt = ScikitVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001,
+                                       'sgd_classification', chunksize=250, epochs=5)
+        print(sgdbt.run_strategy("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', lags=5))
+        self.assertEqual(list(lrbt.results.columns), list(sgdbt.results.columns))
+        self.assertTrue(lrbt.results.index.equals(sgdbt.results.index))
+
+    def test_streaming_refit(self):
+        from ScikitVectorBacktester import ScikitVectorBacktester
+        sgdbt = ScikitVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001,
+                                       'sgd_classification', chunksize=250, epochs=1)
+        first = sgdbt.run_strategy("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', lags=5)
+        second = sgdbt.run_strategy("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', lags=5)
+        print(first, second)
+        # 같은 인자로 다시 실행하면 앞선 학습을 이어 가지 않고 같은 결과를 낸다.
+        self.assertEqual(first, second)
+        # 시차 수를 바꿔도 새 모델로 적합한다.
+        print(sgdbt.run_strategy("2010-1-1", '2016-12-31', '2017-1-1', '2019-12-31', lags=3))
+        self.assertEqual(sgdbt.model.n_features_in_, 3)
+
+    def test_cross_validate(self):
+        import numpy as np
+        from ScikitVectorBacktester import ScikitVectorBacktester
+        scibt = ScikitVectorBacktester(".SPX", '2010-1-1', '2019-12-31', 10000, 0.001, 'logistic')
+        folds, total = scibt.cross_validate('2010-1-1', '2019-12-31', lags=[3, 5], folds=4)
+        print(folds)
+        print(total)
+        self.assertEqual(len(folds), 8)
+        self.assertEqual(list(total.index), [3, 5])
+        self.assertTrue((folds["train_end"] < folds["test_start"]).all())
+        # 폴드 하나를 run_strategy로 직접 다시 계산한다. 학습 구간은 데이터의 처음부터 시작하고,
+        # 검증 구간의 첫날도 특징이 있도록 표본 외 구간을 시차 수만큼 앞에서 시작한다.
+        fold = folds.loc[(5, 3)]
+        index = scibt.data.index
+        start_out = index[index.get_loc(fold["test_start"]) - 5]
+        aperf, operf = scibt.run_strategy(index[0], fold["train_end"], start_out, fold["test_end"], lags=5)
+        self.assertEqual(scibt.results.index[0], fold["test_start"])
+        hit_rate = (np.sign(scibt.results["prediction"]) == np.sign(scibt.results["return"])).mean()
+        self.assertAlmostEqual(fold["aperf"], aperf, delta=0.01)
+        self.assertAlmostEqual(fold["operf"], operf, delta=0.01)
+        self.assertAlmostEqual(fold["hit_rate"], round(hit_rate, 4))
+        # 이동 학습 구간이 purge 행을 빼면 비는 경우는 워커에 보내기 전에 거른다.
+        blocks = len(scibt.select_data('2010-1-1', '2019-12-31')) // 5
+        with self.assertRaises(ValueError):
+            scibt.cross_validate('2010-1-1', '2019-12-31', lags=3, folds=4, purge=blocks,
+                                 expanding=False)
+
+    def test_streaming_indicators(self):
+        import numpy as np
+        from backtest import SMAVectorBacktester
+        from indicators import RollingMean, RollingMeanStd, RollingLags
+        smabt = SMAVectorBacktester("EUR=", 42, 252,
+                                    "2010-1-1", "2020-12-31")
+        price = smabt.data["price"].values
+        sma = RollingMean(42)
+        batch = sma.batch(price[:-100])
+        updates = [sma.update(value) for value in price[-100:]]
+        np.testing.assert_array_equal(np.concatenate((batch, updates)), smabt.data["SMA1"].values)
+        np.testing.assert_allclose(smabt.data["SMA1"], smabt.data["price"].rolling(42).mean())
+        mv = RollingMeanStd(20)
+        mv.batch(price[:-100])
+        mean, std = mv.update(price[-100])
+        print(mean, std)
+        self.assertAlmostEqual(std, smabt.data["price"].iloc[-119:-99].std())
+        lags = RollingLags(5)
+        lags.batch(price[:-1])
+        np.testing.assert_array_equal(lags.update(price[-1]), price[-2:-7:-1])
+
+    def test_append(self):
+        from pandas.testing import assert_frame_equal
+        from backtest import SMAVectorBacktester
+        from momentum_backtest import MomVectorBacktester
+        smabt = SMAVectorBacktester("EUR=", 42, 252, "2010-1-1", "2019-12-31")
+        fresh = smabt.run_strategy()
+        daily = SMAVectorBacktester("EUR=", 42, 252, "2010-1-1", "2018-12-31")
+        daily.run_strategy()
+        bars = smabt.data.loc["2019-1-1":, "price"]
+        for day in range(len(bars)):
+            result = daily.append(bars.iloc[day:day + 1])
+        self.assertEqual(fresh, result)
+        assert_frame_equal(smabt.results, daily.results)
+        mombt = MomVectorBacktester("XAU=", "2010-1-1", "2019-12-31", 10000, 0.001)
+        fresh = mombt.run_strategy(5)
+        daily = MomVectorBacktester("XAU=", "2010-1-1", "2018-12-31", 10000, 0.001)
+        daily.run_strategy(5)
+        print(daily.append(mombt.data.loc["2019-1-1":"2019-6-30", "price"]))
+        self.assertEqual(fresh, daily.append(mombt.data.loc["2019-7-1":, "price"]))
+        assert_frame_equal(mombt.results, daily.results)
+
+    def test_fast_engine(self):
+        import io
+        import contextlib
+        from BacktestBase import BacktestLongOnly, BacktestLongShort
+
+        def run_strategies(cls, engine):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                lobt = cls("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01, engine=engine)
+                lobt.run_sma_strategy(42, 252)
+                lobt.run_momentum_strategy(60)
+                lobt.run_mean_reversion_strategy(50, 5)
+            return output.getvalue(), lobt.amount, lobt.trades
+
+        for cls in (BacktestLongOnly, BacktestLongShort):
+            # 거래와 출력 (날짜, 잔고, 순자산)이 모두 같아야 한다.
+            self.assertEqual(run_strategies(cls, "pandas"), run_strategies(cls, "numpy"))
+
+    def test_lockstep(self):
+        import io
+        import contextlib
+        from BacktestBase import BacktestLongShort
+        lobt = BacktestLongShort("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01,
+                                 verbose=False, engine="numpy")
+        results = lobt.run_lockstep("mean_reversion", {"SMA": [25, 50], "threshold": [2.5, 5]})
+        print(results)
+        for _, row in results.iterrows():
+            with contextlib.redirect_stdout(io.StringIO()):
+                lobt.run_mean_reversion_strategy(int(row["SMA"]), row["threshold"])
+            self.assertEqual((lobt.amount, lobt.trades), (row["amount"], row["trades"]))
+
+    def test_event_engine(self):
+        import io
+        import contextlib
+        from BacktestBase import BacktestLongOnly, BacktestLongShort
+
+        def run_strategy(cls, engine, method, *args):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                lobt = cls("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01, engine=engine)
+                getattr(lobt, method)(*args)
+            return output.getvalue(), lobt.amount, lobt.trades, lobt.net_wealths
+
+        for cls in (BacktestLongOnly, BacktestLongShort):
+            for method, args in (("run_sma_strategy", (42, 252)), ("run_momentum_strategy", (60,)),
+                                 ("run_mean_reversion_strategy", (50, 5))):
+                full = run_strategy(cls, "numpy", method, *args)
+                events = run_strategy(cls, "event", method, *args)
+                print(cls.__name__, method, events[1:3])
+                # 주문이 날 수 있는 봉만 처리해도 거래, 출력, 봉별 순자산이 모두 같아야 한다.
+                self.assertEqual(full[:3], events[:3])
+                self.assertTrue(full[3].equals(events[3]))
+
+    def test_trade_ledger(self):
+        import io
+        import os
+        import tempfile
+        from BacktestBase import BacktestLongShort
+        from trade_ledger import TradeLedger, ConsoleSink
+        output = io.StringIO()
+        lobt = BacktestLongShort("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01,
+                                 verbose=False, sink=ConsoleSink(output))
+        lobt.run_momentum_strategy(60)
+        ledger = lobt.get_ledger()
+        print(ledger.tail())
+        # 거래마다 한 행이 남고, 마지막 행은 청산 뒤 잔고다.
+        self.assertEqual(len(ledger), lobt.trades)
+        self.assertEqual(ledger["balance"].iloc[-1], lobt.amount)
+        self.assertIn("Final balance", output.getvalue())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ledger.npy")
+            lobt.ledger.save(path)
+            self.assertTrue((TradeLedger.load(path).records == lobt.ledger.records).all())
+
+    def test_batched_predict(self):
+        import numpy as np
+        from Finance_environment import Finance
+        from TBBacktesterRM import TBBacktesterRM
+
+        class LinearModel(object):
+            # predict와 같은 (표본, lags, 2) 출력을 내는 간단한 모델
+            def predict(self, x):
+                return np.tanh(x) @ np.array([[0.5, -0.5], [-1., 1.], [0.2, 0.1], [0., 0.3]])
+
+        env = Finance("EUR=", ["r", "s", "m", "v"], window=20, lags=3)
+        tb = TBBacktesterRM(env, LinearModel(), 10000, 0.0, 0.0)
+        states = tb.get_states()
+        print(states.shape)
+        self.assertTrue(np.array_equal(states[5], env.get_state(env.lags + 5)))
+        signals = [tb.predict_signal(bar) for bar in range(env.lags, len(env.data))]
+        self.assertEqual(tb.predict_signals().tolist(), signals)
+
+    def test_risk_overlay(self):
+        import io
+        import contextlib
+        import numpy as np
+        from Finance_environment import Finance
+        from TBBacktesterRM import TBBacktesterRM
+        from trade_ledger import BUY, CLOSE
+
+        class LinearModel(object):
+            def predict(self, x):
+                return np.tanh(x) @ np.array([[0., 0.], [-1., 1.], [0., 0.], [0., 0.]])
+
+        env = Finance("EUR=", ["r", "s", "m", "v"], window=20, lags=3)
+        tb = TBBacktesterRM(env, LinearModel(), 10000, 1.0, 0.001)
+        results = tb.backtest_risk_grid({"sl": [0.01], "tsl": [None, 0.02], "tp": [0.015]}, wait=3)
+        print(results)
+        for _, row in results.iterrows():
+            tsl = None if np.isnan(row["tsl"]) else row["tsl"]
+            with contextlib.redirect_stdout(io.StringIO()):
+                tb.backtest_strategy(sl=row["sl"], tsl=tsl, tp=row["tp"], wait=3)
+            self.assertEqual((tb.current_balance, tb.trades), (row["balance"], row["trades"]))
+        # 매수도 매도처럼 비례 비용을 가격에 더해 내므로 기록한 비용은 양수이고 잔고와 맞는다.
+        records = tb.ledger.records
+        orders = records[records["side"] != CLOSE]
+        np.testing.assert_allclose(orders["cost"], 0.001 * orders["units"] * orders["price"] + 1.0)
+        self.assertTrue((orders["cost"] > 0).all())
+        cash = 10000 - np.cumsum(np.where(orders["side"] == BUY, 1., -1.)
+                                 * orders["units"] * orders["price"] + orders["cost"])
+        np.testing.assert_allclose(orders["balance"], cash)
+
+    def test_portfolio(self):
+        import io
+        import contextlib
+        import numpy as np
+        import pandas as pd
+        from portfolio_backtest import BacktestPortfolio
+        symbols = ["AAPL.O", "MSFT.O", "GS.N", "GLD"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            pbt = BacktestPortfolio(symbols, "2010-1-1", "2019-12-31", 100000, 10.0, 0.001)
+        # dropna=False로 읽으므로 앞쪽에는 일부 종목의 가격이 없는 봉이 있을 수 있다.
+        first = np.flatnonzero(np.isfinite(pbt.price).all(axis=1))[0]
+        units = np.array([10, 20, 5, 15])
+
+        def buy_and_hold(bar, price, bt):
+            if bar == first:
+                bt.place_buy_order(bar, units=units)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            pbt.run(buy_and_hold)
+        value = units * pbt.price[first]
+        # 한 번 산 뒤 마지막 봉에 정리한 잔고와 봉별 순자산
+        expected = 100000 - np.sum(value * 1.001 + 10.0) + units @ pbt.price[-1]
+        self.assertAlmostEqual(pbt.amount, expected, places=6)
+        self.assertEqual(pbt.trades, len(units) + 1)
+        self.assertAlmostEqual(pbt.net_wealths["net_wealth"].iloc[-1], pbt.amount, places=6)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            pbt.run_sma_strategy(42, 252)
+        print(pbt.net_wealths.tail())
+        # 종목마다 차례로 주문하는 참조 루프 (pandas rolling SMA)와 같은 잔고, 거래 수, 순자산
+        prices = pd.DataFrame(pbt.price)
+        sma1 = prices.rolling(42).mean().values
+        sma2 = prices.rolling(252).mean().values
+        marks = prices.ffill().fillna(0.).values
+        amount, held, trades, wealths = 100000., [0] * len(symbols), 0, []
+        for bar in range(252, len(prices)):
+            price = pbt.price[bar]
+            for i in range(len(symbols)):
+                if held[i] > 0 and sma1[bar, i] < sma2[bar, i]:
+                    amount += held[i] * price[i] * (1 - 0.001) - 10.0
+                    held[i] = 0
+                    trades += 1
+            flat = [i for i in range(len(symbols)) if held[i] == 0]
+            budget = amount / len(flat) if flat else 0.
+            for i in flat:
+                if sma1[bar, i] > sma2[bar, i]:
+                    held[i] = int(budget / price[i])
+                    amount -= held[i] * price[i] * (1 + 0.001) + 10.0
+                    trades += 1
+            wealths.append(amount + np.dot(held, marks[bar]))
+        amount += np.dot(held, marks[-1])
+        self.assertGreater(trades, 0)
+        self.assertEqual(pbt.trades, trades + 1)
+        self.assertAlmostEqual(pbt.amount, amount, places=6)
+        np.testing.assert_allclose(pbt.net_wealths["net_wealth"].values, wealths, rtol=1e-12)
+
+    def test_checkpoint(self):
+        import io
+        import os
+        import tempfile
+        import contextlib
+        import numpy as np
+        from Finance_environment import Finance
+        from TBBacktesterRM import TBBacktesterRM
+
+        class LinearModel(object):
+            def predict(self, x):
+                return np.tanh(x) @ np.array([[0., 0.], [-1., 1.], [0., 0.], [0., 0.]])
+
+        class Interrupted(Exception):
+            pass
+
+        class StoppingBacktester(TBBacktesterRM):
+            def _step(self, bar, position, wait, guarantee):
+                if bar >= 1500:
+                    raise Interrupted
+                return super()._step(bar, position, wait, guarantee)
+
+        env = Finance("EUR=", ["r", "s", "m", "v"], window=20, lags=3)
+        path = os.path.join(tempfile.mkdtemp(), "tb.ckpt")
+        for mode in ("loop", "event"):
+            tb = TBBacktesterRM(env, LinearModel(), 10000, 1.0, 0.001)
+            with contextlib.redirect_stdout(io.StringIO()):
+                tb.backtest_strategy(sl=0.01, tsl=0.02, tp=0.015, wait=3, mode=mode)
+            stopped = StoppingBacktester(env, LinearModel(), 10000, 1.0, 0.001)
+            with contextlib.redirect_stdout(io.StringIO()):
+                with self.assertRaises(Interrupted):
+                    stopped.backtest_strategy(sl=0.01, tsl=0.02, tp=0.015, wait=3, mode=mode,
+                                              checkpoint=path, every=250)
+            # 새 백테스터에서 마지막 체크포인트부터 이어서 끝까지 실행한다.
+            resumed = TBBacktesterRM(env, None, 10000, 1.0, 0.001)
+            with contextlib.redirect_stdout(io.StringIO()):
+                resumed.resume(path)
+            print(mode, resumed.current_balance, resumed.trades)
+            self.assertEqual((resumed.current_balance, resumed.trades), (tb.current_balance, tb.trades))
+            np.testing.assert_array_equal(resumed.net_wealths.values, tb.net_wealths.values)
+            np.testing.assert_array_equal(resumed.ledger.records, tb.ledger.records)
+
+        class RecordingBacktester(TBBacktesterRM):
+            def save_checkpoint(self, path, bar):
+                saved.append(bar)
+                super().save_checkpoint(path, bar)
+
+        # 이벤트 모드도 이벤트 사이의 긴 구간에서 every 봉마다 저장하고, 결과는 같다.
+        saved = []
+        recorded = RecordingBacktester(env, LinearModel(), 10000, 1.0, 0.001)
+        with contextlib.redirect_stdout(io.StringIO()):
+            recorded.backtest_strategy(sl=0.01, tsl=0.02, tp=0.015, wait=3, mode="event",
+                                       checkpoint=path, every=5)
+        self.assertTrue((np.diff([env.lags] + saved) <= 5).all())
+        self.assertEqual((recorded.current_balance, recorded.trades), (tb.current_balance, tb.trades))
+        np.testing.assert_array_equal(recorded.net_wealths.values, tb.net_wealths.values)
+
+    @unittest.skipUnless(importlib.util.find_spec("tensorflow"), "TensorFlow is not installed")
+    def test_dql_checkpoint(self):
+        import io
+        import os
+        import tempfile
+        import contextlib
+        import numpy as np
+        from Finance_environment import Finance
+        from Q_learningAgent import TradingBot, set_seeds
+
+        class Interrupted(Exception):
+            pass
+
+        class StoppingBot(TradingBot):
+            def save_checkpoint(self, path, episode, episodes, every=10):
+                super().save_checkpoint(path, episode, episodes, every)
+                if episode == 2:
+                    raise Interrupted
+
+        def make(cls):
+            set_seeds(100)
+            learn_env = Finance("EUR=", ["r", "s"], window=10, lags=3, end=600)
+            valid_env = Finance("EUR=", ["r", "s"], window=10, lags=3, start=600, end=800,
+                                mu=learn_env.mu, std=learn_env.std)
+            return cls(16, 0.001, learn_env, valid_env, dropout=True)
+
+        tmp = tempfile.mkdtemp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent = make(TradingBot)
+            agent.learn(4, checkpoint=os.path.join(tmp, "full.pkl"), every=2)
+            stopped = make(StoppingBot)
+            with self.assertRaises(Interrupted):
+                stopped.learn(4, checkpoint=os.path.join(tmp, "part.pkl"), every=2)
+            resumed = make(TradingBot)
+            resumed.resume(os.path.join(tmp, "part.pkl"))
+        # 중단한 뒤 이어 간 학습은 (드롭아웃을 써도) 중단 없는 학습과 같다.
+        self.assertEqual(resumed.trewards, agent.trewards)
+        self.assertEqual(resumed.performances, agent.performances)
+        self.assertEqual(resumed.vperformances, agent.vperformances)
+        self.assertEqual(resumed.epsilon, agent.epsilon)
+        for a, b in zip(resumed.model.get_weights(), agent.model.get_weights()):
+            np.testing.assert_array_equal(a, b)
+
+    def test_live_runner(self):
+        import io
+        import asyncio
+        import contextlib
+        import numpy as np
+        from BacktestBase import BacktestLongShort
+        from live_runner import ReplayServer, LiveRunner, SMAStrategy, socket_feed, load_series
+        with contextlib.redirect_stdout(io.StringIO()):
+            bt = BacktestLongShort("AAPL.O", "2010-1-1", "2019-12-31", 10000, 10.0, 0.01,
+                                   verbose=False, engine="numpy")
+            bt.run_sma_strategy(42, 252)
+
+        async def replay():
+            # BacktestBase가 버리는 첫 행까지 같은 구간의 종가를 그대로 재생한다.
+            async with ReplayServer(load_series("AAPL.O", "2010-1-1", "2019-12-31")) as server:
+                runner = LiveRunner(SMAStrategy(42, 252), 10000, 10.0, 0.01)
+                await runner.run(socket_feed(server.host, server.port))
+            return runner
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner = asyncio.run(replay())
+        print(runner.latency_stats())
+        # 소켓으로 재생한 봉에 대한 주문은 미리 읽은 데이터로 실행한 백테스트와 같다.
+        self.assertEqual((runner.amount, runner.trades), (bt.amount, bt.trades))
+        np.testing.assert_array_equal(runner.account.ledger.records, bt.ledger.records)
+        self.assertEqual(runner.latency_stats()["bars"], len(bt.data))
+        self.assertTrue(runner.net_wealths.index.equals(bt.data.index))
+
+    def test_model_strategy(self):
+        import io
+        import asyncio
+        import contextlib
+        import numpy as np
+        from Finance_environment import Finance
+        from TBBacktesterRM import TBBacktesterRM
+        from live_runner import LiveRunner, ModelStrategy, replay_feed
+
+        class LinearModel(object):
+            def predict(self, x):
+                return np.tanh(x) @ np.array([[0., 0.], [-1., 1.], [0., 0.], [0., 0.]])
+
+        env = Finance("EUR=", ["r", "s", "m", "v"], window=20, lags=3)
+        tb = TBBacktesterRM(env, LinearModel(), 10000, 1.0, 0.001)
+        with contextlib.redirect_stdout(io.StringIO()) as offline:
+            tb.backtest_strategy(sl=0.01, tsl=0.02, tp=0.015, wait=3)
+        strategy = ModelStrategy(LinearModel(), env, sl=0.01, tsl=0.02, tp=0.015, wait=3)
+        runner = LiveRunner(strategy, 10000, 1.0, 0.001)
+        with contextlib.redirect_stdout(io.StringIO()) as live:
+            asyncio.run(runner.run(replay_feed(env.raw[env.symbol].iloc[env.start:])))
+        print(runner.latency_stats())
+        # 스트리밍 봉에도 TBBacktesterRM의 손절, 추적 손절, 이익 실현, 대기 규칙이 같게 적용된다.
+        self.assertEqual((runner.amount, runner.trades), (tb.current_balance, tb.trades))
+        np.testing.assert_array_equal(runner.account.ledger.records, tb.ledger.records)
+        np.testing.assert_array_equal(runner.net_wealths["net_wealth"].values[env.lags:],
+                                      tb.net_wealths["net_wealth"].values)
+        self.assertEqual(live.getvalue(), offline.getvalue())
+
+    def test_profiler(self):
+        import io
+        import os
+        import json
+        import tempfile
+        import contextlib
+        import numpy as np
+        from Finance_environment import Finance
+        from TBBacktesterRM import TBBacktesterRM
+        from profiler import Profiler, percentile, BUCKETS
+
+        class LinearModel(object):
+            def predict(self, x):
+                return np.tanh(x) @ np.array([[0., 0.], [-1., 1.], [0., 0.], [0., 0.]])
+
+        env = Finance("EUR=", ["r", "s", "m", "v"], window=20, lags=3)
+        tb = TBBacktesterRM(env, LinearModel(), 10000, 1.0, 0.001)
+        profiler = Profiler()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with profiler.attach(tb):
+                tb.backtest_strategy(sl=0.01, tsl=0.02, tp=0.015, wait=3)
+        report = profiler.to_frame()
+        print(report)
+        self.assertEqual(report.loc["step", "calls"], len(env.data) - env.lags)
+        self.assertEqual(report.loc["model.predict", "calls"], 1)
+        self.assertAlmostEqual(report["share"].sum(), 1.)
+        # 프로파일러를 뗀 뒤에는 인스턴스에 래퍼가 남지 않는다.
+        self.assertNotIn("_step", vars(tb))
+        self.assertNotIn("predict", vars(tb.model))
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        profiler.save_trace(path)
+        with open(path) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len(events), report["calls"].sum())
+        print(profiler.histogram())
+        # 호출별 시간을 남기지 않고 히스토그램 구간에서 구한 백분위수는 두 배 안쪽의 근삿값이다.
+        durations = np.random.default_rng(0).lognormal(8., 1., 10000).astype(np.int64)
+        hist = np.bincount([int(d).bit_length() for d in durations], minlength=BUCKETS)
+        approx = percentile(hist, [50, 99], durations.max())
+        exact = np.percentile(durations, [50, 99])
+        self.assertTrue(np.all((approx >= exact / 2) & (approx <= exact * 2)))
+
 
 if __name__ == '__main__':
     unittest.main()
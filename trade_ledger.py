@@ -0,0 +1,127 @@
+# 이벤트 기반 백테스트의 거래 기록 (NumPy 구조화 배열)과 버퍼를 둔 콘솔 출력
+import sys
+import numpy as np
+import pandas as pd
+
+BUY, SELL, CLOSE = 1, -1, 0
+SIDES = {BUY: "buy", SELL: "sell", CLOSE: "close"}
+
+LEDGER_DTYPE = np.dtype([("bar", np.int64), ("side", np.int8), ("units", np.int64),
+                         ("price", np.float64), ("cost", np.float64),
+                         ("balance", np.float64), ("net_wealth", np.float64)])
+
+
+class TradeLedger(object):
+    """
+    거래 (매수, 매도, 청산) 한 번마다 한 행을 미리 할당한 구조화 배열에 쓴다.
+    자리가 모자라면 두 배로 늘리므로 행 추가 비용은 분할 상환 O(1)이다.
+    백테스터는 trades를 하나 늘릴 때마다 한 행을 남기므로 len(ledger) == trades다.
+
+    속성
+    capacity: int
+        처음에 할당할 행 수
+    records: np.ndarray
+        지금까지 쓴 행 (LEDGER_DTYPE 구조화 배열의 뷰)
+
+    메서드
+    =======
+    append:
+        거래 한 건을 기록한다.
+    reset:
+        기록을 비운다 (할당한 배열은 다시 쓴다).
+    to_frame:
+        기록을 데이터프레임으로 반환한다.
+    save:
+        기록을 .npy 이진 파일로 저장한다.
+    load:
+        save로 저장한 파일을 읽어 TradeLedger를 만든다.
+    from_records:
+        구조화 배열로 TradeLedger를 만든다.
+    """
+
+    def __init__(self, capacity=256):
+        self._records = np.zeros(capacity, dtype=LEDGER_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def records(self):
+        return self._records[:self._size]
+
+    def reset(self):
+        self._size = 0
+
+    def append(self, bar, side, units, price, cost, balance, net_wealth):
+        """
+        :param side: int
+            BUY, SELL, CLOSE
+        :param cost: float
+            이 거래에 든 거래 비용 (고정 + 비례)
+        :param balance: float
+            거래 뒤 잔고
+        :param net_wealth: float
+            거래 뒤 순자산 (잔고 + 보유 단위 * 가격)
+        """
+        if self._size == len(self._records):
+            self._records = np.resize(self._records, 2 * len(self._records))
+        self._records[self._size] = (bar, side, units, price, cost, balance, net_wealth)
+        self._size += 1
+
+    def to_frame(self, dates=None):
+        """
+        :param dates: pd.Index
+            봉 번호에 대응하는 날짜 (주면 거래가 난 봉의 날짜를 인덱스로 쓴다)
+        :return: pd.DataFrame
+            bar, side ('buy', 'sell', 'close'), units, price, cost, balance, net_wealth 열
+        """
+        frame = pd.DataFrame(self.records)
+        frame["side"] = frame["side"].map(SIDES)
+        if dates is not None:
+            frame.index = pd.Index(dates[frame["bar"].values], name="date")
+        return frame
+
+    def save(self, path):
+        np.save(path, self.records)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_records(np.load(path))
+
+    @classmethod
+    def from_records(cls, records):
+        """records (LEDGER_DTYPE 구조화 배열)를 복사해서 TradeLedger를 만든다."""
+        ledger = cls(max(1, len(records)))
+        ledger._records[:len(records)] = records
+        ledger._size = len(records)
+        return ledger
+
+
+class ConsoleSink(object):
+    """
+    백테스트의 콘솔 출력을 줄 단위로 모아 두었다가 한 번에 쓴다.
+    백테스터는 close_out이 끝날 때 flush 하고, buffer_lines 줄이 쌓이면 그 전에도 쓴다.
+
+    속성
+    stream: file
+        출력할 스트림 (None이면 쓰는 시점의 sys.stdout)
+    buffer_lines: int
+        이만큼 쌓이면 flush 한다.
+    """
+
+    def __init__(self, stream=None, buffer_lines=1000):
+        self.stream = stream
+        self.buffer_lines = buffer_lines
+        self._lines = []
+
+    def write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("\n".join(self._lines) + "\n")
+            self._lines = []